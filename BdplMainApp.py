@@ -3,6 +3,8 @@
 import chardet
 from collections import OrderedDict
 from collections import Counter
+from collections import deque
+import concurrent.futures
 import csv
 import datetime
 import errno
@@ -16,6 +18,7 @@ import os
 import paramiko
 import pickle
 import psutil
+import queue
 import re
 import shelve
 import shutil
@@ -23,11 +26,13 @@ import sqlite3
 import stat
 import subprocess
 import sys
+import threading
 import time
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
+from tkinter.scrolledtext import ScrolledText
 from urllib.parse import unquote
 import urllib.request
 import uuid
@@ -38,7 +43,7 @@ import zipfile
 import Objects
 
 #BDPL files
-from BdplObjects import Unit, Shipment, DigitalObject, Spreadsheet, MasterSpreadsheet, ManualPremisEvent, RipstationBatch, SdaBatchDeposit, McoBatchDeposit
+from BdplObjects import Unit, Shipment, DigitalObject, Spreadsheet, MasterSpreadsheet, ManualPremisEvent, RipstationBatch, SdaBatchDeposit, McoBatchDeposit, FixityVerifier, WorkbookSession, JobCancelled
 
 #set up as controller
 class BdplMainApp(tk.Tk):
@@ -67,6 +72,15 @@ class BdplMainApp(tk.Tk):
         
         self.checked_servers = {'bdpl_workspace' : False, 'bdpl_archiver' : False}
         
+        #number of processes used to calculate checksums; leave a core free for the GUI and other tools
+        self.fixity_workers = max(1, (os.cpu_count() or 2) - 1)
+        
+        #RipStation batches: discs replicated at once (each uses the drive/ffmpeg) and discs analyzed at once (each shares out the cores)
+        self.ripstation_workers = {'replicate' : 2, 'analyze' : 2}
+        
+        #long-running operations are run as background jobs so the interface stays responsive
+        self.jobs = JobRunner(self)
+        
         #variables entered into BDPL interface
         self.job_type = tk.StringVar()
         self.path_to_content = tk.StringVar()
@@ -126,10 +140,14 @@ class BdplMainApp(tk.Tk):
         self.menubar.add_cascade(menu=self.actions_, label='Other actions')
         self.actions_.add_command(label='Check shipment status', command=self.shipment_status)
         self.actions_.add_separator()
+        self.actions_.add_command(label='View jobs', command=lambda: JobsWindow(self))
+        self.actions_.add_separator()
         self.actions_.add_command(label='Move media images', command=self.media_images)
         self.actions_.add_separator()
         self.actions_.add_command(label='Add Manual PREMIS event', command= lambda: ManualPremisEvent(self))
         self.actions_.add_separator()
+        self.actions_.add_command(label='Verify fixity (unit)', command=self.verify_fixity)
+        self.actions_.add_separator()
         
         self.connect=tk.Menu(self.actions_)
         self.actions_.add_cascade(menu=self.connect, label = 'Connect to server...')
@@ -141,10 +159,27 @@ class BdplMainApp(tk.Tk):
         
         self.help_ = tk.Menu(self.menubar)
         self.menubar.add_cascade(menu=self.help_, label='Help')
-        self.help_.add_command(label='Open BDPL wiki', command = lambda: webbrowser.open_new(r"https://wiki.dlib.indiana.edu/display/DIGIPRES/Born+Digital+Preservation+Lab"))
+        self.help_.add_command(label='Open BDPL wiki', command = lambda: webbrowser.open_new(r"https://wiki.dlib.indiana.edu/display/DIGIPRES/Born+Digital+Preservation+Lab"))
 
     def get_current_tab(self):
+        #jobs see the tab they were started from, even if the technician has moved on to another one
+        job = self.jobs.current_job()
+        if job is not None:
+            return job.tab
+        
         return self.bdpl_notebook.tab(self.bdpl_notebook.select(), 'text')
+    
+    def checkpoint(self):
+        #called by long-running operations at safe stopping points; raises JobCancelled if the current job has been cancelled
+        self.jobs.checkpoint()
+    
+    def job_thread(self, func):
+        #wrap a function handed to a thread pool so that it still counts as part of the current job
+        return self.jobs.helper(func)
+    
+    def alert(self, title, message, kind='warning'):
+        #use instead of messagebox in anything that may run as a job: Tk dialogs can only be opened from the main thread
+        self.jobs.alert(title, message, kind)
         
     def update_scripts(self):
         restart = messagebox.askyesno(title='Update BDPL Scripts', message='Updating scripts will close the BDPL app.  Continue?')
@@ -173,7 +208,7 @@ class BdplMainApp(tk.Tk):
         
         self.clear_gui()
         
-    def check_main_vars(self):
+    def check_main_vars(self):
         if self.unit_name.get() == '':
             return (False, '\n\nERROR: please make sure you have entered a unit ID abbreviation.')
         else:
@@ -254,6 +289,15 @@ class BdplMainApp(tk.Tk):
         current_unit = Unit(self)  
         current_unit.move_media_images()
         
+    def verify_fixity(self):
+        #sweeps can run for hours, so they are run as a background job
+        if self.unit_name.get() == '' or not os.path.exists(os.path.join(self.bdpl_work_dir, self.unit_name.get())):
+            messagebox.showwarning(title='WARNING', message='Enter a valid unit ID abbreviation before verifying fixity.', master=self)
+            return
+        
+        verifier = FixityVerifier(self)
+        self.jobs.submit('Fixity check: {}'.format(verifier.unit_name), verifier.run)
+        
     def add_manual_premis_event(self): 
         #make sure main variables--unit_name, shipment_date, and barcode--are included.  Return if either is missing
         status, msg = self.check_main_vars()
@@ -338,6 +382,263 @@ class BdplMainApp(tk.Tk):
         with open(list_name, 'a') as f:
             f.write('%s\n' % message)
 
+class Job:
+    """One queued operation and its history: status, timings and the output it printed"""
+    def __init__(self, job_id, name, tab, func, args):
+        self.job_id = job_id
+        self.name = name
+        self.tab = tab
+        self.func = func
+        self.args = args
+        self.status = 'Queued'
+        self.queued = datetime.datetime.now()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.log = deque(maxlen=5000)
+    
+    def duration(self):
+        if self.started is None:
+            return ''
+        return str((self.finished or datetime.datetime.now()) - self.started).split('.')[0]
+
+class JobStdout:
+    """Stand-in for sys.stdout: output still goes to the console, and anything printed by a job is also queued for the jobs window"""
+    def __init__(self, runner, stream):
+        self.runner = runner
+        self.stream = stream
+    
+    def write(self, text):
+        job = self.runner.current_job()
+        if job is not None and text:
+            self.runner.log_queue.put((job, text))
+        return self.stream.write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class JobRunner:
+    """Runs jobs one after another on a worker thread. Output and status changes are passed back through a queue that the Tk main loop polls with after(), 
+    so the interface stays responsive (and the technician can queue up the next item) while a job runs. Cancelling takes effect at the job's next checkpoint."""
+    def __init__(self, controller, poll_ms=100):
+        self.controller = controller
+        self.poll_ms = poll_ms
+        self.jobs = []
+        self.job_queue = queue.Queue()
+        self.log_queue = queue.Queue()
+        self.alert_queue = queue.Queue()
+        self.listeners = []
+        self.running = None
+        
+        #pool threads working on behalf of the running job; see helper()
+        self.helpers = set()
+        
+        sys.stdout = JobStdout(self, sys.stdout)
+        
+        self.worker = threading.Thread(target=self.work, name='bdpl-jobs', daemon=True)
+        self.worker.start()
+        
+        self.controller.after(self.poll_ms, self.poll)
+    
+    def submit(self, name, func, *args):
+        """Queue func(*args) as a job; call from the main thread"""
+        job = Job(len(self.jobs) + 1, name, self.controller.get_current_tab(), func, args)
+        self.jobs.append(job)
+        self.job_queue.put(job)
+        
+        if self.running is not None or self.job_queue.qsize() > 1:
+            print('\n\nQueued job #{}: {}'.format(job.job_id, name))
+        
+        self.notify(job)
+        return job
+    
+    def current_job(self):
+        #the job running on this thread (or on a pool thread working for it), if any
+        if threading.current_thread() is self.worker or threading.get_ident() in self.helpers:
+            return self.running
+    
+    def helper(self, func):
+        """Wrap func so that, run on another thread, its output, cancellation checkpoints and tab are those of the job that submitted it"""
+        if self.current_job() is None:
+            return func
+        
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            self.helpers.add(ident)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.helpers.discard(ident)
+        
+        return run
+    
+    def alert(self, title, message, kind='warning'):
+        """Show a dialog to the technician; from a job, the message goes to the job log and the dialog is shown by poll() on the main thread"""
+        job = self.current_job()
+        if job is None:
+            getattr(messagebox, 'show' + kind)(title=title, message=message, master=self.controller)
+            return
+        
+        print('\n\n{}: {}'.format(title.upper(), message))
+        self.alert_queue.put((job, title, message, kind))
+    
+    def checkpoint(self):
+        job = self.current_job()
+        if job is not None and job.cancel_event.is_set():
+            raise JobCancelled(job.name)
+    
+    def cancel(self, job):
+        if job.status in ['Queued', 'Running']:
+            job.cancel_event.set()
+            if job.status == 'Queued':
+                job.status = 'Cancelled'
+            else:
+                job.status = 'Cancelling'
+            self.notify(job)
+    
+    def work(self):
+        while True:
+            job = self.job_queue.get()
+            if job.cancel_event.is_set():
+                continue
+            
+            self.running = job
+            job.started = datetime.datetime.now()
+            job.status = 'Running'
+            self.notify(job)
+            
+            try:
+                job.func(*job.args)
+                job.status = 'Completed'
+            except JobCancelled:
+                print('\n\nJob #{} cancelled: {}'.format(job.job_id, job.name))
+                job.status = 'Cancelled'
+            except Exception as e:
+                print('\n\nJob #{} failed: {}\n\t{}'.format(job.job_id, job.name, e))
+                job.status = 'Failed'
+            finally:
+                job.finished = datetime.datetime.now()
+                self.running = None
+                self.notify(job)
+    
+    def notify(self, job):
+        #status change; picked up by poll() on the main thread
+        self.log_queue.put((job, None))
+    
+    def poll(self):
+        changed = set()
+        while True:
+            try:
+                job, text = self.log_queue.get(block=False)
+            except queue.Empty:
+                break
+            if text is not None:
+                job.log.append(text)
+            changed.add(job)
+        
+        for listener in list(self.listeners):
+            for job in changed:
+                listener(job)
+        
+        self.controller.after(self.poll_ms, self.poll)
+        
+        #dialogs from jobs; shown after the next poll is scheduled so job output keeps coming while one is open
+        while True:
+            try:
+                job, title, message, kind = self.alert_queue.get(block=False)
+            except queue.Empty:
+                break
+            getattr(messagebox, 'show' + kind)(title=title, message='{}\n\n(Job #{}: {})'.format(message, job.job_id, job.name), master=self.controller)
+
+class JobsWindow(tk.Toplevel):
+    def __init__(self, controller):
+        tk.Toplevel.__init__(self, controller)
+        self.title('BDPL Ingest: Jobs')
+        self.iconbitmap(r'C:/BDPL/scripts/favicon.ico')
+        self.protocol('WM_DELETE_WINDOW', self.close_top)
+        
+        self.controller = controller
+        self.runner = self.controller.jobs
+        self.shown = {}
+        
+        tab_frames_list = [('jobs_frame', 'Jobs:'), ('log_frame', 'Output from selected job:'), ('button_frame', 'Actions:')]
+        
+        self.tab_frames_dict = {}
+        
+        for name_, label_ in tab_frames_list:
+            f = tk.LabelFrame(self, text = label_)
+            f.pack(fill=tk.BOTH, expand=True, pady=5)
+            self.tab_frames_dict[name_] = f
+        
+        columns = {'name' : ('Job', 300), 'status' : ('Status', 100), 'queued' : ('Queued', 150), 'duration' : ('Duration', 100)}
+        self.job_tree = ttk.Treeview(self.tab_frames_dict['jobs_frame'], columns=list(columns.keys()), show='headings', height=8)
+        for col, (heading, width) in columns.items():
+            self.job_tree.heading(col, text=heading)
+            self.job_tree.column(col, width=width)
+        self.job_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.job_tree.bind('<<TreeviewSelect>>', self.show_log)
+        
+        self.log_text = ScrolledText(self.tab_frames_dict['log_frame'], state='disabled', height=15, font='TkFixedFont')
+        self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        tk.Button(self.tab_frames_dict['button_frame'], text='Cancel Job', bg='light slate gray', command=self.cancel_job).grid(row=0, column=0, padx=20, pady=10, sticky='nsew')
+        tk.Button(self.tab_frames_dict['button_frame'], text='Close', bg='light slate gray', command=self.close_top).grid(row=0, column=1, padx=20, pady=10, sticky='nsew')
+        
+        for job in self.runner.jobs:
+            self.update_job(job)
+        
+        self.runner.listeners.append(self.update_job)
+    
+    def selected_job(self):
+        selection = self.job_tree.selection()
+        if selection:
+            return self.runner.jobs[int(selection[0]) - 1]
+    
+    def update_job(self, job):
+        values = ('#{} {}'.format(job.job_id, job.name), job.status, job.queued.strftime('%Y-%m-%d %H:%M:%S'), job.duration())
+        
+        if self.job_tree.exists(str(job.job_id)):
+            self.job_tree.item(str(job.job_id), values=values)
+        else:
+            self.job_tree.insert('', 0, iid=str(job.job_id), values=values)
+        
+        #add new output for the job on display
+        if job is self.selected_job():
+            self.show_log()
+    
+    def show_log(self, event=None):
+        job = self.selected_job()
+        if job is None:
+            return
+        
+        lines = list(job.log)
+        
+        self.log_text.configure(state='normal')
+        if self.shown.get('job') is not job or self.shown.get('count', 0) > len(lines):
+            self.log_text.delete(1.0, tk.END)
+            self.shown = {'job' : job, 'count' : 0}
+        self.log_text.insert(tk.END, ''.join(lines[self.shown['count']:]))
+        self.shown['count'] = len(lines)
+        self.log_text.configure(state='disabled')
+        self.log_text.yview(tk.END)
+    
+    def cancel_job(self):
+        job = self.selected_job()
+        if job is None:
+            messagebox.showwarning(title='WARNING', message='Select a job to cancel.', master=self)
+            return
+        
+        if messagebox.askyesno(title='Cancel Job', message='Cancel {}?  Running jobs stop at their next checkpoint.'.format(job.name), master=self):
+            self.runner.cancel(job)
+    
+    def close_top(self):
+        if self.update_job in self.runner.listeners:
+            self.runner.listeners.remove(self.update_job)
+        self.destroy()
+
 class ServerConnect(tk.Toplevel):
     def __init__(self, controller, servername=None):
         tk.Toplevel.__init__(self, controller)
@@ -524,6 +825,149 @@ class McoSftpClient:
             print('\n\nError; SFTP client not created.')
             return
     
+    def transfer_pool(self, sessions=4):
+        #pool of additional SFTP sessions for moving batches of files; uses the same credentials as this client
+        return McoTransferPool(self.host, self.port, self.username, self.password, sessions)
+
+class McoTransferPool:
+    """Uploads files to the MCO dropbox over several SFTP sessions at once (one per worker thread), with large channel windows and pipelined writes. 
+    Remote folders that have been created or found are cached; files that are already partly on the server are resumed from their remote size; each upload is checked against the local md5."""
+    
+    window_size = 64 * 1024 * 1024
+    max_packet_size = 32768
+    block_size = 1024 * 1024
+    
+    def __init__(self, host, port, username, password, sessions=4, verify=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sessions = sessions
+        self.verify = verify
+        
+        self.local = threading.local()
+        self.clients = []
+        self.remote_dirs = set()
+        self.lock = threading.Lock()
+    
+    def connect(self):
+        #each worker thread gets its own transport; channels on one transport share a single connection and cipher stream
+        if getattr(self.local, 'sftp', None) is None:
+            transport = paramiko.Transport((self.host, self.port), default_window_size=self.window_size, default_max_packet_size=self.max_packet_size)
+            transport.connect(None, self.username, self.password)
+            self.local.sftp = paramiko.SFTPClient.from_transport(transport, window_size=self.window_size, max_packet_size=self.max_packet_size)
+            
+            with self.lock:
+                self.clients.append((self.local.sftp, transport))
+                
+        return self.local.sftp
+    
+    def make_dirs(self, sftp, remote_dir):
+        #collect any parent folders we haven't already seen, then create them top-down
+        dirs_ = []
+        while len(remote_dir) > 1 and not remote_dir in self.remote_dirs:
+            dirs_.append(remote_dir)
+            remote_dir = os.path.dirname(remote_dir)
+            
+        while len(dirs_):
+            remote_dir = dirs_.pop()
+            try:
+                sftp.stat(remote_dir)
+            except IOError:
+                try:
+                    sftp.mkdir(remote_dir)
+                except IOError:
+                    #another session may have just created it
+                    sftp.stat(remote_dir)
+            
+            with self.lock:
+                self.remote_dirs.add(remote_dir)
+    
+    def remote_md5(self, sftp, remote_file):
+        #use the server's check-file extension if it has one; otherwise read the file back
+        with sftp.open(remote_file, 'rb') as f:
+            try:
+                return f.check('md5').hex()
+            except IOError:
+                pass
+            
+            f.prefetch()
+            md5 = hashlib.md5()
+            for chunk in iter(lambda: f.read(self.block_size), b''):
+                md5.update(chunk)
+            return md5.hexdigest()
+    
+    def upload(self, local_file, remote_file):
+        """Copy one file; returns (status, msg)"""
+        try:
+            sftp = self.connect()
+            self.make_dirs(sftp, os.path.dirname(remote_file))
+            
+            local_size = os.path.getsize(local_file)
+            
+            #see if a previous attempt left part of the file on the server
+            try:
+                offset = sftp.stat(remote_file).st_size
+            except IOError:
+                offset = 0
+            if offset > local_size:
+                offset = 0
+            
+            md5 = hashlib.md5()
+            with open(local_file, 'rb') as inf:
+                
+                #hash what is already there, then send the rest
+                while inf.tell() < offset:
+                    md5.update(inf.read(min(self.block_size, offset - inf.tell())))
+                
+                if offset < local_size:
+                    with sftp.open(remote_file, 'r+b' if offset else 'wb') as outf:
+                        outf.seek(offset)
+                        outf.set_pipelined(True)
+                        for chunk in iter(lambda: inf.read(self.block_size), b''):
+                            md5.update(chunk)
+                            outf.write(chunk)
+            
+            remote_size = sftp.stat(remote_file).st_size
+            if remote_size != local_size:
+                return (False, 'size mismatch: {} bytes local, {} bytes remote'.format(local_size, remote_size))
+            
+            if self.verify and self.remote_md5(sftp, remote_file) != md5.hexdigest():
+                #don't resume from a bad copy next time
+                sftp.remove(remote_file)
+                return (False, 'checksum mismatch')
+            
+            if offset:
+                return (True, 'resumed at {} bytes'.format(offset))
+            else:
+                return (True, '')
+            
+        except (IOError, OSError, paramiko.SSHException) as e:
+            #drop this thread's session in case the connection is gone
+            self.local.sftp = None
+            return (False, str(e))
+    
+    def upload_all(self, transfers):
+        """Upload a list of (local_file, remote_file) pairs; yields (local_file, status, msg) as each finishes"""
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.sessions)
+        try:
+            futures = {executor.submit(self.upload, local_file, remote_file) : local_file for local_file, remote_file in transfers}
+            for future in concurrent.futures.as_completed(futures):
+                status, msg = future.result()
+                yield futures[future], status, msg
+        finally:
+            #if the caller stops early (e.g., the job was cancelled), drop the uploads that haven't started; partial files are resumed next time
+            executor.shutdown(cancel_futures=True)
+    
+    def close(self):
+        for sftp, transport in self.clients:
+            try:
+                sftp.close()
+                transport.close()
+            except (EOFError, OSError, paramiko.SSHException):
+                pass
+        self.clients = []
+
 
 class BdplIngest(tk.Frame):
     def __init__(self, parent, controller):
@@ -743,7 +1187,7 @@ class BdplIngest(tk.Frame):
             messagebox.showwarning(title='WARNING', message=msg, master=self)
             return
         
-        current_item.run_item_transfer()
+        self.controller.jobs.submit('Transfer: {}'.format(current_item.identifier), current_item.run_item_transfer)
     
     def launch_analysis(self):
         
@@ -759,7 +1203,7 @@ class BdplIngest(tk.Frame):
             return
             
         #run analysis on item
-        current_item.run_item_analysis()
+        self.controller.jobs.submit('Analysis: {}'.format(current_item.identifier), current_item.run_item_analysis)
     
     def write_technician_note(self):
         
@@ -926,7 +1370,12 @@ class RipstationIngest(tk.Frame):
         current_batch = RipstationBatch(self.controller)
         current_batch.set_up()
         
-        current_batch.ripstation_batch_ingest()
+        self.controller.jobs.submit('RipStation batch: {} {}'.format(current_batch.unit_name, current_batch.shipment_date), self.run_ripstation_batch, current_batch)
+    
+    def run_ripstation_batch(self, current_batch):
+        #hold back spreadsheet saves until the batch is done
+        with WorkbookSession.batch():
+            current_batch.ripstation_batch_ingest()
 
 class SdaDeposit(tk.Frame):
     def __init__(self, parent, controller):
@@ -1043,8 +1492,12 @@ class SdaDeposit(tk.Frame):
         if not status:
             messagebox.showwarning(title='WARNING', message=msg, master=self)
             return
-            
-        current_sda_batch.deposit_barcodes_to_sda()
+        
+        self.controller.jobs.submit('SDA deposit: {} {}'.format(current_sda_batch.unit_name, current_sda_batch.shipment_date), self.run_sda_deposit, current_sda_batch)
+    
+    def run_sda_deposit(self, current_sda_batch):
+        with WorkbookSession.batch():
+            current_sda_batch.deposit_barcodes_to_sda()
 
 class McoDeposit(tk.Frame):
     def __init__(self, parent, controller):
@@ -1218,8 +1671,12 @@ class McoDeposit(tk.Frame):
         #create batch object
         mco_batch = McoBatchDeposit(self.controller)
         
-        #prep batches of content for MCO
-        mco_batch.prep_batches_for_mco()
+        self.controller.jobs.submit('MCO prep: {} {}'.format(mco_batch.unit_name, mco_batch.shipment_date), self.run_mco_prep, mco_batch)
+    
+    def run_mco_prep(self, mco_batch):
+        #prep batches of content for MCO; manifest rows are saved in batches
+        with WorkbookSession.batch():
+            mco_batch.prep_batches_for_mco()
         
     def move_to_mco_dropbox(self):
         
@@ -1246,6 +1703,13 @@ class McoDeposit(tk.Frame):
         mco_batch.select_batch_for_mco(self.mco_destination, self.mco_client)
     
 def close_app(window):
+    #check before killing a job that is still running
+    if getattr(window, 'jobs', None) and window.jobs.running is not None:
+        if not messagebox.askyesno(title='Job Running', message='{} is still running.  Close the BDPL app anyway?'.format(window.jobs.running.name), master=window):
+            return
+    
+    #save any spreadsheet rows held back by a batch
+    WorkbookSession.flush_all()
     window.destroy()
     sys.exit(0)
 
@@ -1293,6 +1757,13 @@ def update_software():
         open(update_completed, 'w').close()
     
 def close_app(window):
+    #check before killing a job that is still running
+    if getattr(window, 'jobs', None) and window.jobs.running is not None:
+        if not messagebox.askyesno(title='Job Running', message='{} is still running.  Close the BDPL app anyway?'.format(window.jobs.running.name), master=window):
+            return
+    
+    #save any spreadsheet rows held back by a batch
+    WorkbookSession.flush_all()
     window.destroy()
     sys.exit(0)
 
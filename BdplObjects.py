@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
 
+import array
 import bagit
 import chardet
 from collections import OrderedDict
 from collections import Counter
+from collections import deque
+import concurrent.futures
+import contextlib
 import csv
 import datetime
+import dbm
 import errno
 import fnmatch
 import glob
 import hashlib
+import io
+import itertools
+import json
 from lxml import etree
 import math
+import multiprocessing
 import openpyxl
 import os
 import pickle
@@ -23,6 +32,8 @@ import sqlite3
 import subprocess
 import sys
 import tarfile
+import tempfile
+import threading
 import time
 import tkinter as tk
 from tkinter import ttk
@@ -34,8 +45,2119 @@ import uuid
 import webbrowser
 import zipfile
 
-# from dfxml project
-import Objects
+# DFXML helpers: tsk_loaddb fallback for fiwalk; sorted scandir walk
+import dfxml_from_tskloaddb
+import walk_to_dfxml
+
+'''FIXITY'''
+#algorithms calculated for each file; md5 is still the value written to DFXML and reports
+FIXITY_ALGORITHMS = ('md5', 'sha1', 'sha256')
+FIXITY_BUFFER_SIZE = 1024 * 1024
+
+#disk images and SIP tars: files at least this big are read in large buffers, with each digest updated on its own thread (see hash_large_file)
+LARGE_FILE_THRESHOLD = 1024**3
+LARGE_FILE_BUFFER_SIZE = 16 * 1024**2
+TREE_HASH_CHUNK_SIZE = 256 * 1024**2
+
+#read buffer for the current process; allocated once per worker and reused for every file
+_fixity_buffer = None
+
+def fixity_worker_init(buffer_size=FIXITY_BUFFER_SIZE):
+    global _fixity_buffer
+    _fixity_buffer = bytearray(buffer_size)
+
+def hash_file(args):
+    """Stat a file once and calculate all requested checksums in a single read"""
+    file_target, algorithms = args
+
+    if _fixity_buffer is None:
+        fixity_worker_init()
+
+    buf = _fixity_buffer
+    view = memoryview(buf)
+    hashes = [hashlib.new(a) for a in algorithms]
+
+    with open(file_target, 'rb') as f:
+        #use the stat of the open file handle so size and times match the content we read
+        st = os.fstat(f.fileno())
+        
+        #large files are double-buffered (see hash_stream); small ones are read straight into the worker's buffer
+        if st.st_size >= LARGE_FILE_THRESHOLD:
+            hash_stream(f, hashes)
+        else:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                for h in hashes:
+                    h.update(view[:n])
+
+    file_dict = file_info(file_target, st)
+
+    for a, h in zip(algorithms, hashes):
+        file_dict[a] = h.hexdigest()
+
+    return file_dict
+
+def hash_stream(f, hashes, buffer_size=LARGE_FILE_BUFFER_SIZE):
+    """Read f to the end, updating each of hashes (hashlib objects, or anything with an update method such as TreeHash). 
+    Reads alternate between two large buffers: while each digest works through one buffer on its own thread (hashlib releases the GIL for large updates), the next read goes into the other."""
+    buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+    size = 0
+    pending = []
+    
+    with concurrent.futures.ThreadPoolExecutor(len(hashes)) as pool:
+        for i in itertools.count():
+            buf = buffers[i % 2]
+            n = f.readinto(buf)
+            
+            #the other buffer is free again once the digests are done with it
+            for future in pending:
+                future.result()
+            
+            if not n:
+                break
+            
+            view = memoryview(buf)[:n]
+            pending = [pool.submit(h.update, view) for h in hashes]
+            size += n
+    
+    return size
+
+def hash_large_file(file_target, algorithms=('md5',), tree_hash=False):
+    """Like hash_file, for a single very large file (disk image or SIP tar). If tree_hash is True, the file_dict includes a TreeHash under 'tree_hash'"""
+    hashes = [hashlib.new(a) for a in algorithms]
+    tree = TreeHash() if tree_hash else None
+    
+    with open(file_target, 'rb') as f:
+        st = os.fstat(f.fileno())
+        hash_stream(f, hashes + ([tree] if tree else []))
+    
+    file_dict = file_info(file_target, st)
+    for a, h in zip(algorithms, hashes):
+        file_dict[a] = h.hexdigest()
+    
+    if tree:
+        tree.finish()
+        file_dict['tree_hash'] = tree
+    
+    return file_dict
+
+def file_info(file_target, st):
+    """Basic file stats, plus the raw stat values used to key the hash cache"""
+    return { 'name' : file_target, 'size' : st.st_size, 'mtime' : datetime.datetime.fromtimestamp(st.st_mtime).isoformat(), 'ctime' : datetime.datetime.fromtimestamp(st.st_ctime).isoformat(), 'atime' : datetime.datetime.fromtimestamp(st.st_atime).isoformat()[:-7], 'stat_key' : (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns) }
+
+class TreeHash:
+    """md5 digests of each fixed-size chunk of a file, plus a top hash (the md5 of the chunk digests), saved in a JSON sidecar. 
+    Chunks can be checked independently, so a large file can be verified with several readers at once, and a failure shows which part of the file changed."""
+    suffix = '.treehash.json'
+    
+    def __init__(self, chunk_size=TREE_HASH_CHUNK_SIZE, chunks=None, size=0):
+        self.chunk_size = chunk_size
+        self.chunks = chunks or []
+        self.size = size
+        self.current = hashlib.md5()
+        self.chunk_fill = 0
+    
+    def update(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            n = min(len(view), self.chunk_size - self.chunk_fill)
+            self.current.update(view[:n])
+            self.chunk_fill += n
+            self.size += n
+            view = view[n:]
+            if self.chunk_fill == self.chunk_size:
+                self.chunks.append(self.current.hexdigest())
+                self.current = hashlib.md5()
+                self.chunk_fill = 0
+    
+    def finish(self):
+        #the last (partial) chunk; an empty file has a single empty chunk
+        if self.chunk_fill > 0 or len(self.chunks) == 0:
+            self.chunks.append(self.current.hexdigest())
+            self.current = hashlib.md5()
+            self.chunk_fill = 0
+        return self
+    
+    def top_hash(self):
+        return hashlib.md5(''.join(self.chunks).encode()).hexdigest()
+    
+    @classmethod
+    def sidecar(cls, file_target):
+        return '{}{}'.format(file_target, cls.suffix)
+    
+    def save(self, sidecar_file):
+        temp_file = '{}.tmp'.format(sidecar_file)
+        with open(temp_file, 'w') as f:
+            json.dump({'algorithm' : 'md5', 'chunk_size' : self.chunk_size, 'size' : self.size, 'top_hash' : self.top_hash(), 'chunks' : self.chunks}, f)
+        os.replace(temp_file, sidecar_file)
+    
+    @classmethod
+    def load(cls, sidecar_file):
+        """Return the TreeHash saved in sidecar_file, or None if there isn't a usable one"""
+        try:
+            with open(sidecar_file, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        tree = cls(saved['chunk_size'], saved['chunks'], saved['size'])
+        if tree.top_hash() != saved.get('top_hash'):
+            return None
+        return tree
+    
+    def check_chunk(self, file_target, index, throttle=None):
+        md5 = hashlib.md5()
+        remaining = min(self.chunk_size, self.size - index * self.chunk_size)
+        buf = bytearray(min(LARGE_FILE_BUFFER_SIZE, max(1, remaining)))
+        view = memoryview(buf)
+        with open(file_target, 'rb') as f:
+            f.seek(index * self.chunk_size)
+            while remaining > 0:
+                n = f.readinto(view[:min(len(buf), remaining)])
+                if not n:
+                    break
+                if throttle is not None:
+                    throttle.consume(n)
+                md5.update(view[:n])
+                remaining -= n
+        return md5.hexdigest() == self.chunks[index]
+    
+    def verify(self, file_target, workers=4, throttle=None):
+        """Check every chunk of file_target, several at a time (reads are paced by throttle, an IoThrottle, if given); returns (status, msg)"""
+        if os.path.getsize(file_target) != self.size:
+            return (False, 'size is {} bytes; expected {}'.format(os.path.getsize(file_target), self.size))
+        
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(lambda i: self.check_chunk(file_target, i, throttle), range(len(self.chunks))))
+        
+        failed = [i for i, ok in enumerate(results) if not ok]
+        if len(failed) > 0:
+            return (False, 'checksum mismatch in {} of {} chunk(s), starting at byte(s) {}'.format(len(failed), len(self.chunks), ', '.join(str(i * self.chunk_size) for i in failed[:10])))
+        
+        return (True, 'all {} chunk(s) match'.format(len(self.chunks)))
+
+class IoThrottle:
+    """Paces reads shared by several threads to an average of bytes_per_second, allowing up to burst seconds' worth after an idle spell. Used by fixity sweeps so they don't starve ingest work of disk and network bandwidth"""
+    def __init__(self, bytes_per_second, burst=1.0):
+        self.rate = bytes_per_second
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def consume(self, n):
+        #reserve a slot for n bytes, then wait (outside the lock) until it comes up
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now - self.burst) + n / self.rate
+            wait = self.next_time - now
+        if wait > 0:
+            time.sleep(wait)
+
+class ThrottledReader:
+    """Binary file wrapper whose reads are paced by an IoThrottle"""
+    def __init__(self, f, throttle):
+        self.f = f
+        self.throttle = throttle
+
+    def readinto(self, buf):
+        n = self.f.readinto(buf)
+        if n:
+            self.throttle.consume(n)
+        return n
+
+def verify_file(file_target, md5=None, tree=None, throttle=None, workers=4):
+    """Check a file against a recorded md5 or, if one is given, its TreeHash (faster for large files, as chunks are read in parallel); returns (status, msg)"""
+    if not md5 and tree is None:
+        return (False, 'no checksum recorded')
+
+    if not os.path.isfile(file_target):
+        return (False, 'file not found')
+
+    if tree is not None:
+        return tree.verify(file_target, workers, throttle)
+
+    md5_hash = hashlib.md5()
+    with open(file_target, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        reader = ThrottledReader(f, throttle) if throttle is not None else f
+
+        if size >= LARGE_FILE_THRESHOLD:
+            hash_stream(reader, [md5_hash])
+        else:
+            buf = bytearray(max(1, min(size, FIXITY_BUFFER_SIZE)))
+            view = memoryview(buf)
+            while True:
+                n = reader.readinto(buf)
+                if not n:
+                    break
+                md5_hash.update(view[:n])
+
+    if md5_hash.hexdigest() != md5.lower():
+        return (False, 'checksum mismatch: recorded {}; calculated {}'.format(md5.lower(), md5_hash.hexdigest()))
+
+    return (True, 'checksum matches')
+
+class HashCache:
+    """Persistent cache of file checksums shared across items and shipments. 
+    Entries are only used if the file's device, inode, size, mtime and path all match what was recorded."""
+    def __init__(self, db_file, max_age_days=180, max_entries=5000000):
+        self.db_file = db_file
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        
+        #workstations share the cache, so wait on locks rather than failing
+        self.conn = sqlite3.connect(self.db_file, timeout=60)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS hashes (path text primary key, dev integer, inode integer, size integer, mtime_ns integer, md5 text, sha1 text, sha256 text, last_used real)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_hashes_last_used ON hashes (last_used)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache_info (key text primary key, value real)")
+        self.conn.commit()
+        
+        #evict old entries at most once a day
+        last_evicted = self.get_info('last_evicted')
+        if time.time() - last_evicted > 86400:
+            self.evict()
+    
+    def get_info(self, key):
+        row = self.conn.execute("SELECT value FROM cache_info WHERE key=?", (key,)).fetchone()
+        if row:
+            return row[0]
+        return 0
+    
+    def set_info(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO cache_info VALUES (?, ?)", (key, value))
+    
+    def lookup(self, path, st, algorithms=('md5',)):
+        """Return a dict of checksums for an unchanged file, or None if the cache doesn't have all the requested algorithms"""
+        row = self.conn.execute("SELECT dev, inode, size, mtime_ns, md5, sha1, sha256 FROM hashes WHERE path=?", (path,)).fetchone()
+        if row and tuple(row[:4]) == (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns):
+            digests = dict(zip(('md5', 'sha1', 'sha256'), row[4:]))
+            if all(digests.get(a) for a in algorithms):
+                self.hits += 1
+                self.conn.execute("UPDATE hashes SET last_used=? WHERE path=?", (time.time(), path))
+                self.tick()
+                return {a : digests[a] for a in algorithms}
+        
+        self.misses += 1
+        return None
+    
+    def store(self, path, stat_key, digests):
+        #keep any checksums we already have for this exact version of the file
+        row = self.conn.execute("SELECT dev, inode, size, mtime_ns, md5, sha1, sha256 FROM hashes WHERE path=?", (path,)).fetchone()
+        if row and tuple(row[:4]) == tuple(stat_key):
+            old = dict(zip(('md5', 'sha1', 'sha256'), row[4:]))
+            old.update({a : v for a, v in digests.items() if v})
+            digests = old
+        
+        self.conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (path, *stat_key, digests.get('md5'), digests.get('sha1'), digests.get('sha256'), time.time()))
+        self.tick()
+    
+    def tick(self):
+        self.pending += 1
+        if self.pending >= 1000:
+            self.commit()
+    
+    def evict(self):
+        """Remove entries that haven't been used within max_age_days, then the least recently used entries over max_entries"""
+        self.conn.execute("DELETE FROM hashes WHERE last_used < ?", (time.time() - self.max_age_days * 86400,))
+        count = self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute("DELETE FROM hashes WHERE path IN (SELECT path FROM hashes ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+        self.set_info('last_evicted', time.time())
+        self.conn.commit()
+    
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+    
+    def close(self, report=True):
+        #keep running totals so we can see how well the cache is working over time
+        self.set_info('hits', self.get_info('hits') + self.hits)
+        self.set_info('misses', self.get_info('misses') + self.misses)
+        self.conn.commit()
+        self.conn.close()
+        
+        if report and self.hits + self.misses > 0:
+            print('\n\tHash cache: {} file(s) found in cache; {} file(s) read.'.format(self.hits, self.misses))
+
+class FixityEngine:
+    def __init__(self, workers=None, algorithms=FIXITY_ALGORITHMS, buffer_size=FIXITY_BUFFER_SIZE, window=1000, cache=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.algorithms = tuple(algorithms)
+        self.buffer_size = buffer_size
+        self.cache = cache
+
+        #number of files handed to the pool at a time; keeps the task queue from holding the whole file list
+        self.window = window
+
+    def hash_files(self, file_list):
+        """Generator: yields a dict of stats and checksums for each file, in the same order as file_list"""
+        if self.workers == 1:
+            fixity_worker_init(self.buffer_size)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(self.workers, initializer=fixity_worker_init, initargs=(self.buffer_size,))
+        
+        try:
+            batch = []
+            for file_target in file_list:
+                batch.append(file_target)
+                if len(batch) == self.window:
+                    yield from self.hash_batch(pool, batch)
+                    batch = []
+            if len(batch) > 0:
+                yield from self.hash_batch(pool, batch)
+        finally:
+            if pool:
+                pool.terminate()
+
+    def hash_batch(self, pool, batch):
+        #check the hash cache first; anything unchanged since it was last hashed doesn't need to be read
+        results = []
+        to_hash = []
+        for file_target in batch:
+            cached = None
+            if self.cache:
+                st = os.stat(file_target)
+                digests = self.cache.lookup(file_target, st, self.algorithms)
+                if digests:
+                    cached = file_info(file_target, st)
+                    cached.update(digests)
+            results.append(cached)
+            if cached is None:
+                to_hash.append((file_target, self.algorithms))
+        
+        #imap keeps results in submission order; large chunks cut IPC overhead for directories of small files
+        if pool:
+            chunksize = max(1, len(to_hash) // (self.workers * 4))
+            hashed = pool.imap(hash_file, to_hash, chunksize)
+        else:
+            hashed = map(hash_file, to_hash)
+        
+        for cached in results:
+            if cached is not None:
+                yield cached
+            else:
+                file_dict = next(hashed)
+                if self.cache:
+                    self.cache.store(file_dict['name'], file_dict['stat_key'], {a : file_dict[a] for a in self.algorithms})
+                yield file_dict
+
+class FileStatsStore:
+    """Compact on-disk record of file stats and checksums; replaces the pickled checksums.txt list"""
+    fields = ('counter', 'name', 'size', 'mtime', 'ctime', 'atime', 'checksum', 'sha1', 'sha256')
+    
+    def __init__(self, db_file, table='file_stats', commit_every=1000):
+        self.db_file = db_file
+        self.table = table
+        self.commit_every = commit_every
+        self.pending = 0
+        
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS {} (counter integer primary key, name text, size integer, mtime text, ctime text, atime text, checksum text, sha1 text, sha256 text)".format(self.table))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_{0}_name ON {0} (name)".format(self.table))
+        self.conn.commit()
+    
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM {}".format(self.table)).fetchone()[0]
+    
+    def __contains__(self, name):
+        return self.conn.execute("SELECT 1 FROM {} WHERE name=? LIMIT 1".format(self.table), (name,)).fetchone() is not None
+    
+    def __iter__(self):
+        """Stream records back as dicts in the order they were added"""
+        for row in self.conn.execute("SELECT {} FROM {} ORDER BY counter".format(', '.join(self.fields), self.table)):
+            yield dict(zip(self.fields, row))
+    
+    def add(self, file_dict):
+        #records reloaded from the resume log keep their original counter; anything already saved is left alone
+        self.conn.execute("INSERT OR IGNORE INTO {} ({}) VALUES ({})".format(self.table, ', '.join(self.fields), ', '.join('?' * len(self.fields))), [file_dict.get(f) for f in self.fields])
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+    
+    def last_counter(self):
+        return self.conn.execute("SELECT IFNULL(MAX(counter), 0) FROM {}".format(self.table)).fetchone()[0]
+    
+    def load_pickle(self, pickle_file):
+        #catch legacy items where file stats were pickled
+        with open(pickle_file, 'rb') as f:
+            for file_dict in pickle.load(f):
+                self.add(file_dict)
+        self.commit()
+    
+    def clear(self):
+        self.conn.execute("DELETE FROM {}".format(self.table))
+        self.conn.commit()
+    
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+    
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+class DfxmlWriter:
+    """Write a bdpl_ingest DFXML hash list one fileobject at a time, so memory use does not grow with the number of files"""
+    dc_namespace = 'http://purl.org/dc/elements/1.1/'
+    NSMAP = {None : 'http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML',
+            'xsi': "http://www.w3.org/2001/XMLSchema-instance",
+            'dc' : dc_namespace}
+    closing_tag = b'</dfxml>\n'
+    
+    def __init__(self, dfxml_output, timestamp):
+        self.dfxml_output = dfxml_output
+        self.timestamp = timestamp
+        
+        #reuse one fileobject element for every file; only the text values change
+        self.fileobject = etree.Element('fileobject')
+        self.fields = []
+        for tag, key in (('filename', 'name'), ('filesize', 'size'), ('mtime', 'mtime'), ('ctime', 'ctime'), ('atime', 'atime')):
+            self.fields.append((etree.SubElement(self.fileobject, tag), key))
+        self.fields.append((etree.SubElement(self.fileobject, 'hashdigest', type='md5'), 'checksum'))
+        etree.indent(self.fileobject, level=1)
+    
+    def __enter__(self):
+        #serialize the document header with the same settings as a full tree so the output is unchanged; hold back the closing tag
+        dc = "{%s}" % self.dc_namespace
+        dfxml = etree.Element("dfxml", nsmap=self.NSMAP, version="1.0")
+        metadata = etree.SubElement(dfxml, "metadata")
+        dctype = etree.SubElement(metadata, dc + "type")
+        dctype.text = "Hash List"
+        creator = etree.SubElement(dfxml, 'creator')
+        program = etree.SubElement(creator, 'program')
+        program.text = 'bdpl_ingest'
+        execution_environment = etree.SubElement(creator, 'execution_environment')
+        start_time = etree.SubElement(execution_environment, 'start_time')
+        start_time.text = self.timestamp
+        
+        header = etree.tostring(etree.ElementTree(dfxml), pretty_print=True, xml_declaration=True, encoding="UTF-8")
+        
+        self.f = open(self.dfxml_output, 'wb')
+        self.f.write(header[:-len(self.closing_tag)])
+        return self
+    
+    def write_fileobject(self, file_dict):
+        for element, key in self.fields:
+            element.text = str(file_dict[key])
+        self.f.write(b'  ' + etree.tostring(self.fileobject, encoding="utf-8") + b'\n')
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        #only close out the document if all files were written; an incomplete DFXML will be rebuilt when we resume
+        if exc_type is None:
+            self.f.write(self.closing_tag)
+        self.f.close()
+
+class DfxmlRecords:
+    """The fileobjects in a DFXML file, read in one streaming pass and kept as compact columns (one list or array per field) rather than an object per file. 
+    produce_dfxml and fix_dates both work from these, so a fiwalk DFXML is only parsed once."""
+    tags = ('filename', 'name_type', 'alloc', 'unalloc', 'filesize', 'mtime', 'crtime')
+    
+    def __init__(self, dfxml_file):
+        self.dfxml_file = dfxml_file
+        self.filename = []
+        self.name_type = []
+        #1: allocated; 0: unallocated; 2: not recorded
+        self.alloc = bytearray()
+        #-1: not recorded
+        self.size = array.array('q')
+        self.md5 = []
+        #epoch seconds; nan: not recorded
+        self.mtime = array.array('d')
+        self.crtime = array.array('d')
+        #fiwalk records either epoch seconds or ISO 8601 timestamps
+        self.iso_timestamps = False
+        
+        self.loaded_mtime = os.path.getmtime(self.dfxml_file)
+        self.read()
+    
+    def __len__(self):
+        return len(self.filename)
+    
+    def current(self):
+        return os.path.exists(self.dfxml_file) and os.path.getmtime(self.dfxml_file) == self.loaded_mtime
+    
+    def read(self):
+        raw_mtime = []
+        raw_crtime = []
+        
+        for event, element in etree.iterparse(self.dfxml_file, events = ("end",), tag="{*}fileobject"):
+            values = {}
+            for child in element:
+                tag = child.tag.rpartition('}')[2]
+                if tag == 'hashdigest':
+                    if child.get('type', '').lower() == 'md5':
+                        values['md5'] = child.text
+                elif tag in self.tags:
+                    values[tag] = child.text
+            
+            #free each fileobject (and anything before it) as soon as it has been read
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+            
+            self.filename.append(values.get('filename'))
+            self.name_type.append(values.get('name_type'))
+            self.md5.append(values.get('md5'))
+            raw_mtime.append(values.get('mtime'))
+            raw_crtime.append(values.get('crtime'))
+            
+            if ('alloc' in values and values['alloc'] != '1') or values.get('unalloc') == '1':
+                self.alloc.append(0)
+            elif 'alloc' in values:
+                self.alloc.append(1)
+            else:
+                self.alloc.append(2)
+            
+            try:
+                self.size.append(int(values['filesize']))
+            except (KeyError, TypeError, ValueError):
+                self.size.append(-1)
+        
+        self.mtime = self.parse_timestamps(raw_mtime)
+        self.crtime = self.parse_timestamps(raw_crtime)
+    
+    def parse_timestamps(self, values):
+        """Convert a column of DFXML timestamps to epoch seconds. ISO 8601 values are read as local time, as fix_dates has always applied them; 
+        the conversion is done once per distinct hour and minutes/seconds are added on, rather than running strptime and mktime for every file."""
+        hours = {}
+        nan = float('nan')
+        column = array.array('d')
+        
+        for value in values:
+            if not value:
+                column.append(nan)
+            elif value.isdigit():
+                column.append(int(value))
+            else:
+                self.iso_timestamps = True
+                try:
+                    key = value[:13]
+                    if not key in hours:
+                        hours[key] = time.mktime((int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), 0, 0, 0, 0, -1))
+                    column.append(hours[key] + int(value[14:16]) * 60 + int(value[17:19]))
+                except (ValueError, OverflowError):
+                    column.append(nan)
+        
+        return column
+    
+    def file_date(self, i):
+        #last modified date, falling back to the created date; None if neither was recorded
+        if self.mtime[i] == self.mtime[i]:
+            return self.mtime[i]
+        if self.crtime[i] == self.crtime[i]:
+            return self.crtime[i]
+    
+    def file_stats(self):
+        """Yield a FileStatsStore record for each allocated regular file"""
+        for i in range(len(self.filename)):
+            if self.name_type[i] != 'r' or self.alloc[i] == 0:
+                continue
+            
+            file_date = self.file_date(i)
+            if file_date is None:
+                mtime = 'undated'
+            elif self.iso_timestamps:
+                mtime = datetime.datetime.fromtimestamp(file_date).isoformat()
+            else:
+                mtime = datetime.datetime.utcfromtimestamp(int(file_date)).isoformat()
+            
+            yield {'name' : self.filename[i] or '', 'size' : self.size[i] if self.size[i] >= 0 else '', 'mtime' : mtime, 'checksum' : self.md5[i] or ''}
+
+class StatsEngine:
+    """Compile report statistics for an item with one pass over the siegfried table and one over the file stats store.
+    Results for each pass are cached against a fingerprint of their inputs, so re-analysis only recomputes what changed."""
+    full_header = ['Filename', 'Filesize', 'Date modified', 'Errors', 
+                'Namespace', 'ID', 'Format', 'Format version', 'MIME type', 
+                'Basis for ID', 'Warning']
+    
+    def __init__(self, item):
+        self.item = item
+        self.cache = {}
+        if os.path.exists(self.item.stats_cache):
+            try:
+                with open(self.item.stats_cache, 'rb') as f:
+                    self.cache = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                pass
+        
+        #reports written by each section; if any are missing we redo the section even if inputs are unchanged
+        self.reports = {
+            'siegfried' : [os.path.join(self.item.reports_dir, f) for f in ['formats.csv', 'formatVersions.csv', 'mimetypes.csv', 'unidentified.csv', 'errors.csv']],
+            'files' : [os.path.join(self.item.reports_dir, 'years.csv')]
+            }
+    
+    def run(self):
+        results = {}
+        
+        #retrieve our 'file stats'; for dvd jobs, we need to use disk image metadata for dates
+        file_stats = FileStatsStore(self.item.file_stats_db)
+        if len(file_stats) == 0 and os.path.exists(self.item.checksums):
+            file_stats.load_pickle(self.item.checksums)
+        
+        if self.item.job_type == 'DVD':
+            date_stats = FileStatsStore(self.item.file_stats_db, 'dvd_stats')
+            if len(date_stats) == 0 and os.path.exists(self.item.checksums_dvd):
+                date_stats.load_pickle(self.item.checksums_dvd)
+        else:
+            date_stats = file_stats
+        
+        conn = sqlite3.connect(self.item.siegfried_db)
+        conn.text_factory = str  # allows utf-8 data to be stored
+        
+        sections = [
+            ('siegfried', self.siegfried_fingerprint(), lambda: self.siegfried_stats(conn)), 
+            ('files', self.files_fingerprint(file_stats, date_stats), lambda: self.file_stats(conn, file_stats, date_stats))
+            ]
+        
+        for section, fingerprint, compile_stats in sections:
+            cached = self.cache.get(section)
+            if cached and cached[0] == fingerprint and all(os.path.exists(r) for r in self.reports[section]) and self.duplicates_saved(conn, section):
+                print('\n\t{} stats unchanged since last analysis; using saved results.'.format(section.capitalize()))
+                results.update(cached[1])
+            else:
+                section_results = compile_stats()
+                self.cache[section] = (fingerprint, section_results)
+                results.update(section_results)
+        
+        #total size comes from the file stats store when it describes files_dir; otherwise walk the folder
+        if self.item.job_type in ['Copy_only', 'DVD'] or (self.item.job_type == 'Disk_image' and not 'hfs+' in [fs.lower() for fs in self.item.db.get('fs_list', [])]):
+            results['total_size_bytes'] = results['stats_size_bytes']
+        else:
+            results['total_size_bytes'] = 0
+            for root, dirs, files in os.walk(self.item.files_dir):
+                for f in files:
+                    results['total_size_bytes'] += os.stat(os.path.join(root, f)).st_size
+        
+        conn.close()
+        if date_stats is not file_stats:
+            date_stats.close()
+        file_stats.close()
+        
+        with open(self.item.stats_cache, 'wb') as f:
+            pickle.dump(self.cache, f)
+        
+        return results
+    
+    def duplicates_saved(self, conn, section):
+        if section != 'files':
+            return True
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='duplicates';").fetchone()[0] > 0
+    
+    def siegfried_fingerprint(self):
+        #siegfried output is small compared to the content it describes, so hash it
+        hash_md5 = hashlib.md5()
+        with open(self.item.sf_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hash_md5.update(chunk)
+        return hash_md5.hexdigest()
+    
+    def files_fingerprint(self, file_stats, date_stats):
+        #cheap signature of the stats store calculated by sqlite, plus the replication time that we compare dates against
+        signature = []
+        for store in [file_stats, date_stats]:
+            signature.append(store.conn.execute("SELECT COUNT(*), TOTAL(size), MIN(mtime), MAX(mtime), COUNT(DISTINCT checksum), MAX(counter) FROM {}".format(store.table)).fetchone())
+        signature.append(os.path.getmtime(self.item.folders_created))
+        return tuple(signature)
+    
+    def siegfried_stats(self, conn):
+        """Counts, format/version/mime tallies, and lists of unidentified files and errors; aggregates and lists use the indexes built by import_csv"""
+        # get total # of files, empty files, unidentified files, siegfried errors, and # of identified file formats in one pass
+        num_files, empty_files, unidentified_files, num_errors, num_formats = conn.execute("SELECT COUNT(*), IFNULL(SUM(filesize=0), 0), IFNULL(SUM(id='UNKNOWN'), 0), IFNULL(SUM(errors <> ''), 0), COUNT(DISTINCT NULLIF(format, '')) FROM siegfried;").fetchone()
+        
+        # generate sorted format, format version and mimetype reports
+        format_rows = conn.execute("SELECT format, id, COUNT(*) as 'num' FROM siegfried GROUP BY format ORDER BY num DESC").fetchall()
+        self.write_csv('formats.csv', ['Format', 'ID', 'Count'], format_rows)
+        
+        self.write_csv('formatVersions.csv', ['Format', 'ID', 'Version', 'Count'], conn.execute("SELECT format, id, version, COUNT(*) as 'num' FROM siegfried GROUP BY format, version ORDER BY num DESC"))
+        
+        self.write_csv('mimetypes.csv', ['MIME type', 'Count'], conn.execute("SELECT mime, COUNT(*) as 'num' FROM siegfried GROUP BY mime ORDER BY num DESC"))
+        
+        # write lists of unidentified files and siegfried errors
+        self.write_csv('unidentified.csv', self.full_header, conn.execute("SELECT * FROM siegfried WHERE id='UNKNOWN'"))
+        self.write_csv('errors.csv', self.full_header, conn.execute("SELECT * FROM siegfried WHERE errors <> ''"))
+        
+        return {'num_files' : num_files, 'empty_files' : empty_files, 'unidentified_files' : unidentified_files, 'num_errors' : num_errors, 'num_formats' : num_formats, 'format_list' : [r[0] for r in format_rows]}
+    
+    def file_stats(self, conn, file_stats, date_stats):
+        """Duplicates from the indexed store, plus one pass for sizes and last modified dates"""
+        self.build_duplicate_index(conn, file_stats)
+        
+        #total duplicates = total # of rows in the duplicate index; distinct duplicates = # of unique checksums in the index
+        all_dupes, distinct_dupes = conn.execute("SELECT COUNT(*), COUNT(DISTINCT checksum) FROM duplicates;").fetchone()
+        
+        stats_size_bytes = file_stats.conn.execute("SELECT TOTAL(size) FROM {}".format(file_stats.table)).fetchone()[0]
+        
+        #For reporting purposes, we want to catch any files whose current 'mtime' was set during replication in the BDPL process.
+        #first, establish when we ran the replication operation.  If no replication operation, check timestamp of folders we created
+        bdpl_time = datetime.datetime.fromtimestamp(os.path.getmtime(self.item.folders_created)).isoformat().replace('T', ' ').split('.')[0]
+        
+        #next, go through or file list.  If the 'mtime' is more recent than the 'BDPL' replication action, that means we don't have the original file timestamp.
+        #timestamps are ISO 8601, so once they are normalized to 'YYYY-MM-DD HH:MM:SS' we can compare the strings directly
+        earliest_date = latest_date = None
+        year_count = {}
+        undated_count = 0
+        for dctnry in date_stats:
+            mtime = dctnry['mtime']
+            dt_time = mtime.replace('T', ' ').split('.')[0]
+            if dt_time[:4].isdigit() and dt_time < bdpl_time:
+                year = mtime[:4]
+                year_count[year] = year_count.get(year, 0) + 1
+                if earliest_date is None or mtime < earliest_date:
+                    earliest_date = mtime
+                if latest_date is None or mtime > latest_date:
+                    latest_date = mtime
+            else:
+                undated_count += 1
+        
+        #If we've collected any dates, set date ranges; otherwise record 'undated'
+        if earliest_date is not None:
+            begin_date = earliest_date[:4]
+            end_date = latest_date[:4]
+        else:
+            begin_date = end_date = earliest_date = latest_date = "undated"
+            if undated_count > 0:
+                year_count = {'undated' : undated_count}
+        
+        #write year info to file
+        with open(os.path.join(self.item.reports_dir, 'years.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            year_header = ['Year Last Modified', 'Count']
+            writer.writerow(year_header)
+            for key, value in year_count.items():
+                writer.writerow([key, value])
+        
+        return {'all_dupes' : all_dupes, 'distinct_dupes' : distinct_dupes, 'stats_size_bytes' : int(stats_size_bytes), 'begin_date' : begin_date, 'end_date' : end_date, 'earliest_date' : earliest_date, 'latest_date' : latest_date, 'year_count' : year_count}
+    
+    def build_duplicate_index(self, conn, file_stats):
+        """Group files by size and checksum and save groups with more than one file"""
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS duplicates")
+        cursor.execute("CREATE TABLE duplicates (filename text, filesize integer, modified text, checksum text)")
+        
+        #catch legacy items where the duplicate list was kept in the shelve
+        if 'dup_list' in list(self.item.db.keys()) and not self.item.re_analyze:
+            cursor.executemany("INSERT INTO duplicates VALUES (?, ?, ?, ?)", self.item.db['dup_list'])
+        
+        #let sqlite do the grouping against the file stats store; rows for each checksum are inserted together, in the order files were first seen, and reports read them back by rowid
+        else:
+            file_stats.commit()
+            cursor.execute("ATTACH DATABASE ? AS fs", (file_stats.db_file,))
+            cursor.execute("""INSERT INTO duplicates 
+                SELECT f.name, f.size, f.mtime, f.checksum FROM fs.{0} f 
+                JOIN (SELECT size, checksum, MIN(counter) AS first_seen FROM fs.{0} WHERE size > 0 GROUP BY size, checksum HAVING COUNT(*) > 1) g 
+                ON f.size = g.size AND f.checksum = g.checksum 
+                ORDER BY g.first_seen, f.counter""".format(file_stats.table))
+            conn.commit()
+            cursor.execute("DETACH DATABASE fs")
+        
+        cursor.execute("CREATE INDEX idx_duplicates_checksum ON duplicates (checksum)")
+        conn.commit()
+        cursor.close()
+    
+    def write_csv(self, report, header, rows):
+        with open(os.path.join(self.item.reports_dir, report), 'w', newline='', encoding='utf8') as f:
+            w = csv.writer(f, lineterminator='\n')
+            w.writerow(header)
+            w.writerows(rows)
+
+class BagBuilder:
+    """Bag a barcode folder in place, as bagit.make_bag does, but seed manifest-md5.txt from the checksums already recorded in the item's DFXML.
+    Only files that are missing from the DFXML or whose size or mtime have changed (metadata, reports, etc.) are hashed."""
+    def __init__(self, bag_dir, identifier, dfxml_file=None, workers=None, hash_cache_db=None):
+        self.bag_dir = os.path.abspath(bag_dir)
+        self.identifier = identifier
+        self.dfxml_file = dfxml_file
+        self.workers = workers
+        self.hash_cache_db = hash_cache_db
+        self.reused = 0
+        self.hashed = 0
+    
+    def load_dfxml(self):
+        """Map each file's path (relative to the bag directory, with '/' separators) to the size, mtime and md5 recorded in the DFXML"""
+        records = {}
+        if not self.dfxml_file or not os.path.exists(self.dfxml_file):
+            return records
+        
+        #bdpl_ingest records full paths that include the barcode folder; drive letters and shipment paths may have changed since
+        marker = '/{}/'.format(self.identifier)
+        
+        for event, element in etree.iterparse(self.dfxml_file, events = ("end",), tag="{*}fileobject"):
+            values = {}
+            for child in element:
+                tag = etree.QName(child).localname
+                if tag == 'hashdigest':
+                    if child.get('type', '').lower() == 'md5':
+                        values['md5'] = child.text
+                elif tag in ['filename', 'filesize', 'mtime']:
+                    values[tag] = child.text
+            element.clear()
+            
+            if not values.get('filename') or not values.get('md5') or not values.get('filesize'):
+                continue
+            
+            name = values['filename'].replace('\\', '/')
+            if marker in name:
+                rel_path = name.split(marker)[-1]
+            #fiwalk records paths within the disk image; tsk_recover and unhfs write these to the files folder
+            else:
+                rel_path = 'files/{}'.format(name.lstrip('/'))
+            
+            records[rel_path] = (int(values['filesize']), values.get('mtime'), values['md5'].lower())
+        
+        return records
+    
+    def mtime_matches(self, recorded, st):
+        if not recorded:
+            return False
+        
+        #bdpl_ingest records the local time from os.stat
+        if datetime.datetime.fromtimestamp(st.st_mtime).isoformat() == recorded:
+            return True
+        
+        #fiwalk records either epoch seconds or an ISO 8601 timestamp (applied to the files by fix_dates)
+        try:
+            if recorded.isdigit():
+                recorded = int(recorded)
+            else:
+                recorded = int(time.mktime(datetime.datetime.strptime(recorded[:19], "%Y-%m-%dT%H:%M:%S").timetuple()))
+        except ValueError:
+            return False
+        
+        return int(st.st_mtime) == recorded
+    
+    def make_bag(self, bag_info):
+        records = self.load_dfxml()
+        
+        #stat each file in the order bagit lists the payload; reuse the DFXML checksum wherever the size and mtime still match
+        entries = []
+        to_hash = []
+        for root, dirnames, filenames in os.walk(self.bag_dir):
+            dirnames.sort()
+            filenames.sort()
+            for file in filenames:
+                file_target = os.path.join(root, file)
+                rel_path = os.path.relpath(file_target, self.bag_dir).replace(os.sep, '/')
+                st = os.stat(file_target)
+                record = records.get(rel_path)
+                if record and record[0] == st.st_size and self.mtime_matches(record[1], st):
+                    entries.append([rel_path, st.st_size, record[2]])
+                else:
+                    entries.append([rel_path, st.st_size, None])
+                    to_hash.append(file_target)
+        
+        del records
+        
+        self.hashed = len(to_hash)
+        self.reused = len(entries) - self.hashed
+        print('\n\t{} checksum(s) taken from DFXML; hashing {} file(s)...'.format(self.reused, self.hashed))
+        
+        #anything else goes through the fixity engine (and the hash cache) before any files are moved
+        if len(to_hash) > 0:
+            hash_cache = HashCache(self.hash_cache_db) if self.hash_cache_db else None
+            fixity = FixityEngine(self.workers, algorithms=('md5',), cache=hash_cache)
+            hashed = fixity.hash_files(to_hash)
+            try:
+                for entry in entries:
+                    if entry[2] is None:
+                        file_dict = next(hashed)
+                        entry[1] = file_dict['size']
+                        entry[2] = file_dict['md5']
+            finally:
+                hashed.close()
+                if hash_cache:
+                    hash_cache.close()
+        
+        #move payload into 'data', by way of a temp folder in case the item already has a 'data' folder
+        temp_data = tempfile.mkdtemp(dir=self.bag_dir)
+        for f in os.listdir(self.bag_dir):
+            if os.path.join(self.bag_dir, f) == temp_data:
+                continue
+            os.rename(os.path.join(self.bag_dir, f), os.path.join(temp_data, f))
+        data_dir = os.path.join(self.bag_dir, 'data')
+        os.rename(temp_data, data_dir)
+        os.chmod(data_dir, os.stat(self.bag_dir).st_mode)
+        
+        #write tag files in the same formats as bagit
+        total_bytes = 0
+        with open(os.path.join(self.bag_dir, 'manifest-md5.txt'), 'w', encoding='utf-8', newline='') as f:
+            for rel_path, size, md5 in entries:
+                f.write('{}  data/{}\n'.format(md5, rel_path.replace('\r', '%0D').replace('\n', '%0A')))
+                total_bytes += size
+        
+        with open(os.path.join(self.bag_dir, 'bagit.txt'), 'w', encoding='utf-8', newline='') as f:
+            f.write('BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n')
+        
+        bag_info = dict(bag_info)
+        if not 'Bagging-Date' in bag_info:
+            bag_info['Bagging-Date'] = datetime.date.today().strftime('%Y-%m-%d')
+        if not 'Bag-Software-Agent' in bag_info:
+            bag_info['Bag-Software-Agent'] = 'bagit.py v{} <{}>'.format(bagit.VERSION, bagit.PROJECT_URL)
+        bag_info['Payload-Oxum'] = '{}.{}'.format(total_bytes, len(entries))
+        
+        with open(os.path.join(self.bag_dir, 'bag-info.txt'), 'w', encoding='utf-8', newline='') as f:
+            for key in sorted(bag_info):
+                f.write('{}: {}\n'.format(key, re.sub(r"\n|\r|(\r\n)", "", str(bag_info[key]))))
+        
+        tag_files = [f for f in sorted(os.listdir(self.bag_dir)) if os.path.isfile(os.path.join(self.bag_dir, f)) and not f.startswith('tagmanifest-')]
+        with open(os.path.join(self.bag_dir, 'tagmanifest-md5.txt'), 'w', encoding='utf-8', newline='') as f:
+            for tag_file in tag_files:
+                with open(os.path.join(self.bag_dir, tag_file), 'rb') as fh:
+                    f.write('{} {}\n'.format(hashlib.md5(fh.read()).hexdigest(), tag_file))
+        
+        #confirm bagit can read the bag and the payload matches the Payload-Oxum
+        bag = bagit.Bag(self.bag_dir)
+        bag.validate(fast=True)
+        
+        return bag
+
+class HashingWriter:
+    """File wrapper that keeps a running md5 (and, optionally, a TreeHash) and byte count of everything written through it"""
+    def __init__(self, f, md5=None, size=0, tree=None):
+        self.f = f
+        self.md5 = md5 or hashlib.md5()
+        self.size = size
+        self.tree = tree
+    
+    def write(self, data):
+        self.f.write(data)
+        self.md5.update(data)
+        if self.tree is not None:
+            self.tree.update(data)
+        self.size += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.size
+
+class SipWriter:
+    """Create a SIP tar in a single pass, calculating its md5 and size as it is written, so the tar can go straight to the Archiver spool.
+    Progress is checkpointed every few thousand members (or GB) so an interrupted tar resumes where it left off. If tree_hash_file is given, a TreeHash of the tar is saved there."""
+    def __init__(self, source_dir, arcname, tar_file, checkpoint_every=1000, checkpoint_bytes=1024**3, tree_hash_file=None):
+        self.source_dir = source_dir
+        self.arcname = arcname
+        self.tar_file = tar_file
+        self.tree_hash_file = tree_hash_file
+        self.part_file = '{}.part'.format(tar_file)
+        self.checkpoint_file = '{}.checkpoint'.format(tar_file)
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_bytes = checkpoint_bytes
+    
+    def members(self, name, arcname):
+        """Yield paths and archive names in the same order as TarFile.add"""
+        yield name, arcname
+        if os.path.isdir(name) and not os.path.islink(name):
+            for f in sorted(os.listdir(name)):
+                yield from self.members(os.path.join(name, f), os.path.join(arcname, f))
+    
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_file) or not os.path.exists(self.part_file):
+            return None
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+        except ValueError:
+            return None
+        if os.path.getsize(self.part_file) < checkpoint['offset']:
+            return None
+        return checkpoint
+    
+    def save_checkpoint(self, f, members_done, offset):
+        #make sure everything up to the checkpoint is actually on disk before we record it
+        f.flush()
+        os.fsync(f.fileno())
+        temp_checkpoint = '{}.tmp'.format(self.checkpoint_file)
+        with open(temp_checkpoint, 'w') as cp:
+            json.dump({'members' : members_done, 'offset' : offset}, cp)
+        os.replace(temp_checkpoint, self.checkpoint_file)
+    
+    def write(self):
+        """Write the tar and return SIP stats: md5, extent (bytes), filename, and creation date"""
+        checkpoint = self.load_checkpoint()
+        
+        if checkpoint:
+            print('\tResuming tar archive after {} member(s)...'.format(checkpoint['members']))
+            f = open(self.part_file, 'r+b')
+            f.truncate(checkpoint['offset'])
+            
+            #the md5 can't be saved, so re-read the part of the tar we already have; still much cheaper than re-writing it
+            md5 = hashlib.md5()
+            tree = TreeHash() if self.tree_hash_file else None
+            hash_stream(f, [md5, tree] if tree else [md5])
+            writer = HashingWriter(f, md5, checkpoint['offset'], tree)
+            members_done = checkpoint['members']
+        else:
+            f = open(self.part_file, 'wb')
+            writer = HashingWriter(f, tree=TreeHash() if self.tree_hash_file else None)
+            members_done = 0
+        
+        try:
+            last_offset = writer.size
+            last_members = members_done
+            
+            with tarfile.open(fileobj=writer, mode='w') as tar:
+                for name, arcname in itertools.islice(self.members(self.source_dir, self.arcname), members_done, None):
+                    tar.add(name, arcname=arcname, recursive=False)
+                    members_done += 1
+                    
+                    if members_done - last_members >= self.checkpoint_every or tar.offset - last_offset >= self.checkpoint_bytes:
+                        self.save_checkpoint(f, members_done, tar.offset)
+                        last_members = members_done
+                        last_offset = tar.offset
+            
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        
+        os.replace(self.part_file, self.tar_file)
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        
+        if writer.tree is not None:
+            writer.tree.finish().save(self.tree_hash_file)
+        
+        return {'sip_md5' : writer.md5.hexdigest(), 'sip_extent' : writer.size, 'sip_filename' : os.path.basename(self.tar_file), 'sip_creation_date' : datetime.datetime.fromtimestamp(os.path.getmtime(self.tar_file)).isoformat()}
+
+class SpacePlanner:
+    """Calculate the exact size of a SIP tar and keep track of space promised to SIPs that are still being written, per destination volume"""
+    def __init__(self, headroom=256*1024**2):
+        #leave some space free on each volume for logs and other tools
+        self.headroom = headroom
+        self.lock = threading.Lock()
+        self.reservations = {}
+    
+    def tar_size(self, sip_writer):
+        """Size of the finished tar: each member's header (including any pax headers), data padded to 512-byte blocks, end-of-archive blocks and record padding"""
+        tar = tarfile.TarFile(fileobj=io.BytesIO(), mode='w')
+        total = 0
+        for name, arcname in sip_writer.members(sip_writer.source_dir, sip_writer.arcname):
+            tarinfo = tar.gettarinfo(name, arcname)
+            if tarinfo is None:
+                continue
+            total += len(tarinfo.tobuf(tar.format, tar.encoding, tar.errors))
+            if tarinfo.isreg():
+                total += math.ceil(tarinfo.size / tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        
+        total += 2 * tarfile.BLOCKSIZE
+        total = math.ceil(total / tarfile.RECORDSIZE) * tarfile.RECORDSIZE
+        return total
+    
+    def outstanding(self, volume):
+        #space still to be written by reserved SIPs; anything already in a .part file is reflected in the volume's free space
+        total = 0
+        for res_volume, size, part_file in self.reservations.values():
+            if res_volume == volume:
+                written = os.path.getsize(part_file) if part_file and os.path.exists(part_file) else 0
+                total += max(0, size - written)
+        return total
+    
+    def reserve(self, identifier, dest_dir, size, part_file=None):
+        """Reserve space for a SIP on the volume holding dest_dir; returns (status, available space)"""
+        with self.lock:
+            volume = os.stat(dest_dir).st_dev
+            self.reservations.pop(identifier, None)
+            
+            #credit any part of this SIP that was already written before a restart
+            if part_file and os.path.exists(part_file):
+                needed = max(0, size - os.path.getsize(part_file))
+            else:
+                needed = size
+            
+            available = shutil.disk_usage(dest_dir).free - self.outstanding(volume) - self.headroom
+            if needed > available:
+                return (False, available)
+            
+            self.reservations[identifier] = (volume, size, part_file)
+            return (True, available)
+    
+    def release(self, identifier):
+        with self.lock:
+            self.reservations.pop(identifier, None)
+
+class PremisWriter:
+    """Write an item's PREMIS XML. New events are serialized from a single reusable event template and spliced in before the closing tag, 
+    so recording an event doesn't mean rebuilding the whole document; output matches a full pretty-printed rewrite."""
+    PREMIS_NAMESPACE = "http://www.loc.gov/premis/v3"
+    PREMIS = "{%s}" % PREMIS_NAMESPACE
+    NSMAP = {'premis' : PREMIS_NAMESPACE,
+            "xsi": "http://www.w3.org/2001/XMLSchema-instance"}
+    closing_tag = b'</premis:premis>\n'
+    
+    def __init__(self, premis_xml_file, identifier):
+        self.premis_xml_file = premis_xml_file
+        self.identifier = identifier
+        
+        #serialized events carry the document's namespace declarations; note them so they can be dropped
+        empty = etree.tostring(etree.Element(self.PREMIS + 'event', nsmap=self.NSMAP))
+        self.ns_declarations = empty[len(b'<premis:event'):-len(b'/>')]
+        
+        self.event, self.fields = self.event_template()
+    
+    def event_template(self):
+        PREMIS = self.PREMIS
+        fields = {}
+        
+        event = etree.Element(PREMIS + 'event', nsmap=self.NSMAP)
+        eventID = etree.SubElement(event, PREMIS + 'eventIdentifier')
+        eventIDtype = etree.SubElement(eventID, PREMIS + 'eventIdentifierType')
+        eventIDtype.text = 'UUID'
+        fields['eventIdentifierValue'] = etree.SubElement(eventID, PREMIS + 'eventIdentifierValue')
+        fields['eventType'] = etree.SubElement(event, PREMIS + 'eventType')
+        fields['timestamp'] = etree.SubElement(event, PREMIS + 'eventDateTime')
+        eventDetailInfo = etree.SubElement(event, PREMIS + 'eventDetailInformation')
+        fields['eventDetailInfo'] = etree.SubElement(eventDetailInfo, PREMIS + 'eventDetail')
+        
+        #additional eventDetailInfo to clarify action; older transfers may not include this, in which case the element is left empty
+        eventDetailInfo = etree.SubElement(event, PREMIS + 'eventDetailInformation')
+        fields['eventDetailInfo_additional'] = etree.SubElement(eventDetailInfo, PREMIS + 'eventDetail')
+        
+        eventOutcomeInfo = etree.SubElement(event, PREMIS + 'eventOutcomeInformation')
+        fields['eventOutcomeDetail'] = etree.SubElement(eventOutcomeInfo, PREMIS + 'eventOutcome')
+        eventOutDetail = etree.SubElement(eventOutcomeInfo, PREMIS + 'eventOutcomeDetail')
+        fields['eventOutcomeDetailNote'] = etree.SubElement(eventOutDetail, PREMIS + 'eventOutcomeDetailNote')
+        
+        for role, value in (('implementer', 'IUL BDPL'), ('executing software', None)):
+            linkingAgentID = etree.SubElement(event, PREMIS + 'linkingAgentIdentifier')
+            linkingAgentIDtype = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentIdentifierType')
+            linkingAgentIDtype.text = 'local'
+            linkingAgentIDvalue = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentIdentifierValue')
+            if value:
+                linkingAgentIDvalue.text = value
+            else:
+                fields['linkingAgentIDvalue'] = linkingAgentIDvalue
+            linkingAgentRole = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentRole')
+            linkingAgentRole.text = role
+        
+        linkingObjectID = etree.SubElement(event, PREMIS + 'linkingObjectIdentifier')
+        linkingObjectIDtype = etree.SubElement(linkingObjectID, PREMIS + 'linkingObjectIdentifierType')
+        linkingObjectIDtype.text = 'local'
+        linkingObjectIDvalue = etree.SubElement(linkingObjectID, PREMIS + 'linkingObjectIdentifierValue')
+        linkingObjectIDvalue.text = self.identifier
+        
+        etree.indent(event, level=1)
+        return event, fields
+    
+    def serialize_event(self, entry, event_id):
+        for key, element in self.fields.items():
+            if key == 'eventIdentifierValue':
+                element.text = event_id
+            elif key == 'eventOutcomeDetail':
+                element.text = str(entry['eventOutcomeDetail'])
+            elif key == 'eventOutcomeDetailNote':
+                if entry['eventOutcomeDetail'] in ['0', 0]:
+                    element.text = 'Successful completion'
+                else:
+                    element.text = 'Unsuccessful completion; refer to logs.'
+            else:
+                element.text = entry.get(key)
+        
+        return b'  ' + etree.tostring(self.event, encoding="utf-8").replace(self.ns_declarations, b'', 1) + b'\n'
+    
+    def header(self):
+        PREMIS = self.PREMIS
+        attr_qname = etree.QName("http://www.w3.org/2001/XMLSchema-instance", "schemaLocation")
+        
+        root = etree.Element(PREMIS + 'premis', {attr_qname: "http://www.loc.gov/premis/v3 https://www.loc.gov/standards/premis/premis.xsd"}, version="3.0", nsmap=self.NSMAP)
+        
+        object = etree.SubElement(root, PREMIS + 'object', attrib={etree.QName(self.NSMAP['xsi'], 'type'): 'premis:file'})
+        objectIdentifier = etree.SubElement(object, PREMIS + 'objectIdentifier')
+        objectIdentifierType = etree.SubElement(objectIdentifier, PREMIS + 'objectIdentifierType')
+        objectIdentifierType.text = 'local'
+        objectIdentifierValue = etree.SubElement(objectIdentifier, PREMIS + 'objectIdentifierValue')
+        objectIdentifierValue.text = self.identifier
+        objectCharacteristics = etree.SubElement(object, PREMIS + 'objectCharacteristics')
+        compositionLevel = etree.SubElement(objectCharacteristics, PREMIS + 'compositionLevel')
+        compositionLevel.text = '0'
+        format = etree.SubElement(objectCharacteristics, PREMIS + 'format')
+        formatDesignation = etree.SubElement(format, PREMIS + 'formatDesignation')
+        formatName = etree.SubElement(formatDesignation, PREMIS + 'formatName')
+        formatName.text = 'Tape Archive Format'
+        formatRegistry = etree.SubElement(format, PREMIS + 'formatRegistry')
+        formatRegistryName = etree.SubElement(formatRegistry, PREMIS + 'formatRegistryName')
+        formatRegistryName.text = 'PRONOM'
+        formatRegistryKey = etree.SubElement(formatRegistry, PREMIS + 'formatRegistryKey')
+        formatRegistryKey.text = 'x-fmt/265' 
+        
+        document = etree.tostring(etree.ElementTree(root), pretty_print=True, xml_declaration=True, encoding="UTF-8")
+        return document[:-len(self.closing_tag)]
+    
+    def write(self, events):
+        """Write the whole document; events is a list of (event dict, event UUID)"""
+        temp_file = '{}.tmp'.format(self.premis_xml_file)
+        with open(temp_file, 'wb') as f:
+            f.write(self.header())
+            for entry, event_id in events:
+                f.write(self.serialize_event(entry, event_id))
+            f.write(self.closing_tag)
+        os.replace(temp_file, self.premis_xml_file)
+    
+    def append(self, events):
+        """Add events to the end of an existing document; returns False if the document isn't one we can append to"""
+        if not os.path.exists(self.premis_xml_file):
+            return False
+        
+        with open(self.premis_xml_file, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell() - len(self.closing_tag)
+            if end < 0:
+                return False
+            f.seek(end)
+            if f.read() != self.closing_tag:
+                return False
+            
+            f.seek(end)
+            for entry, event_id in events:
+                f.write(self.serialize_event(entry, event_id))
+            f.write(self.closing_tag)
+            f.truncate()
+        
+        return True
+
+class ItemStateStore:
+    """Per-item state for DigitalObject, replacing the writeback shelve in item_ingest_info. PREMIS events are rows in an append-only table and item info is written one key at a time, 
+    so recording an event or updating a value is one small write rather than re-pickling the item's whole history. Other values (fs_list, partition_info_list, etc.) are cached and written back on sync(), as with the shelve.
+    Analysis stages may run at the same time, so all statements go through execute() under one lock."""
+    premis_fields = ('eventType', 'eventOutcomeDetail', 'timestamp', 'eventDetailInfo', 'eventDetailInfo_additional', 'linkingAgentIDvalue')
+    
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.cache = {}
+        self.closed = False
+        
+        #PREMIS events by eventType; built the first time check_premis needs it
+        self.premis_index = None
+        
+        self.lock = threading.RLock()
+        
+        #autocommit: each event or info value is saved as soon as it is written
+        #objects may be set up on the main thread and used by a background job
+        self.conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS premis_events (seq integer primary key, {}, event_id text, written integer default 0)".format(', '.join(self.premis_fields)))
+        
+        #stores created before events had stable identifiers
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(premis_events)")]
+        if not 'event_id' in columns:
+            self.conn.execute("ALTER TABLE premis_events ADD COLUMN event_id text")
+            self.conn.execute("ALTER TABLE premis_events ADD COLUMN written integer default 0")
+            for (seq,) in self.conn.execute("SELECT seq FROM premis_events").fetchall():
+                self.conn.execute("UPDATE premis_events SET event_id=? WHERE seq=?", (str(uuid.uuid4()), seq))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS info (key text primary key, value blob)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS record (key text primary key, value blob)")
+    
+    def execute(self, sql, params=()):
+        """Run a statement and return all of its rows"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+    
+    def __getitem__(self, key):
+        if key == 'premis':
+            return PremisEvents(self)
+        elif key == 'info':
+            return InfoDict(self)
+        
+        with self.lock:
+            if not key in self.cache:
+                rows = self.execute("SELECT value FROM record WHERE key=?", (key,))
+                if not rows:
+                    raise KeyError(key)
+                self.cache[key] = pickle.loads(rows[0][0])
+            return self.cache[key]
+    
+    def __setitem__(self, key, value):
+        if key == 'premis':
+            self.replace_premis([(event, str(uuid.uuid4()), 0) for event in value])
+        elif key == 'info':
+            with self.lock, self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.execute("DELETE FROM info")
+                self.conn.executemany("INSERT INTO info VALUES (?, ?)", [(k, pickle.dumps(v)) for k, v in value.items()])
+                self.mark(key)
+        else:
+            with self.lock:
+                self.cache[key] = value
+    
+    def replace_premis(self, rows):
+        """Rewrite the PREMIS event table from a list of (event dict, event UUID, written flag)"""
+        with self.lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.execute("DELETE FROM premis_events")
+                self.conn.executemany("INSERT INTO premis_events ({}, event_id, written) VALUES ({})".format(', '.join(self.premis_fields), ', '.join('?' * (len(self.premis_fields) + 2))), [[event.get(f) for f in self.premis_fields] + [event_id, written] for event, event_id, written in rows])
+                self.mark('premis')
+            self.premis_index = None
+    
+    def mark(self, key):
+        #premis and info live in their own tables; keep a placeholder so they show up in keys()
+        self.execute("INSERT OR REPLACE INTO record VALUES (?, NULL)", (key,))
+    
+    def __contains__(self, key):
+        return key in self.keys()
+    
+    def keys(self):
+        with self.lock:
+            keys = [row[0] for row in self.execute("SELECT key FROM record ORDER BY rowid")]
+            return keys + [k for k in self.cache if not k in keys]
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def sync(self):
+        with self.lock:
+            if len(self.cache) > 0:
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    for key, value in self.cache.items():
+                        self.conn.execute("INSERT OR REPLACE INTO record VALUES (?, ?)", (key, pickle.dumps(value)))
+            self.cache = {}
+    
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.sync()
+                self.conn.close()
+                self.closed = True
+    
+    def __del__(self):
+        #like a shelve, write back anything outstanding if the item is dropped without closing
+        try:
+            self.close()
+        except Exception:
+            pass
+    
+    def migrate_shelve(self, shelve_file):
+        """Import an item's shelve from an earlier session, if this store is still empty"""
+        if not dbm.whichdb(shelve_file) or len(self.keys()) > 0:
+            return
+        
+        with shelve.open(shelve_file, flag='r') as db:
+            for key in db.keys():
+                self[key] = db[key]
+        self.sync()
+
+class PremisEvents:
+    """List-like view of an item's PREMIS events, in the order they were recorded"""
+    def __init__(self, store):
+        self.store = store
+        self.fields = store.premis_fields
+    
+    def __iter__(self):
+        for row in self.store.execute("SELECT {} FROM premis_events ORDER BY seq".format(', '.join(self.fields))):
+            yield dict(zip(self.fields, row))
+    
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(*) FROM premis_events")[0][0]
+    
+    def __contains__(self, event):
+        return event in list(self)
+    
+    def append(self, event):
+        with self.store.lock:
+            self.store.execute("INSERT INTO premis_events ({}, event_id) VALUES ({})".format(', '.join(self.fields), ', '.join('?' * (len(self.fields) + 1))), [event.get(f) for f in self.fields] + [str(uuid.uuid4())])
+            if self.store.premis_index is not None:
+                self.store.premis_index.setdefault(event['eventType'], []).append(dict(event))
+    
+    def sort(self, key=None):
+        #keep each event's identifier and written flag with it
+        with self.store.lock:
+            self.store.replace_premis(sorted(((event, event_id, written) for seq, event, event_id, written in self.rows()), key=lambda row: key(row[0])))
+    
+    def rows(self):
+        """List of (seq, event dict, event UUID, written flag) in order"""
+        return [(row[0], dict(zip(self.fields, row[1:-2])), row[-2], row[-1]) for row in self.store.execute("SELECT seq, {}, event_id, written FROM premis_events ORDER BY seq".format(', '.join(self.fields)))]
+    
+    def by_type(self, event_type):
+        """Events of one eventType, in order"""
+        with self.store.lock:
+            if self.store.premis_index is None:
+                self.store.premis_index = {}
+                for event in self:
+                    self.store.premis_index.setdefault(event['eventType'], []).append(event)
+            return list(self.store.premis_index.get(event_type, []))
+    
+    def mark_written(self):
+        self.store.execute("UPDATE premis_events SET written=1 WHERE written=0")
+
+class InfoDict:
+    """Dict-like view of an item's info; each assignment is written straight to the store"""
+    def __init__(self, store):
+        self.store = store
+    
+    def __getitem__(self, key):
+        rows = self.store.execute("SELECT value FROM info WHERE key=?", (key,))
+        if not rows:
+            raise KeyError(key)
+        return pickle.loads(rows[0][0])
+    
+    def __setitem__(self, key, value):
+        self.store.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", (key, pickle.dumps(value)))
+    
+    def __delitem__(self, key):
+        with self.store.lock:
+            if self.store.conn.execute("DELETE FROM info WHERE key=?", (key,)).rowcount == 0:
+                raise KeyError(key)
+    
+    def __contains__(self, key):
+        return len(self.store.execute("SELECT 1 FROM info WHERE key=?", (key,))) > 0
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(*) FROM info")[0][0]
+    
+    def __reduce__(self):
+        #pickle (e.g. into sda_status item_stats) as a plain dict
+        return (dict, (dict(self.items()),))
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def pop(self, key, *default):
+        with self.store.lock:
+            try:
+                value = self[key]
+            except KeyError:
+                if default:
+                    return default[0]
+                raise
+            del self[key]
+            return value
+    
+    def keys(self):
+        return [row[0] for row in self.store.execute("SELECT key FROM info ORDER BY rowid")]
+    
+    def items(self):
+        return [(row[0], pickle.loads(row[1])) for row in self.store.execute("SELECT key, value FROM info ORDER BY rowid")]
+    
+    def update(self, values):
+        with self.store.lock, self.store.conn:
+            self.store.conn.execute("BEGIN")
+            for key, value in dict(values).items():
+                self[key] = value
+
+class SdaStatusStore:
+    """SQLite replacement for the sda_status shelve. Stage lists (started, bagged, tarred...) and message dicts (failed, other_action) are rows of stage x identifier with a timestamp, 
+    so membership checks are indexed lookups and a status change is a single row. Other sections (item_stats, format_report, etc.) hold one pickled value per key; 
+    as with a writeback shelve, values that are read or assigned are cached and written back on sync(), but only those values rather than the whole shelve."""
+    def __init__(self, db_file, stages, messages):
+        self.db_file = db_file
+        self.stages = stages
+        self.messages = messages
+        self.cache = {}
+        
+        #the deposit is set up on the main thread and run as a background job
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS status (stage text, identifier text, message text, timestamp text, PRIMARY KEY (stage, identifier))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS record (section text, key text, value blob, PRIMARY KEY (section, key))")
+        self.conn.commit()
+    
+    def __getitem__(self, name):
+        if name in self.stages:
+            return StageList(self, name)
+        elif name in self.messages:
+            return StageDict(self, name)
+        else:
+            return RecordDict(self, name)
+    
+    def __setitem__(self, name, values):
+        #replace a whole section
+        if name in self.stages or name in self.messages:
+            self.conn.execute("DELETE FROM status WHERE stage=?", (name,))
+            if name in self.stages:
+                values = dict.fromkeys(values)
+            for identifier, message in values.items():
+                self.set_status(name, identifier, message)
+        else:
+            self.conn.execute("DELETE FROM record WHERE section=?", (name,))
+            self.cache = {k : v for k, v in self.cache.items() if k[0] != name}
+            for key, value in values.items():
+                self.cache[(name, key)] = value
+    
+    def set_status(self, stage, identifier, message=None):
+        #update the message (and time) if the identifier is already at this stage, without losing its place in the list
+        self.conn.execute("INSERT INTO status VALUES (?, ?, ?, ?) ON CONFLICT (stage, identifier) DO UPDATE SET message=excluded.message, timestamp=excluded.timestamp", (stage, identifier, message, datetime.datetime.now().isoformat()))
+    
+    def flush(self):
+        for (section, key), value in self.cache.items():
+            self.conn.execute("INSERT INTO record VALUES (?, ?, ?) ON CONFLICT (section, key) DO UPDATE SET value=excluded.value", (section, key, pickle.dumps(value)))
+    
+    def sync(self):
+        self.flush()
+        self.conn.commit()
+        self.cache = {}
+    
+    def close(self):
+        self.sync()
+        self.conn.close()
+    
+    def migrate_shelve(self, shelve_file):
+        """Import an sda_status shelve from an earlier session, if this store is still empty"""
+        if not dbm.whichdb(shelve_file):
+            return
+        if self.conn.execute("SELECT EXISTS (SELECT 1 FROM status) OR EXISTS (SELECT 1 FROM record)").fetchone()[0]:
+            return
+        
+        print('\n\tImporting status information from {}...'.format(shelve_file))
+        with shelve.open(shelve_file, flag='r') as db:
+            for name in db.keys():
+                self[name] = db[name]
+        self.sync()
+
+class StageList:
+    """List-like view of the identifiers at one stage, in the order they got there"""
+    def __init__(self, store, stage):
+        self.store = store
+        self.stage = stage
+    
+    def __contains__(self, identifier):
+        return self.store.conn.execute("SELECT 1 FROM status WHERE stage=? AND identifier=?", (self.stage, identifier)).fetchone() is not None
+    
+    def __iter__(self):
+        return iter([row[0] for row in self.store.conn.execute("SELECT identifier FROM status WHERE stage=? ORDER BY rowid", (self.stage,))])
+    
+    def __len__(self):
+        return self.store.conn.execute("SELECT COUNT(*) FROM status WHERE stage=?", (self.stage,)).fetchone()[0]
+    
+    def append(self, identifier):
+        self.store.set_status(self.stage, identifier)
+    
+    def remove(self, identifier):
+        if self.store.conn.execute("DELETE FROM status WHERE stage=? AND identifier=?", (self.stage, identifier)).rowcount == 0:
+            raise ValueError('{} not in {}'.format(identifier, self.stage))
+
+class StageDict(StageList):
+    """Dict-like view of identifiers at one stage with a message for each (failures, other appraisal decisions)"""
+    def __getitem__(self, identifier):
+        row = self.store.conn.execute("SELECT message FROM status WHERE stage=? AND identifier=?", (self.stage, identifier)).fetchone()
+        if row is None:
+            raise KeyError(identifier)
+        return row[0]
+    
+    def __setitem__(self, identifier, message):
+        self.store.set_status(self.stage, identifier, message)
+    
+    def __delitem__(self, identifier):
+        self.remove(identifier)
+    
+    def get(self, identifier, default=None):
+        try:
+            return self[identifier]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        return list(self)
+    
+    def items(self):
+        return [tuple(row) for row in self.store.conn.execute("SELECT identifier, message FROM status WHERE stage=? ORDER BY rowid", (self.stage,))]
+
+class RecordDict:
+    """Dict-like view of one section of pickled values; values are cached by the store until sync()"""
+    def __init__(self, store, section):
+        self.store = store
+        self.section = section
+    
+    def __getitem__(self, key):
+        if not (self.section, key) in self.store.cache:
+            row = self.store.conn.execute("SELECT value FROM record WHERE section=? AND key=?", (self.section, key)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            self.store.cache[(self.section, key)] = pickle.loads(row[0])
+        return self.store.cache[(self.section, key)]
+    
+    def __setitem__(self, key, value):
+        self.store.cache[(self.section, key)] = value
+    
+    def __delitem__(self, key):
+        self[key]
+        self.store.cache.pop((self.section, key), None)
+        self.store.conn.execute("DELETE FROM record WHERE section=? AND key=?", (self.section, key))
+    
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        #write out cached values first so new keys are included, in the order they were added
+        self.store.flush()
+        return [row[0] for row in self.store.conn.execute("SELECT key FROM record WHERE section=? ORDER BY rowid", (self.section,))]
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+class FixityStatusStore:
+    """Results of fixity sweeps for a unit: one row per target (a barcode folder or a SIP) with the outcome and time of its last check.
+    A target that was cut off by the time budget or a cancelled job keeps its position (files checked, in manifest order) and failures so far, so the next sweep resumes it."""
+    fields = ('status', 'message', 'position', 'files', 'failed', 'failures', 'kind', 'last_checked')
+    
+    def __init__(self, db_file):
+        self.db_file = db_file
+        
+        #the sweep is set up on the main thread and run as a background job
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS targets (target text primary key, kind text, shipment_date text, identifier text, status text, message text, position integer default 0, files integer default 0, failed integer default 0, failures text, last_checked real)")
+        self.conn.commit()
+    
+    def get(self, target):
+        row = self.conn.execute("SELECT {} FROM targets WHERE target=?".format(', '.join(self.fields)), (target['key'],)).fetchone()
+        if row:
+            record = dict(zip(self.fields, row))
+            record['failures'] = json.loads(record['failures'] or '[]')
+            return record
+    
+    def save(self, target, status, message=None, position=0, files=0, failed=0, failures=()):
+        """Record a target's progress ('in progress') or the outcome of its check ('passed' or 'failed')"""
+        last_checked = None if status == 'in progress' else time.time()
+        self.conn.execute("INSERT INTO targets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (target) DO UPDATE SET kind=excluded.kind, status=excluded.status, message=excluded.message, position=excluded.position, files=excluded.files, failed=excluded.failed, failures=excluded.failures, last_checked=COALESCE(excluded.last_checked, last_checked)", (target['key'], target['kind'], target['shipment_date'], target['identifier'], status, message, position, files, failed, json.dumps(list(failures)), last_checked))
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+'''WORKBOOK SESSIONS'''
+#rules for mapping spreadsheet headers to metadata keys, checked in order (first match wins): 'in' = substring of lowercased header; 'strip' = stripped, lowercased header equals text; 'equals' = lowercased header equals text
+SPREADSHEET_COLUMNS = [
+    ('in', 'identifier', 'identifier'),
+    ('strip', 'unit', 'unit_name'),
+    ('strip', 'shipmentid', 'shipment_date'),
+    ('in', 'accession', 'accession_number'),
+    ('in', 'collection title', 'collection_title'),
+    ('in', 'collection id', 'collection_id'),
+    ('in', 'creator', 'collection_creator'),
+    ('in', 'physical location', 'phys_loc'),
+    ('in', 'source type', 'content_source_type'),
+    ('strip', 'title', 'item_title'),
+    ('in', 'label transcription', 'label_transcription'),
+    ('strip', 'description', 'item_description'),
+    ('in', 'appraisal notes', 'appraisal_notes'),
+    ('in', 'content date range', 'assigned_dates'),
+    ('in', 'instructions', 'bdpl_instructions'),
+    ('in', 'restriction statement', 'restriction_statement'),
+    ('in', 'restriction end date', 'restriction_end_date'),
+    ('in', 'move directly to sda', 'initial_appraisal'),
+    ('in', 'transfer method', 'transfer_method'),
+    ('in', 'migration date', 'migration_date'),
+    ('in', 'migration notes', 'technician_note'),
+    ('in', 'migration outcome', 'migration_outcome'),
+    ('in', 'extent (normalized)', 'extent_normal'),
+    ('in', 'extent (raw)', 'extent_raw'),
+    ('in', 'extracted files extent', 'extent_raw'),
+    ('in', 'no. of files', 'item_file_count'),
+    ('in', 'extracted files number', 'item_file_count'),
+    ('in', 'no. of duplicate files', 'item_duplicate_count'),
+    ('in', 'no. of unidentified files', 'item_unidentified_count'),
+    ('in', 'file formats', 'format_overview'),
+    ('in', 'begin date', 'begin_date'),
+    ('equals', 'end date', 'end_date'),
+    ('in', 'virus status', 'virus_scan_results'),
+    ('in', 'pii status', 'pii_scan_results'),
+    ('in', 'full report', 'full_report'),
+    ('in', 'link to transfer', 'transfer_link'),
+    ('in', 'appraisal results', 'final_appraisal'),
+    ('in', 'job type', 'job_type'),
+    #additional elements for master_spreadsheet 'Item' sheet
+    ('in', 'sip creation date', 'sip_creation_date'),
+    ('in', 'sip extent', 'sip_extent'),
+    ('in', 'sip md5', 'sip_md5'),
+    ('in', 'sip filename', 'sip_filename'),
+    #additional elements for master_spreadsheet 'Cumulative'
+    ('in', 'sip count', 'sip_count'),
+    ('in', 'sips extent', 'sips_extent'),
+    ('in', 'ingest start date', 'ingest_start_date'),
+    ('equals', 'ingest end date', 'ingest_end_date'),
+    ('in', 'ingest duration', 'ingest_duration'),
+]
+
+def match_column(header):
+    """Return the metadata key for a spreadsheet header, or None"""
+    lower = str(header).lower()
+    for test, text, key in SPREADSHEET_COLUMNS:
+        if test == 'in' and text in lower:
+            return key
+        elif test == 'strip' and lower.strip() == text:
+            return key
+        elif test == 'equals' and lower == text:
+            return key
+
+class SheetIndex:
+    """Lookups for one worksheet, built in a single pass: identifier -> row (unit/shipment -> row for 'Cumulative') and the header -> column map.
+    Rows added through add() keep the index current; if the sheet grows any other way the index is rebuilt."""
+    def __init__(self, ws):
+        self.ws = ws
+        self.rows = {}
+        self.columns = {}
+        
+        for cell in ws[1]:
+            if not cell.value is None:
+                key = match_column(cell.value)
+                if key:
+                    self.columns[key] = cell.column
+        
+        for row, values in enumerate(ws.iter_rows(min_row=2, max_col=2, values_only=True), 2):
+            if ws.title == 'Cumulative':
+                if not values[0] is None and not values[1] is None:
+                    self.rows.setdefault((values[0], values[1]), row)
+            elif not values[0] is None:
+                self.rows.setdefault(str(values[0]).strip(), row)
+        
+        self.max_row = ws.max_row
+    
+    def current(self, ws):
+        return ws is self.ws and ws.max_row == self.max_row
+    
+    def find(self, key):
+        return self.rows.get(key)
+    
+    def find_shipment(self, unit_name, shipment_date):
+        #shipments are matched on substrings of the unit and shipment cells; check for an exact match first
+        if (unit_name, shipment_date) in self.rows:
+            return self.rows[(unit_name, shipment_date)]
+        for (unit, shipment), row in self.rows.items():
+            if unit_name in unit and shipment_date in shipment:
+                return row
+    
+    def add(self, key, row):
+        self.rows.setdefault(key, row)
+        self.max_row = max(self.max_row, self.ws.max_row)
+
+class ShipmentMetadata:
+    """Inventory and Appraisal rows for a whole shipment, read with one values_only pass per worksheet and kept as tuples keyed by identifier, so batch jobs can load item metadata without going back to openpyxl"""
+    sheets = ('Inventory', 'Appraisal')
+    
+    def __init__(self, session):
+        self.columns = {}
+        self.records = {}
+        
+        for sheet in self.sheets:
+            rows = session.read_rows(sheet)
+            
+            self.columns[sheet] = {}
+            if rows:
+                for column, header in enumerate(rows[0], 1):
+                    if not header is None:
+                        key = match_column(header)
+                        if key:
+                            self.columns[sheet][key] = column
+            
+            #as with return_row, the first row for an identifier wins
+            self.records[sheet] = {}
+            for values in rows[1:]:
+                if values and not values[0] is None:
+                    self.records[sheet].setdefault(str(values[0]).strip(), values)
+    
+    def get(self, sheet, identifier):
+        """Return (found, {key : value}) for an identifier; values are None if the identifier isn't on the sheet"""
+        values = self.records[sheet].get(identifier)
+        
+        if values is None:
+            return False, dict.fromkeys(self.columns[sheet])
+        else:
+            return True, {key : (values[column-1] if column <= len(values) else None) for key, column in self.columns[sheet].items()}
+    
+    def update(self, sheet, identifier, values):
+        """Apply {column : value} written to the worksheet"""
+        row = list(self.records[sheet].get(identifier, [identifier]))
+        
+        for column, value in values.items():
+            row.extend([None] * (column - len(row)))
+            row[column-1] = value
+        
+        self.records[sheet][identifier] = tuple(row)
+
+class WorkbookSession:
+    """Keeps a spreadsheet loaded between operations so it isn't reloaded for every item. Row updates are applied to the loaded workbook and tracked by identifier;
+    outside a batch they are saved right away, inside a batch they are saved every flush_every rows / flush_seconds and when the batch ends. Saves go to a temp file that replaces the original.
+    Batches belong to the thread that opened them: a background job's batch doesn't hold back writes made from the interface. Callers flush before recording that a row has been written."""
+
+    #one session per spreadsheet path
+    sessions = {}
+    registry_lock = threading.Lock()
+
+    #number of open batches on each thread; see batch()
+    batch_state = threading.local()
+
+    def __init__(self, path, flush_every=25, flush_seconds=120):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.wb = None
+        self.loaded_mtime = None
+        self.pending = {}
+        self.indexes = {}
+        self.metadata = None
+        self.last_flush = time.time()
+        
+        #items processed on pool threads share the session; hold this while reading or updating it (see Spreadsheet.locked)
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get(cls, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with cls.registry_lock:
+            if not key in cls.sessions:
+                cls.sessions[key] = cls(path)
+            return cls.sessions[key]
+
+    @classmethod
+    @contextlib.contextmanager
+    def batch(cls):
+        """Hold back saves of this thread's writes until the batch is done (or a flush threshold is reached)"""
+        cls.batch_state.depth = cls.batch_depth() + 1
+        try:
+            yield
+        finally:
+            cls.batch_state.depth -= 1
+            if cls.batch_state.depth == 0:
+                cls.flush_all()
+
+    @classmethod
+    def batch_depth(cls):
+        return getattr(cls.batch_state, 'depth', 0)
+
+    @classmethod
+    def flush_all(cls):
+        for session in list(cls.sessions.values()):
+            session.flush()
+
+    def mtime(self):
+        if os.path.exists(self.path):
+            return os.path.getmtime(self.path)
+
+    def load(self):
+        """Return the loaded workbook; (re)load it if it hasn't been loaded yet or if the file was changed by someone else since we last loaded or saved it"""
+        if self.wb is None or (not self.pending and self.mtime() != self.loaded_mtime):
+            if os.path.exists(self.path):
+                self.wb = openpyxl.load_workbook(self.path)
+            else:
+                self.wb = openpyxl.Workbook()
+            self.loaded_mtime = self.mtime()
+            self.indexes = {}
+            self.metadata = None
+        return self.wb
+    
+    def index(self, ws):
+        """Return the SheetIndex for ws, building it if needed"""
+        if not ws.title in self.indexes or not self.indexes[ws.title].current(ws):
+            self.indexes[ws.title] = SheetIndex(ws)
+        return self.indexes[ws.title]
+
+    def read_rows(self, sheet_name, **kwargs):
+        """Return cell values for a read-only pass over one worksheet. Uses the loaded workbook if it is current; otherwise the file is opened read-only and closed again"""
+        if self.wb is not None and (self.pending or self.mtime() == self.loaded_mtime):
+            return list(self.wb[sheet_name].iter_rows(values_only=True, **kwargs))
+
+        wb = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            return list(wb[sheet_name].iter_rows(values_only=True, **kwargs))
+        finally:
+            wb.close()
+
+    def update_row(self, ws, identifier, row, values):
+        """Write {column : value} to a row of ws and record the update under the identifier"""
+        for column, value in values.items():
+            ws.cell(row=row, column=column, value=value)
+
+        self.pending.setdefault((ws.title, identifier), {}).update(values)
+        
+        #keep bulk-loaded shipment metadata in step with the sheet
+        if self.metadata is not None and ws.title in self.metadata.records:
+            self.metadata.update(ws.title, identifier, values)
+        
+        self.commit()
+
+    def touch(self, key):
+        """Record a change made directly to the workbook (appended rows, new sheets, etc.)"""
+        self.pending[key] = True
+
+    def commit(self):
+        #save now unless we're in a batch; batches save when a threshold is reached
+        if WorkbookSession.batch_depth() == 0 or len(self.pending) >= self.flush_every or time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending or self.wb is None:
+                return
+
+            temp_file = '{}.tmp'.format(self.path)
+            self.wb.save(temp_file)
+            os.replace(temp_file, self.path)
+
+            self.loaded_mtime = self.mtime()
+            self.pending = {}
+            self.last_flush = time.time()
+
+'''ANALYSIS STAGES'''
+class StageScheduler:
+    """Runs analysis stages on threads as soon as their dependencies have finished and there is room in the CPU and I/O budgets. 
+    Each stage declares its CPU cost (cores it keeps busy) and I/O cost (full passes over the content it makes); a stage that costs more than a whole budget runs once nothing else is using it."""
+    def __init__(self, controller, cpu_budget, io_budget):
+        self.controller = controller
+        self.cpu_budget = cpu_budget
+        self.io_budget = io_budget
+        self.stages = OrderedDict()
+        self.timings = OrderedDict()
+    
+    def add(self, name, func, args=(), deps=(), cpu=1, io=1):
+        self.stages[name] = {'func' : func, 'args' : args, 'deps' : deps, 'cpu' : min(cpu, self.cpu_budget), 'io' : min(io, self.io_budget)}
+    
+    def ready(self, name, done):
+        #dependencies that weren't scheduled (e.g., already completed in an earlier session) don't hold a stage back
+        return all(dep in done or not dep in self.stages for dep in self.stages[name]['deps'])
+    
+    def run_stage(self, name):
+        start = time.time()
+        stage = self.stages[name]
+        stage['func'](*stage['args'])
+        return time.time() - start
+    
+    def run(self):
+        """Run all stages; returns {stage : wall time in seconds}. If a stage fails or the job is cancelled, running stages are allowed to finish and the error is raised"""
+        waiting = list(self.stages)
+        running = {}
+        done = set()
+        cpu_used = io_used = 0
+        error = None
+        
+        with concurrent.futures.ThreadPoolExecutor(max(1, len(self.stages))) as executor:
+            while waiting or running:
+                
+                #start whatever fits, in the order stages were added
+                if error is None:
+                    try:
+                        self.controller.checkpoint()
+                    except JobCancelled as e:
+                        error = e
+                
+                if error is None:
+                    for name in list(waiting):
+                        stage = self.stages[name]
+                        if self.ready(name, done) and cpu_used + stage['cpu'] <= self.cpu_budget and io_used + stage['io'] <= self.io_budget:
+                            print('\n\tStarting {}...'.format(name))
+                            running[executor.submit(self.controller.job_thread(self.run_stage), name)] = name
+                            waiting.remove(name)
+                            cpu_used += stage['cpu']
+                            io_used += stage['io']
+                
+                if not running:
+                    break
+                
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    cpu_used -= self.stages[name]['cpu']
+                    io_used -= self.stages[name]['io']
+                    try:
+                        self.timings[name] = future.result()
+                        done.add(name)
+                        print('\n\t{} finished ({:.1f} seconds)'.format(name, self.timings[name]))
+                    except Exception as e:
+                        print('\n\t{} failed: {}'.format(name, e))
+                        if error is None:
+                            error = e
+        
+        if error is not None:
+            raise error
+        
+        return self.timings
+
+'''SDA DEPOSIT PIPELINE'''
+#stage functions run on SdaBatchDeposit's worker pools; each takes a job dict of paths and settings and returns (status, result or failure message)
+
+def sda_bag_item(job):
+    """Bag a barcode folder and work out the size of its tar"""
+    try:
+        #make sure we haven't added a temp_dir if we had to restart packaging
+        if os.path.exists(job['temp_dir']):
+            shutil.rmtree(job['temp_dir'])
+        
+        bag_builder = BagBuilder(job['barcode_dir'], job['identifier'], job['dfxml_output'], job['fixity_workers'], job['hash_cache_db'])
+        bag_builder.make_bag(job['bag_info'])
+    
+    except (RuntimeError, PermissionError, bagit.BagError, OSError) as e:
+        return (False, 'bagit\t{}'.format(e))
+    
+    return sda_plan_item(job)
+
+def sda_plan_item(job):
+    """Calculate the exact size of an item's tar"""
+    try:
+        #make sure we haven't added a temp_dir to our bag...
+        if os.path.exists(job['temp_dir']):
+            shutil.rmtree(job['temp_dir'])
+        
+        sip_writer = SipWriter(job['barcode_dir'], job['identifier'], job['sip_file'])
+        return (True, SpacePlanner().tar_size(sip_writer))
+    
+    except (PermissionError, OSError) as e:
+        return (False, 'space check\t{}'.format(e))
+
+def sda_tar_item(job):
+    """Write an item's tar straight to the Archiver folder; returns SIP stats"""
+    try:
+        sip_writer = SipWriter(job['barcode_dir'], job['identifier'], job['sip_file'], tree_hash_file=job.get('tree_hash_file'))
+        return (True, sip_writer.write())
+    
+    except (RuntimeError, PermissionError, IOError, EnvironmentError) as e:
+        return (False, 'tar\t{}'.format(e))
+
+def sda_move_item(job):
+    """Get stats on a tar left in the shipment folder by an earlier version and move it to the Archiver folder"""
+    try:
+        file_dict = hash_large_file(job['tar_file'], tree_hash=bool(job.get('tree_hash_file')))
+        if job.get('tree_hash_file'):
+            file_dict['tree_hash'].save(job['tree_hash_file'])
+        
+        sip_stats = {'sip_extent' : os.path.getsize(job['tar_file']), 'sip_md5' : file_dict['md5'], 'sip_filename' : os.path.basename(job['tar_file']), 'sip_creation_date' : datetime.datetime.fromtimestamp(os.path.getmtime(job['tar_file'])).isoformat()}
+        
+        shutil.move(job['tar_file'], job['sip_file'])
+    
+    except (RuntimeError, PermissionError, IOError, EnvironmentError) as e:
+        return (False, 'move\t{}'.format(e))
+    
+    return (True, sip_stats)
+
+def sda_clean_item(job):
+    """Remove the original barcode folder"""
+    cmd = 'RD /S /Q "{}"'.format(job['barcode_dir'])
+    try:
+        subprocess.check_output(cmd, shell=True)
+    
+    except (PermissionError, subprocess.CalledProcessError, OSError) as e:
+        return (False, 'clean_original\t{}'.format(e))
+    
+    return (True, None)
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint (controller.checkpoint()) when the technician has cancelled the running job"""
+    pass
 
 class Unit:
     def __init__(self, controller):
@@ -134,6 +2256,17 @@ class DigitalObject(Shipment):
         self.controller = controller
         self.identifier = self.controller.identifier.get()
         self.skip_folders = skip_folders
+        self.fixity_workers = self.controller.fixity_workers
+        
+        #analysis tools run side by side within these budgets: cores, and tools reading through the content at once
+        self.analysis_cpu_budget = os.cpu_count() or 2
+        self.analysis_io_budget = 4
+        
+        #DFXML for disk images: 'fiwalk' (falls back to tsk_loaddb if fiwalk fails) or 'tsk_loaddb'
+        self.dfxml_tool = 'fiwalk'
+        self.bulkext_threads = max(1, self.analysis_cpu_budget // 2 - 1)
+        
+        self.hash_cache_db = os.path.join(self.controller.bdpl_work_dir, 'hash_cache.sqlite')
 
         '''SET VARIABLES'''
         #main folders
@@ -181,6 +2314,8 @@ class DigitalObject(Shipment):
         self.cumulative_be_report = os.path.join(self.bulkext_dir, 'cumulative.txt')
         self.lsdvd_temp = os.path.join(self.temp_dir, 'lsdvd.txt')
         self.temp_dfxml = os.path.join(self.temp_dir, 'temp_dfxml.txt')
+        self.dfxml_records = None
+        self.tsk_db = os.path.join(self.temp_dir, 'tsk_loaddb.db')
         self.dummy_audio = os.path.join(self.temp_dir, 'added_silence.mpg')
         self.cdr_scan = os.path.join(self.temp_dir, 'cdr_scan.txt')
         self.droid_profile = os.path.join(self.temp_dir, 'droid.droid')
@@ -195,6 +2330,8 @@ class DigitalObject(Shipment):
         self.final_stats = os.path.join(self.temp_dir, 'final_stats.txt')
         self.checksums_dvd = os.path.join(self.temp_dir, 'checksums_dvd.txt')
         self.checksums = os.path.join(self.temp_dir, 'checksums.txt')
+        self.file_stats_db = os.path.join(self.temp_dir, 'file_stats.sqlite')
+        self.stats_cache = os.path.join(self.temp_dir, 'stats_cache.txt')
 
         #metadata files
         self.dfxml_output = os.path.join(self.metadata_dir, '{}-dfxml.xml'.format(self.identifier))
@@ -204,9 +2341,10 @@ class DigitalObject(Shipment):
         if not self.skip_folders and not self.check_ingest_folders(): 
             self.create_folders() 
         
-        #set up shelve
+        #set up item state store; bring in the shelve used by earlier versions, if there is one
         self.temp_info = os.path.join(self.item_ingest_info, '{}-info'.format(self.identifier))
-        self.db = shelve.open(self.temp_info, writeback=True)    
+        self.db = ItemStateStore('{}.sqlite'.format(self.temp_info))
+        self.db.migrate_shelve(self.temp_info)
 
         if not 'premis' in list(self.db.keys()):
             
@@ -242,16 +2380,17 @@ class DigitalObject(Shipment):
                 return (status, msg)
             
         #open spreadsheet and make sure current item exists in spreadsheet; if not, return
-        shipment_spreadsheet.open_wb()
-        status, row = shipment_spreadsheet.return_row(shipment_spreadsheet.inv_ws)
-        #if status is False, then barcode doesn't exist in spreadsheet.  Close shelve and delete created folders
-        if not status:
-            self.db.close()
-            self.delete_folders()
-            return (False, '\n\nWARNING: barcode was not found in spreadsheet.  Make sure value is entered correctly and/or check spreadsheet for value.  Consult with digital preservation librarian as needed.')
-        
-        #load metadata into item object
-        self.load_item_metadata(shipment_spreadsheet)
+        with shipment_spreadsheet.locked():
+            shipment_spreadsheet.open_wb()
+            status, row = shipment_spreadsheet.return_row(shipment_spreadsheet.inv_ws, self.identifier)
+            #if status is False, then barcode doesn't exist in spreadsheet.  Close shelve and delete created folders
+            if not status:
+                self.db.close()
+                self.delete_folders()
+                return (False, '\n\nWARNING: barcode was not found in spreadsheet.  Make sure value is entered correctly and/or check spreadsheet for value.  Consult with digital preservation librarian as needed.')
+            
+            #load metadata into item object
+            self.load_item_metadata(shipment_spreadsheet)
         
         #assign variables to GUI
         if self.controller.get_current_tab() == 'BDPL Ingest':
@@ -293,17 +2432,17 @@ class DigitalObject(Shipment):
             self.db['info']['unit_name'] = self.unit_name
             self.db['info']['shipment_date'] = self.shipment_date
             
-        #get info from inventory and appraisal sheets
-        for ws in (shipment_spreadsheet.inv_ws, shipment_spreadsheet.app_ws):
-                   
-            ws_columns = shipment_spreadsheet.get_spreadsheet_columns(ws)
+        #get info from inventory and appraisal sheets; these are read for the whole shipment at once
+        metadata = shipment_spreadsheet.shipment_metadata()
+        
+        for sheet in ShipmentMetadata.sheets:
         
-            status, row = shipment_spreadsheet.return_row(ws)
+            status, values = metadata.get(sheet, self.identifier)
             
-            if ws == shipment_spreadsheet.app_ws and not status:
+            if sheet == 'Appraisal' and not status:
                 pass
             else:
-                for key in ws_columns.keys():
+                for key in values.keys():
                     if key == 'identifier':
                         self.db['info']['identifier'] = self.identifier
                     
@@ -316,7 +2455,7 @@ class DigitalObject(Shipment):
                             pass
                             
                     else:
-                        _val = ws.cell(row=row, column=ws_columns[key]).value
+                        _val = values[key]
                         
                         if _val is None or str(_val).lower() in [' ', '', 'n/a', 'none']:
                             self.db['info'][key] = '-'
@@ -563,7 +2702,7 @@ class DigitalObject(Shipment):
             if os.stat(imagefile).st_size > 0:
                 exitcode = 0
             else:
-                messagebox.showwarning(title='WARNING', message='Disk image not successfully created. Verify you have selected the correct disk type and try again (if possible).  Otherwise, indicate issues in note to collecting unit.', master=self)
+                self.controller.alert('WARNING', 'Disk image not successfully created. Verify you have selected the correct disk type and try again (if possible).  Otherwise, indicate issues in note to collecting unit.')
                 return
         
         #record event in PREMIS metadata
@@ -813,90 +2952,69 @@ class DigitalObject(Shipment):
     def produce_dfxml(self, target):
     
         timestamp = str(datetime.datetime.now())
-        file_stats = []
         
-        #use fiwalk if we have an image file
+        #use fiwalk if we have an image file; fall back to tsk_loaddb if fiwalk fails (or if the item is set to use tsk_loaddb)
         if os.path.isfile(target):
-            print('\n\nDIGITAL FORENSICS XML CREATION: FIWALK')
-            dfxml_ver_cmd = 'fiwalk-0.6.3 -V'
-            dfxml_ver = subprocess.check_output(dfxml_ver_cmd, shell=True, text=True).splitlines()[0]
-            dfxml_cmd = 'fiwalk-0.6.3 -x {} > {}'.format(target, self.dfxml_output)
-            exitcode = subprocess.call(dfxml_cmd, shell=True, text=True)
-                    
-            #parse dfxml to get info for later; because large DFXML files pose a challenge; use iterparse to avoid crashing (Note: for DVD jobs we will also get stats on the files themselves later on) 
-            print('\n\tCollecting file statistics...\n')
-            counter = 0
-            for event, element in etree.iterparse(self.dfxml_output, events = ("end",), tag="fileobject"):
-                
-                #refresh dict for each fileobject
-                file_dict = {}
+            exitcode = 1
+            if self.dfxml_tool == 'fiwalk':
+                print('\n\nDIGITAL FORENSICS XML CREATION: FIWALK')
+                dfxml_ver_cmd = 'fiwalk-0.6.3 -V'
+                dfxml_ver = subprocess.check_output(dfxml_ver_cmd, shell=True, text=True).splitlines()[0]
+                dfxml_cmd = 'fiwalk-0.6.3 -x {} > {}'.format(target, self.dfxml_output)
+                exitcode = subprocess.call(dfxml_cmd, shell=True, text=True)
                 
-                #default values; will make sure that we don't record info about non-allocated files and that we have a default timestamp value
-                good = True
-                mt = False
-                mtime = 'undated'
-                target = ''
-                size = ''
-                checksum = ''
+                if exitcode != 0 or not self.dfxml_complete():
+                    print('\n\tfiwalk did not complete; trying tsk_loaddb...')
+            
+            if exitcode != 0 or not self.dfxml_complete():
+                print('\n\nDIGITAL FORENSICS XML CREATION: TSK_LOADDB')
+                dfxml_ver = '{}; https://github.com/IUBLibTech/bdpl_ingest'.format(subprocess.run('tsk_loaddb -V', shell=True, text=True, capture_output=True).stdout.strip())
+                status, msg = dfxml_from_tskloaddb.tsk_loaddb(target, self.tsk_db)
+                if not status:
+                    print('\n\t{}'.format(msg))
+                    self.record_premis(timestamp, 'message digest calculation', 1, 'tsk_loaddb -h -d "{}" "{}"'.format(self.tsk_db, target), msg, dfxml_ver)
+                    return
                 
-                for child in element:
+                dfxml_cmd = '{}; dfxml_from_tskloaddb.py'.format(msg)
+                status, msg = dfxml_from_tskloaddb.dfxml_from_tskdb(self.tsk_db, self.dfxml_output, target, self.disktype_output, self.fsstat_output)
+                if not status:
+                    print('\n\t{}'.format(msg))
+                    self.record_premis(timestamp, 'message digest calculation', 1, dfxml_cmd, msg, dfxml_ver)
+                    return
+            
+            #for DVD jobs, save info from disk image checksums to a separate table; we will get stats on the files themselves later on
+            if self.job_type == 'DVD':
+                file_stats = FileStatsStore(self.file_stats_db, 'dvd_stats')
+            else:
+                file_stats = FileStatsStore(self.file_stats_db)
+            file_stats.clear()
                     
-                    if child.tag == "filename":
-                        target = child.text
-                    if child.tag == "name_type":
-                        if child.text != "r":
-                            element.clear()
-                            good = False
-                            break
-                    if child.tag == "alloc":
-                        if child.text != "1":
-                            good = False
-                            element.clear()
-                            break
-                    if child.tag == "unalloc":
-                        if child.text == "1":
-                            good = False
-                            element.clear()
-                            break
-                    if child.tag == "filesize":
-                        size = child.text
-                    if child.tag == "hashdigest":
-                        if child.attrib['type'] == 'md5':
-                            checksum = child.text
-                    if child.tag == "mtime":
-                        mtime = datetime.datetime.utcfromtimestamp(int(child.text)).isoformat()
-                        mt = True
-                    if child.tag == "crtime" and mt == False:
-                        mtime = datetime.datetime.utcfromtimestamp(int(child.text)).isoformat()
+            #parse dfxml to get info for later; the records are kept so fix_dates doesn't have to parse it again
+            print('\n\tCollecting file statistics...\n')
+            counter = 0
+            for file_dict in self.read_dfxml().file_stats():
+                file_stats.add(file_dict)
                 
-                if good and not '' in file_dict.values():
-                    file_dict = { 'name' : target, 'size' : size, 'mtime' : mtime, 'checksum' : checksum}
-                    file_stats.append(file_dict)
-                    
-                    counter+=1            
+                counter+=1
+                if counter % 1000 == 0:
                     print('\r\tWorking on file #: {}'.format(counter), end='')
-
-                element.clear()
+            
+            print('\r\tWorking on file #: {}'.format(counter), end='')
+            
+            file_stats.commit()
                 
             if self.job_type == 'DVD':
-            
-                #save info from DVD checksums to separate file
-                with open (self.checksums_dvd, 'wb') as f:
-                    pickle.dump(file_stats, f)
+                file_stats.close()
                 
                 #now compile stats for the normalized file versions
-                file_stats = []
-                for f in os.listdir(self.files_dir):
-                    file = os.path.join(self.files_dir, f)
-                    file_dict = {}
-                    size = os.path.getsize(file)
-                    mtime = datetime.datetime.fromtimestamp(os.path.getmtime(file)).isoformat()
-                    ctime = datetime.datetime.fromtimestamp(os.path.getctime(file)).isoformat()
-                    atime = datetime.datetime.fromtimestamp(os.path.getatime(file)).isoformat()[:-7]
-                    checksum = self.md5(file)
-                    
-                    file_dict = { 'name' : file, 'size' : size, 'mtime' : mtime, 'ctime' : ctime, 'atime' : atime, 'checksum' : checksum}
-                    file_stats.append(file_dict)  
+                file_stats = FileStatsStore(self.file_stats_db)
+                file_stats.clear()
+                hash_cache = HashCache(self.hash_cache_db)
+                fixity = FixityEngine(self.fixity_workers, cache=hash_cache)
+                for file_dict in fixity.hash_files(os.path.join(self.files_dir, f) for f in os.listdir(self.files_dir)):
+                    file_dict['checksum'] = file_dict['md5']
+                    file_stats.add(file_dict)  
+                hash_cache.close()
      
         #use custom operation for other cases    
         elif os.path.isdir(target):
@@ -907,103 +3025,91 @@ class DigitalObject(Shipment):
             
             timestamp = str(datetime.datetime.now().isoformat())
             
-            done_list = []
-
+            file_stats = FileStatsStore(self.file_stats_db)
+            file_stats.clear()
+            
+            #if we crashed earlier, reload stats for files that were already completed
             if os.path.exists(self.temp_dfxml):
                 with open(self.temp_dfxml, 'r', encoding='utf-8') as f:
-                    done_so_far = f.read().splitlines()
-                    for d in done_so_far:
-                        line = d.split(' | ')
-                        done_list.append(line[0])
+                    for d in f:
+                        line = d.rstrip('\n').split(' | ')
                         file_dict = { 'name' : line[0], 'size' : line[1], 'mtime' : line[2], 'ctime' : line[3], 'atime' : line[4], 'checksum' : line[5], 'counter' : line[6] }
-                        file_stats.append(file_dict)
+                        
+                        #logs from earlier versions only recorded md5
+                        if len(line) > 8:
+                            file_dict['sha1'] = line[7]
+                            file_dict['sha256'] = line[8]
+                        file_stats.add(file_dict)
+                file_stats.commit()
             
-            if len(file_stats) > 0:
-                counter = int(file_stats[-1]['counter'])
-            else:
-                counter = 0
+            counter = file_stats.last_counter()
             
             print('\n')
             
-            #get total number of files
-            total = sum([len(files) for r, d, files in os.walk(target)])
+            #list the folder once, in sorted order (see walk_to_dfxml.walk_entries), and get total number of files
+            files = [file_target for file_target, entry in walk_to_dfxml.walk_entries(target) if entry.is_file()]
+            total = len(files)
             
-            #now loop through, keeping count
-            for root, dirnames, filenames in os.walk(target):
-                for file in filenames:
-                    
-                    #check to make sure that we haven't already added info for this file
-                    file_target = os.path.join(root, file)
-                    
-                    if file_target in done_list:
-                        continue
+            #hand off files that we haven't already added info for; results come back in walk order so counter and DFXML stay the same
+            def pending_files():
+                for file_target in files:
+                    if not file_target in file_stats:
+                        yield file_target
+            
+            hash_cache = HashCache(self.hash_cache_db)
+            fixity = FixityEngine(self.fixity_workers, cache=hash_cache)
+            
+            with DfxmlWriter(self.dfxml_output, timestamp) as dfxml, open(self.temp_dfxml, 'a', encoding='utf8') as f:
+                
+                #write out anything completed before a crash, then add each file as soon as it is hashed
+                for file_dict in file_stats:
+                    dfxml.write_fileobject(file_dict)
+                
+                for file_dict in fixity.hash_files(pending_files()):
                     
                     counter += 1
                     print('\r\tCalculating checksum for file {} out of {}'.format(counter, total), end='')
                     
-                    size = os.path.getsize(file_target)
-                    mtime = datetime.datetime.fromtimestamp(os.path.getmtime(file_target)).isoformat()
-                    ctime = datetime.datetime.fromtimestamp(os.path.getctime(file_target)).isoformat()
-                    atime = datetime.datetime.fromtimestamp(os.path.getatime(file_target)).isoformat()[:-7]
-                    checksum = self.md5(file_target)
-                    file_dict = { 'name' : file_target, 'size' : size, 'mtime' : mtime, 'ctime' : ctime, 'atime' : atime, 'checksum' : checksum, 'counter' : counter }                 
-                    file_stats.append(file_dict)
-                    done_list.append(file_target)
+                    file_dict['checksum'] = file_dict['md5']
+                    file_dict['counter'] = counter
+                    file_stats.add(file_dict)
+                    dfxml.write_fileobject(file_dict)
                     
                     #save this list to file just in case we crash...
-                    raw_stats = "{} | {} | {} | {} | {} | {} | {}\n".format(file_target, size, mtime, ctime, atime, checksum, counter)
-                    with open(self.temp_dfxml, 'a', encoding='utf8') as f:
-                        f.write(raw_stats)
+                    raw_stats = "{} | {} | {} | {} | {} | {} | {} | {} | {}\n".format(file_dict['name'], file_dict['size'], file_dict['mtime'], file_dict['ctime'], file_dict['atime'], file_dict['checksum'], counter, file_dict['sha1'], file_dict['sha256'])
+                    f.write(raw_stats)
+                    f.flush()
             
+            hash_cache.close()
             print('\n')
-            
-            dc_namespace = 'http://purl.org/dc/elements/1.1/'
-            dc = "{%s}" % dc_namespace
-            NSMAP = {None : 'http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML',
-                    'xsi': "http://www.w3.org/2001/XMLSchema-instance",
-                    'dc' : dc_namespace}
-            dfxml = etree.Element("dfxml", nsmap=NSMAP, version="1.0")
-            metadata = etree.SubElement(dfxml, "metadata")
-            dctype = etree.SubElement(metadata, dc + "type")
-            dctype.text = "Hash List"
-            creator = etree.SubElement(dfxml, 'creator')
-            program = etree.SubElement(creator, 'program')
-            program.text = 'bdpl_ingest'
-            execution_environment = etree.SubElement(creator, 'execution_environment')
-            start_time = etree.SubElement(execution_environment, 'start_time')
-            start_time.text = timestamp
-            
-            for f in file_stats:
-                fileobject = etree.SubElement(dfxml, 'fileobject')
-                filename = etree.SubElement(fileobject, 'filename')
-                filename.text = f['name']
-                filesize = etree.SubElement(fileobject, 'filesize')
-                filesize.text = str(f['size'])
-                modifiedtime = etree.SubElement(fileobject, 'mtime')
-                modifiedtime.text = f['mtime']
-                createdtime = etree.SubElement(fileobject, 'ctime')
-                createdtime.text = f['ctime']
-                accesstime = etree.SubElement(fileobject, 'atime')
-                accesstime.text = f['atime']
-                hashdigest = etree.SubElement(fileobject, 'hashdigest', type='md5')
-                hashdigest.text = f['checksum']
-
-            tree = etree.ElementTree(dfxml)
-            tree.write(self.dfxml_output, pretty_print=True, xml_declaration=True, encoding="utf-8")      
         
         else:
-            messagebox.showwarning(title='WARNING', message='{} does not appear to exist...'.format(target), master=self)
+            self.controller.alert('WARNING', '{} does not appear to exist...'.format(target))
             return
         
         #save stats for reporting...            
-        with open (self.checksums, 'wb') as f:
-            pickle.dump(file_stats, f)
+        file_stats.commit()
+        file_stats.close()
         
         #save PREMIS
         self.record_premis(timestamp, 'message digest calculation', 0, dfxml_cmd, 'Extracted information about the structure and characteristics of content, including file checksums.', dfxml_ver)
         
         print('\n\n\tDFXML creation completed; moving on to next step...')
     
+    def dfxml_complete(self):
+        #fiwalk can crash partway through an image, leaving a truncated DFXML
+        if not os.path.exists(self.dfxml_output) or os.path.getsize(self.dfxml_output) == 0:
+            return False
+        with open(self.dfxml_output, 'rb') as f:
+            f.seek(max(0, os.path.getsize(self.dfxml_output) - 64))
+            return b'</dfxml>' in f.read()
+    
+    def read_dfxml(self):
+        #produce_dfxml and fix_dates share one parse of the DFXML; it is only read again if the file changes
+        if self.dfxml_records is None or not self.dfxml_records.current():
+            self.dfxml_records = DfxmlRecords(self.dfxml_output)
+        return self.dfxml_records
+    
     def fix_dates(self, outfolder):
         #adapted from Timothy Walsh's Disk Image Processor: https://github.com/CCA-Public/diskimageprocessor
                
@@ -1012,65 +3118,51 @@ class DigitalObject(Shipment):
         timestamp = str(datetime.datetime.now())
          
         try:
-            for (event, obj) in Objects.iterparse(self.dfxml_output):
-                # only work on FileObjects
-                if not isinstance(obj, Objects.FileObject):
+            records = self.read_dfxml()
+        except (OSError, etree.XMLSyntaxError):
+            print('\nUnable to read DFXML!')
+            records = None
+        
+        if records is not None:
+            #get the date for each file and folder (last modified, falling back to created); if a path is listed more than once, the last entry wins
+            file_dates = {}
+            for i in range(len(records)):
+                
+                # skip links and other special files; '..' entries point back to the parent folder (outside outfolder at the top level)
+                if records.name_type[i] and not records.name_type[i] in ["r", "d"]:
                     continue
-
-                # skip directories and links
-                if obj.name_type:
-                    if obj.name_type not in ["r", "d"]:
-                        continue
-
-                # record filename
-                dfxml_filename = obj.filename
-                dfxml_filedate = int(time.time()) # default to current time
-
-                # record last modified or last created date
-                try:
-                    mtime = obj.mtime
-                    mtime = str(mtime)
-                except:
-                    pass
-
-                try:
-                    crtime = obj.crtime
-                    crtime = str(crtime)
-                except:
-                    pass
-
-                # fallback to created date if last modified doesn't exist
-                if mtime and (mtime != 'None'):
-                    mtime = time_to_int(mtime[:19])
-                    dfxml_filedate = mtime
-                elif crtime and (crtime != 'None'):
-                    crtime = time_to_int(crtime[:19])
-                    dfxml_filedate = crtime
-                else:
+                
+                dfxml_filename = records.filename[i]
+                if not dfxml_filename or os.path.basename(dfxml_filename) == '..':
                     continue
-
-                # rewrite last modified date of corresponding file in objects/files
-                exported_filepath = os.path.join(outfolder, dfxml_filename)
-                if os.path.isdir(exported_filepath):
-                    os.utime(exported_filepath, (dfxml_filedate, dfxml_filedate))
-                elif os.path.isfile(exported_filepath):
-                    os.utime(exported_filepath, (dfxml_filedate, dfxml_filedate)) 
-                else:
+                
+                dfxml_filedate = records.file_date(i)
+                if dfxml_filedate is None:
                     continue
-
-        except (ValueError, xml.etree.ElementTree.ParseError):
-            print('\nUnable to read DFXML!')
-            pass
+                
+                file_dates[os.path.normpath(os.path.join(outfolder, dfxml_filename))] = dfxml_filedate
+            
+            #group by folder so each folder is listed once, rather than checking every path before updating it
+            folders = {}
+            for path, dfxml_filedate in file_dates.items():
+                folders.setdefault(os.path.dirname(path), []).append((os.path.basename(path), dfxml_filedate))
+            
+            for folder, contents in folders.items():
+                try:
+                    with os.scandir(folder) as it:
+                        entries = {os.path.normcase(entry.name) : entry.path for entry in it}
+                except OSError:
+                    continue
+                
+                # rewrite last modified date of corresponding files in objects/files
+                for name, dfxml_filedate in contents:
+                    exported_filepath = entries.get(os.path.normcase(name))
+                    if exported_filepath:
+                        os.utime(exported_filepath, (dfxml_filedate, dfxml_filedate))
         
         #record event in PREMIS metadata
         self.record_premis(timestamp, 'metadata modification', 0, 'https://github.com/CCA-Public/diskimageprocessor/blob/master/diskimageprocessor.py#L446-L489', 'Corrected file timestamps to match information extracted from disk image.', 'Adapted from Disk Image Processor Version: 1.0.0 (Tim Walsh)')
     
-    def time_to_int(self, str_time):
-        """ Convert datetime to unix integer value """
-        dt = time.mktime(datetime.datetime.strptime(str_time, 
-            "%Y-%m-%dT%H:%M:%S").timetuple())
-        return dt
-    
     def lsdvd_check(self, drive_letter):
         
         #get lsdvd version
@@ -1102,7 +3194,7 @@ class DigitalObject(Shipment):
                 title_format = 'NTSC'
                 
         #if lsdvd fails or information not in report, get the title count by parsing directory...
-        except (OSError, lxml.etree.XMLSyntaxError):
+        except (OSError, etree.XMLSyntaxError):
             titlelist = glob.glob(os.path.join(drive_letter, '**/VIDEO_TS', '*_*_*.VOB'), recursive=True)
             count = []
             for t in titlelist:
@@ -1119,14 +3211,10 @@ class DigitalObject(Shipment):
     
     def normalize_dvd_content(self, titlecount, drive_letter):
 
-        #check current directory; change to a temp directory to store files
-        bdpl_cwd = 'C:\\BDPL\\scripts'
-        
+        #ffmpeg runs in a temp directory so its report files land there; other items may be normalized at the same time, so don't change the process's working directory
         if not os.path.exists(self.ffmpeg_temp_dir):
             os.makedirs(self.ffmpeg_temp_dir)
         
-        os.chdir(self.ffmpeg_temp_dir)
-        
         #get ffmpeg version
         ffmpeg_ver =  '; '.join(subprocess.check_output('"C:\\Program Files\\ffmpeg\\bin\\ffmpeg" -version', shell=True, text=True).splitlines()[0:2])
         
@@ -1152,7 +3240,7 @@ class DigitalObject(Shipment):
                         pass
                 
                 if len(audio_test) == 0:
-                    messagebox.showwarning(title='WARNING', message='Unable to access information on DVD. Moving image normalization has failed...', master=self)
+                    self.controller.alert('WARNING', 'Unable to access information on DVD. Moving image normalization has failed...')
                     return
                 
                 #if there's no audio in any track, it's OK
@@ -1162,15 +3250,15 @@ class DigitalObject(Shipment):
                 #if our first track lacks audio, add a dummy track
                 elif audio_test[titlelist[0]] == '':
                     
-                    cmd = "ffmpeg -y -nostdin -loglevel warning -i {} -f lavfi -i anullsrc -c:v copy -c:a aac -shortest -target ntsc-dvd {{}".format(titlelist[0], self.dummy_audio)
+                    cmd = "ffmpeg -y -nostdin -loglevel warning -i {} -f lavfi -i anullsrc -c:v copy -c:a aac -shortest -target ntsc-dvd {}".format(titlelist[0], self.dummy_audio)
                     
                     print('\n\tCorrecting missing audio on first track...')
                     
-                    subprocess.call(cmd, text=True)
+                    subprocess.call(cmd, text=True, cwd=self.ffmpeg_temp_dir)
                     
                     #replace original item from list
                     del titlelist[0]
-                    titlelist.insert(0, dummy_audio)
+                    titlelist.insert(0, self.dummy_audio)
                 
                 timestamp = str(datetime.datetime.now())
                 
@@ -1179,17 +3267,14 @@ class DigitalObject(Shipment):
                 
                 print('\n\tGenerating title {} of {}: {}\n'.format(str(title), str(titlecount), ffmpegout))
                 
-                exitcode = subprocess.call(ffmpeg_cmd, shell=True, text=True)
+                exitcode = subprocess.call(ffmpeg_cmd, shell=True, text=True, cwd=self.ffmpeg_temp_dir)
                 
                 #record event in PREMIS metadata                
                 self.record_premis(timestamp, 'normalization', exitcode, ffmpeg_cmd, 'Transformed object to an institutionally supported preservation format (.MPG) with a direct copy of all streams.', ffmpeg_ver)
                 
                 #move and rename ffmpeg log file
                 ffmpeglog = glob.glob(os.path.join(self.ffmpeg_temp_dir, 'ffmpeg-*.log'))[0]
-                shutil.move(ffmpeglog, os.path.join(self.log_dir, '{}-{}-ffmpeg.log'.format(identifier, str(title).zfill(2))))
-                
-        #move back to original directory
-        os.chdir(bdpl_cwd)
+                shutil.move(ffmpeglog, os.path.join(self.log_dir, '{}-{}-ffmpeg.log'.format(self.identifier, str(title).zfill(2))))
         
         print('\n\tMoving image normalization completed; proceed to content analysis.')
 
@@ -1347,7 +3432,7 @@ class DigitalObject(Shipment):
         print('\n\tScan underway...be patient!\n')
         
         #use default command with buklk_extractor
-        bulkext_command = 'bulk_extractor -x aes -x base64 -x elf -x exif -x gps -x hiberfile -x httplogs -x json -x kml -x net -x pdf -x sqlite -x winlnk -x winpe -x winprefetch -S ssn_mode=2 -q -1 -o "{}" -R "{}" > "{}"'.format(self.bulkext_dir, self.files_dir, self.bulkext_log)
+        bulkext_command = 'bulk_extractor -x aes -x base64 -x elf -x exif -x gps -x hiberfile -x httplogs -x json -x kml -x net -x pdf -x sqlite -x winlnk -x winpe -x winprefetch -S ssn_mode=2 -q -1 -j {} -o "{}" -R "{}" > "{}"'.format(self.bulkext_threads, self.bulkext_dir, self.files_dir, self.bulkext_log)
         
         if os.path.exists(self.bulkext_dir):
             shutil.rmtree(self.bulkext_dir)
@@ -1475,10 +3560,14 @@ class DigitalObject(Shipment):
                     
                     csvWriter.writerow(data)
     
-    def import_csv(self):
+    def import_csv(self, chunk_size=5000):
 
         conn = sqlite3.connect(self.siegfried_db)
         conn.text_factory = str  # allows utf-8 data to be stored
+        
+        #the table is rebuilt from siegfried.csv if we crash, so we don't need a full sync on every write
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
         cursor = conn.cursor()
 
         print('\n\tImporting siegried file to sqlite3 database...')
@@ -1491,20 +3580,29 @@ class DigitalObject(Shipment):
         except UnicodeDecodeError:
             f = (x.strip() for x in f) # skip non-utf8 encodable characters
             reader = csv.reader(x.replace('\0', '') for x in f) # replace null bytes with empty strings on read
-        header = True
-        for row in reader:
-            if header:
-                header = False # gather column names from first row of csv
-                sql = "DROP TABLE IF EXISTS siegfried"
-                cursor.execute(sql)
-                sql = "CREATE TABLE siegfried (filename text, filesize text, modified text, errors text, namespace text, id text, format text, version text, mime text, basis text, warning text)"
-                cursor.execute(sql)
-                insertsql = "INSERT INTO siegfried VALUES ({})".format(", ".join([ "?" for column in row ]))
-                rowlen = len(row)
-            else:
-                # skip lines that don't have right number of columns
-                if len(row) == rowlen:
-                    cursor.execute(insertsql, row)
+        
+        # gather column names from first row of csv
+        header = next(reader, None)
+        if header is not None:
+            cursor.execute("DROP TABLE IF EXISTS siegfried")
+            
+            #filesize has integer affinity, so numeric values from the csv are stored as integers
+            cursor.execute("CREATE TABLE siegfried (filename text, filesize integer, modified text, errors text, namespace text, id text, format text, version text, mime text, basis text, warning text)")
+            insertsql = "INSERT INTO siegfried VALUES ({})".format(", ".join([ "?" for column in header ]))
+            rowlen = len(header)
+            
+            # skip lines that don't have right number of columns; load the rest in chunks within a single transaction
+            rows = (row for row in reader if len(row) == rowlen)
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if len(chunk) == 0:
+                    break
+                cursor.executemany(insertsql, chunk)
+            
+            #build indexes once the data is loaded
+            for column in ['id', 'format', 'mime', 'errors']:
+                cursor.execute("CREATE INDEX idx_siegfried_{0} ON siegfried ({0})".format(column))
+            
         conn.commit()
         f.close()
         
@@ -1528,59 +3626,10 @@ class DigitalObject(Shipment):
 
         print('\n\tGetting statistics and generating reports about content...')
         
-        #prepare sqlite database and variables
-        conn = sqlite3.connect(self.siegfried_db)
-        conn.text_factory = str  # allows utf-8 data to be stored
-        cursor = conn.cursor()
-        
-        full_header = ['Filename', 'Filesize', 'Date modified', 'Errors', 
-                    'Namespace', 'ID', 'Format', 'Format version', 'MIME type', 
-                    'Basis for ID', 'Warning']
-        
-        #retrieve our 'file stats'
-        file_stats = []
-        try:
-            with open(self.checksums, 'rb') as f:
-                file_stats = pickle.load(f)
-        except FileNotFoundError:
-            pass
-        
-        # get total # of files
-        cursor.execute("SELECT COUNT(*) from siegfried;") # total files
-        self.num_files = cursor.fetchone()[0]
-
-        # get # of empty files
-        cursor.execute("SELECT COUNT(*) from siegfried where filesize='0';") # empty files
-        self.empty_files = cursor.fetchone()[0]
-            
-        #Get stats on duplicates. Just in case the bdpl ingest tool crashes after compiling a duplicates list, we'll check to see if it already exists
-        if not 'dup_list' in list(self.db.keys()) or self.re_analyze:
-            self.db['dup_list'] = []
-
-            #next, create a new dictionary that IDs checksums that correspond to 1 or more files. NOTE: the 'file_stats' list will be empty for DVDs, so we'll skip this step in that case
-            if len(file_stats) > 1:
-                stat_dict = {}
-                for dctnry in file_stats:
-                    if int(dctnry['size']) > 0:
-                        if dctnry['checksum'] in stat_dict:
-                            stat_dict[dctnry['checksum']].append(dctnry['name'])
-                        else:
-                            stat_dict[dctnry['checksum']] = [dctnry['name']]
-               
-                #go through new dict and find checksums with duplicates
-                for chksm in [key for key, values in stat_dict.items() if len(values) > 1]:
-                    for fname in stat_dict[chksm]:
-                        temp = [item for item in file_stats if item['checksum'] == chksm and item['name'] == fname][0]
-                        self.db['dup_list'].append([temp['name'], temp['size'], temp['mtime'], temp['checksum']])
-                
-            #save
-            self.db.sync()
-        
-        #total duplicates = total length of duplicate list
-        self.all_dupes = len(self.db['dup_list'])
-
-        #distinct duplicates = # of unique checksums in the duplicates list
-        self.distinct_dupes = len(set([c[3] for c in self.db['dup_list']]))
+        #compile stats; sections whose inputs haven't changed since the last run are loaded from cache
+        stats = StatsEngine(self).run()
+        for key, value in stats.items():
+            setattr(self, key, value)
 
         #duplicate copies = # of unique files that may have one or more copies
         duplicate_copies = int(self.all_dupes) - int(self.distinct_dupes) # number of duplicate copies of unique files
@@ -1589,150 +3638,30 @@ class DigitalObject(Shipment):
         distinct_files = int(self.num_files) - int(self.duplicate_copies)
         self.distinct_files = str(distinct_files)
         
-        # generate sorted format list report;
-        path = os.path.join(self.reports_dir, 'formats.csv')
-        sql = "SELECT format, id, COUNT(*) as 'num' FROM siegfried GROUP BY format ORDER BY num DESC"
-        format_header = ['Format', 'ID', 'Count']
-        self.sqlite_to_csv(sql, path, format_header, cursor)
-        
         #add top formats to db['info']
-        fileformats = []
-        formatcount = 0
-        try:
-            with open(path, 'r') as csvfile:
-                formatreader = csv.reader(csvfile)
-                next(formatreader)
-                for row in formatreader:
-                    formatcount += 1
-                    fileformats.append(row[0])
-                fileformats = [element or 'Unidentified' for element in fileformats] # replace empty elements with 'Unidentified'
-                if formatcount > 0:
-                    self.db['info']['format_overview'] = "Top file formats (out of {} total) are: {}".format(formatcount, ' | '.join(fileformats[:10]))
-                else:
-                    self.db['info']['format_overview'] = "-"
-                
-        except IOError:
-            self.db['info']['format_overview'] = "ERROR! No formats.csv file to pull formats from."
-        
-        # generate sorted format and version list report
-        path = os.path.join(self.reports_dir, 'formatVersions.csv')
-        sql = "SELECT format, id, version, COUNT(*) as 'num' FROM siegfried GROUP BY format, version ORDER BY num DESC"
-        version_header = ['Format', 'ID', 'Version', 'Count']
-        self.sqlite_to_csv(sql, path, version_header, cursor)
-        
-        # get # of unidentified files and write list to CSV
-        cursor.execute("SELECT COUNT(*) FROM siegfried WHERE id='UNKNOWN';") # unidentified files
-        self.unidentified_files = cursor.fetchone()[0]
-        
-        sql = "SELECT * FROM siegfried WHERE id='UNKNOWN';"
-        path = os.path.join(self.reports_dir, 'unidentified.csv')
-        self.sqlite_to_csv(sql, path, full_header, cursor)
-        
-        # get sorted mimetype list report
-        path = os.path.join(self.reports_dir, 'mimetypes.csv')
-        sql = "SELECT mime, COUNT(*) as 'num' FROM siegfried GROUP BY mime ORDER BY num DESC"
-        mime_header = ['MIME type', 'Count']
-        self.sqlite_to_csv(sql, path, mime_header, cursor)
-        
-        #for dvd jobs, we need to use disk image metadata for dates; for CDDA jobs, we can only list date as unknown
-        if self.job_type == 'DVD':
-            try:
-                with open(self.checksums_dvd, 'rb') as f:
-                    file_stats = pickle.load(f)
-            except FileNotFoundError:
-                pass
-                
-        #For reporting purposes, we want to catch any files whose current 'mtime' was set during replication in the BDPL process.
-
-        #first, establish when we ran the replication operation.  If no replication operation, check timestamp of folders we created
-        bdpl_time = datetime.datetime.fromtimestamp(os.path.getmtime(self.folders_created)).isoformat().replace('T', ' ').split('.')[0]
-        
-        bdpl_time = datetime.datetime.strptime(bdpl_time, "%Y-%m-%d %H:%M:%S")
-        
-        #next, go through or file list.  If the 'mtime' is more recent than the 'BDPL' replication action, that means we don't have the original file timestamp.  Only record older/original dates in a date_info list
-        date_info = []
-        undated_count = []
-        if len(file_stats) > 0:
-            for dctnry in file_stats:
-                dt_time = dctnry['mtime'].replace('T', ' ').split('.')[0]
-                dt_time = datetime.datetime.strptime(dt_time, "%Y-%m-%d %H:%M:%S")
-                if dt_time < bdpl_time:
-                    date_info.append(dctnry['mtime'])
-                else:
-                    undated_count.append('undated')
-            
-        #If we've collected any dates in our date_info list, set date ranges and then record years in separate list
-        if len(date_info) > 0:
-            self.begin_date = min(date_info)[:4]
-            self.end_date = max(date_info)[:4]
-            self.earliest_date = min(date_info)
-            self.latest_date = max(date_info)   
-            
-            year_info = [x[:4] for x in date_info]
-            
-        #if date_info is empty, record 'undated' for date ranges
+        fileformats = [element or 'Unidentified' for element in self.format_list] # replace empty elements with 'Unidentified'
+        if len(fileformats) > 0:
+            self.db['info']['format_overview'] = "Top file formats (out of {} total) are: {}".format(len(fileformats), ' | '.join(fileformats[:10]))
         else:
-            self.begin_date = "undated"
-            self.end_date = "undated"
-            self.earliest_date = "undated"
-            self.latest_date = "undated"
-            
-            year_info = undated_count
-            
-        #get frequency of each year for report       
-        self.year_count = dict(Counter(year_info))
-        
-        #write year info to file
-        path = os.path.join(self.reports_dir, 'years.csv')    
-        with open(path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            year_header = ['Year Last Modified', 'Count']
-            writer.writerow(year_header)
-            if len(self.year_count) > 0:
-                for key, value in self.year_count.items():
-                    writer.writerow([key, value])
-
-        # get number of identfied file formats
-        cursor.execute("SELECT COUNT(DISTINCT format) as formats from siegfried WHERE format <> '';")
-        self.num_formats = cursor.fetchone()[0]
-
-        # get number of siegfried errors and write errors to csv
-        cursor.execute("SELECT COUNT(*) FROM siegfried WHERE errors <> '';") # number of siegfried errors
-        self.num_errors = cursor.fetchone()[0]
-        
-        sql = "SELECT * FROM siegfried WHERE errors <> '';"
-        path = os.path.join(self.reports_dir, 'errors.csv')
-        self.sqlite_to_csv(sql, path, full_header, cursor)
-
-        # calculate size from recursive dirwalk and format
-        self.total_size_bytes = 0
-        for root, dirs, files in os.walk(self.files_dir):
-            for f in files:
-                file_path = os.path.join(root, f)
-                file_info = os.stat(file_path)
-                self.total_size_bytes += file_info.st_size
+            self.db['info']['format_overview'] = "-"
 
         self.total_size = self.convert_size(self.total_size_bytes)
         
-        # close database connections
-        cursor.close()
-        conn.close()
-        
         #save information to db['info']     
         self.db['info'].update({'Source': self.identifier, 'begin_date': self.begin_date, 'end_date' : self.end_date, 'extent_normal': self.total_size, 'extent_raw': self.total_size_bytes, 'item_file_count': self.num_files, 'item_duplicate_count': self.distinct_dupes, 'FormatCount': self.num_formats, 'item_unidentified_count': self.unidentified_files})  
         
         #get additional metadata from PREMIS about transfer
         if self.job_type in ['Disk_image', 'DVD', 'CDDA']:
             try:
-                temp_dict = [f for f in self.db['premis'] if f['eventType'] == 'disk image creation'][-1]
+                temp_dict = self.db['premis'].by_type('disk image creation')[-1]
             except IndexError:
                 try: 
-                    temp_dict = [f for f in self.db['premis'] if f['eventType'] == 'normalization'][-1]
+                    temp_dict = self.db['premis'].by_type('normalization')[-1]
                 except IndexError:
                     temp_dict = {'linkingAgentIDvalue' : '-', 'timestamp' : '-', 'eventOutcomeDetail' : 'Operation not completed.'}
         elif self.job_type == 'Copy_only':
             try:
-                temp_dict = [f for f in self.db['premis'] if f['eventType'] == 'replication'][-1]
+                temp_dict = self.db['premis'].by_type('replication')[-1]
             except IndexError:
                 temp_dict = {'linkingAgentIDvalue' : '-', 'timestamp' : '-', 'eventOutcomeDetail' : 'Operation not completed.'}
         
@@ -1930,48 +3859,56 @@ class DigitalObject(Shipment):
         
         if header == 'Duplicates':
             html_doc.write('\n<p><em>Duplicates are grouped by hash value.</em></p>')
-            numline = len(self.db['dup_list'])
+            conn = sqlite3.connect(self.siegfried_db)
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='duplicates';")
+            if cursor.fetchone()[0] > 0:
+                cursor.execute("SELECT COUNT(*) FROM duplicates;")
+                numline = cursor.fetchone()[0]
+            else:
+                numline = 0
             
             if numline > 1: #aka more rows than just header
-                # read md5s from csv and write to list
-                hash_list = []
-                for row in self.db['dup_list']:
-                    hash_list.append(row[3])
-                # deduplicate md5_list
-                hash_list = list(OrderedDict.fromkeys(hash_list))
-                # for each hash in md5_list, print header, file info, and list of matching files
-                for hash_value in hash_list:
-                    html_doc.write('\n<p>Files matching checksum <strong>{}</strong>:</p>'.format(hash_value))
-                    html_doc.write('\n<table class="table table-sm table-responsive table-bordered table-hover">')
-                    html_doc.write('\n<thead>')
-                    html_doc.write('\n<tr>')
-                    html_doc.write('\n<th>Filename</th><th>Filesize</th>')
-                    html_doc.write('<th>Date modified</th>')
-                    html_doc.write('<th>Checksum</th>')
-                    html_doc.write('\n</tr>')
-                    html_doc.write('\n</thead>')
-                    html_doc.write('\n<tbody>')
-                    for row in self.db['dup_list']:
-                        if row[3] == hash_value:
-                            # write data
+                #rows come back grouped by hash; start a new table whenever the hash changes and save a copy of the duplicates for the reports
+                with open(self.dup_report, "w", newline="", encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    dup_header = ['Filename', 'Filesize', 'Date modified', 'Checksum']
+                    writer.writerow(dup_header)
+                    
+                    hash_value = None
+                    for row in cursor.execute("SELECT filename, filesize, modified, checksum FROM duplicates ORDER BY rowid"):
+                        writer.writerow(row)
+                        
+                        if row[3] != hash_value:
+                            if hash_value is not None:
+                                html_doc.write('\n</tbody>')
+                                html_doc.write('\n</table>')
+                            hash_value = row[3]
+                            html_doc.write('\n<p>Files matching checksum <strong>{}</strong>:</p>'.format(hash_value))
+                            html_doc.write('\n<table class="table table-sm table-responsive table-bordered table-hover">')
+                            html_doc.write('\n<thead>')
                             html_doc.write('\n<tr>')
-                            for column in row:
-                                html_doc.write('\n<td>' + str(column) + '</td>')
+                            html_doc.write('\n<th>Filename</th><th>Filesize</th>')
+                            html_doc.write('<th>Date modified</th>')
+                            html_doc.write('<th>Checksum</th>')
                             html_doc.write('\n</tr>')
+                            html_doc.write('\n</thead>')
+                            html_doc.write('\n<tbody>')
+                        
+                        # write data
+                        html_doc.write('\n<tr>')
+                        for column in row:
+                            html_doc.write('\n<td>' + str(column) + '</td>')
+                        html_doc.write('\n</tr>')
+                    
                     html_doc.write('\n</tbody>')
                     html_doc.write('\n</table>')
-            
-                #save a copy of the duplicates for the reports
-                dup_report = os.path.join(self.reports_dir, 'duplicates.csv')
-                with open(dup_report, "w", newline="", encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    dup_header = ['Filename', 'Filesize', 'Date modified', 'Checksum']
-                    writer.writerow(dup_header)
-                    for item in self.db['dup_list']:
-                        writer.writerow(item)
             else:
                 html_doc.write('\nNone found.\n<br><br>')
-            
+
+            cursor.close()
+            conn.close()
+
         else:
             if not os.path.exists(path):
                 open(path, 'w').close()
@@ -2075,109 +4012,30 @@ class DigitalObject(Shipment):
         
             in_file.close()
     
-    def print_premis(self):   
-        
-        attr_qname = etree.QName("http://www.w3.org/2001/XMLSchema-instance", "schemaLocation")
-
-        PREMIS_NAMESPACE = "http://www.loc.gov/premis/v3"
-
-        PREMIS = "{%s}" % PREMIS_NAMESPACE
-
-        NSMAP = {'premis' : PREMIS_NAMESPACE,
-                "xsi": "http://www.w3.org/2001/XMLSchema-instance"}
-
-        events = []
-        
-        #if our premis file already exists, we'll just delete it and write a new one
-        if os.path.exists(self.premis_xml_file):
-            os.remove(self.premis_xml_file)
-            
-        root = etree.Element(PREMIS + 'premis', {attr_qname: "http://www.loc.gov/premis/v3 https://www.loc.gov/standards/premis/premis.xsd"}, version="3.0", nsmap=NSMAP)
-        
-        object = etree.SubElement(root, PREMIS + 'object', attrib={etree.QName(NSMAP['xsi'], 'type'): 'premis:file'})
-        objectIdentifier = etree.SubElement(object, PREMIS + 'objectIdentifier')
-        objectIdentifierType = etree.SubElement(objectIdentifier, PREMIS + 'objectIdentifierType')
-        objectIdentifierType.text = 'local'
-        objectIdentifierValue = etree.SubElement(objectIdentifier, PREMIS + 'objectIdentifierValue')
-        objectIdentifierValue.text = self.identifier
-        objectCharacteristics = etree.SubElement(object, PREMIS + 'objectCharacteristics')
-        compositionLevel = etree.SubElement(objectCharacteristics, PREMIS + 'compositionLevel')
-        compositionLevel.text = '0'
-        format = etree.SubElement(objectCharacteristics, PREMIS + 'format')
-        formatDesignation = etree.SubElement(format, PREMIS + 'formatDesignation')
-        formatName = etree.SubElement(formatDesignation, PREMIS + 'formatName')
-        formatName.text = 'Tape Archive Format'
-        formatRegistry = etree.SubElement(format, PREMIS + 'formatRegistry')
-        formatRegistryName = etree.SubElement(formatRegistry, PREMIS + 'formatRegistryName')
-        formatRegistryName.text = 'PRONOM'
-        formatRegistryKey = etree.SubElement(formatRegistry, PREMIS + 'formatRegistryKey')
-        formatRegistryKey.text = 'x-fmt/265' 
-
-        for entry in self.db['premis']:
+    def print_premis(self):
+        """Bring the PREMIS XML up to date: append events recorded since it was last written, or rebuild it if it's missing or earlier events were merged or re-sorted"""
+        premis_writer = PremisWriter(self.premis_xml_file, self.identifier)
         
-            event = etree.SubElement(root, PREMIS + 'event')
-            eventID = etree.SubElement(event, PREMIS + 'eventIdentifier')
-            eventIDtype = etree.SubElement(eventID, PREMIS + 'eventIdentifierType')
-            eventIDtype.text = 'UUID'
-            eventIDval = etree.SubElement(eventID, PREMIS + 'eventIdentifierValue')
-            eventIDval.text = str(uuid.uuid4())
-
-            eventType = etree.SubElement(event, PREMIS + 'eventType')
-            eventType.text = entry['eventType']
-
-            eventDateTime = etree.SubElement(event, PREMIS + 'eventDateTime')
-            eventDateTime.text = entry['timestamp']
-
-            eventDetailInfo = etree.SubElement(event, PREMIS + 'eventDetailInformation')
-            eventDetail = etree.SubElement(eventDetailInfo, PREMIS + 'eventDetail')
-            eventDetail.text = entry['eventDetailInfo']
-            
-            #include additional eventDetailInfo to clarify action; older transfers may not include this element, so skip if KeyError
-            try:
-                eventDetailInfo = etree.SubElement(event, PREMIS + 'eventDetailInformation')
-                eventDetail = etree.SubElement(eventDetailInfo, PREMIS + 'eventDetail')
-                eventDetail.text = entry['eventDetailInfo_additional']
-            except KeyError:
-                pass
-                
-            eventOutcomeInfo = etree.SubElement(event, PREMIS + 'eventOutcomeInformation')
-            eventOutcome = etree.SubElement(eventOutcomeInfo, PREMIS + 'eventOutcome')
-            eventOutcome.text = str(entry['eventOutcomeDetail'])
-            eventOutDetail = etree.SubElement(eventOutcomeInfo, PREMIS + 'eventOutcomeDetail')
-            eventOutDetailNote = etree.SubElement(eventOutDetail, PREMIS + 'eventOutcomeDetailNote')
-            if entry['eventOutcomeDetail'] == '0':
-                eventOutDetailNote.text = 'Successful completion'
-            elif entry['eventOutcomeDetail'] == 0:
-                eventOutDetailNote.text = 'Successful completion'
-            else:
-                eventOutDetailNote.text = 'Unsuccessful completion; refer to logs.'
-
-            linkingAgentID = etree.SubElement(event, PREMIS + 'linkingAgentIdentifier')
-            linkingAgentIDtype = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentIdentifierType')
-            linkingAgentIDtype.text = 'local'
-            linkingAgentIDvalue = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentIdentifierValue')
-            linkingAgentIDvalue.text = 'IUL BDPL'
-            linkingAgentRole = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentRole')
-            linkingAgentRole.text = 'implementer'
-            linkingAgentID = etree.SubElement(event, PREMIS + 'linkingAgentIdentifier')
-            linkingAgentIDtype = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentIdentifierType')
-            linkingAgentIDtype.text = 'local'
-            linkingAgentIDvalue = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentIdentifierValue')
-            linkingAgentIDvalue.text = entry['linkingAgentIDvalue']
-            linkingAgentRole = etree.SubElement(linkingAgentID, PREMIS + 'linkingAgentRole')
-            linkingAgentRole.text = 'executing software'
-            linkingObjectID = etree.SubElement(event, PREMIS + 'linkingObjectIdentifier')
-            linkingObjectIDtype = etree.SubElement(linkingObjectID, PREMIS + 'linkingObjectIdentifierType')
-            linkingObjectIDtype.text = 'local'
-            linkingObjectIDvalue = etree.SubElement(linkingObjectID, PREMIS + 'linkingObjectIdentifierValue')
-            linkingObjectIDvalue.text = self.identifier
+        events = self.db['premis']
+        rows = events.rows()
+        written = len([r for r in rows if r[3]])
         
-        premis_tree = etree.ElementTree(root)
+        #events already in the file have to come first, in the same order, for us to add to it
+        if written > 0 and all(r[3] for r in rows[:written]) and premis_writer.append([(r[1], r[2]) for r in rows[written:]]):
+            pass
+        else:
+            premis_writer.write([(r[1], r[2]) for r in rows])
         
-        premis_tree.write(self.premis_xml_file, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        events.mark_written()
     
     def record_premis(self, timestamp, event_type, event_outcome, event_detail, event_detail_note, agent_id):
         
+        #analysis stages may record events at the same time
+        with self.db.lock:
+            self.add_premis_event(timestamp, event_type, event_outcome, event_detail, event_detail_note, agent_id)
+    
+    def add_premis_event(self, timestamp, event_type, event_outcome, event_detail, event_detail_note, agent_id):
+        
         temp_dict = {}
         temp_dict['eventType'] = event_type
         temp_dict['eventOutcomeDetail'] = event_outcome
@@ -2223,7 +4081,7 @@ class DigitalObject(Shipment):
         #check to see if an event is already in our premis list--i.e., it's been successfully completed.  Currently only used for most resource-intensive operations: virus scheck, sensitive data scan, format id, and checksum calculation.
         
         #see if term has been recorded at all
-        found = [dic for dic in self.db['premis'] if dic['eventType'] == term]
+        found = self.db['premis'].by_type(term)
         
         #if not recorded, it hasn't been run
         if not found: 
@@ -2242,13 +4100,6 @@ class DigitalObject(Shipment):
                 else:
                     return False
 
-    def md5(self, fname):
-        hash_md5 = hashlib.md5()
-        with open(fname, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-
     def convert_size(self, size):
         # convert size to human-readable form
         if (size == 0):
@@ -2327,14 +4178,14 @@ class DigitalObject(Shipment):
             
             #make surre this isn't PAL formatted: need to figure out solution. 
             if title_format == 'PAL':
-                messagebox.showwarning(title='WARNING', message='DVD is PAL formatted! Notify digital preservation librarian so we can configure approprioate ffmpeg command; set disc aside for now...', master=self)
+                self.controller.alert('WARNING', 'DVD is PAL formatted! Notify digital preservation librarian so we can configure approprioate ffmpeg command; set disc aside for now...')
                 return
             
             #if DVD has one or more titles, rip raw streams to .MPG
             if titlecount > 0:
                 self.normalize_dvd_content(titlecount, drive_letter)
             else:
-                messagebox.showwarning(title='WARNING', message='DVD does not appear to have any titles; job type should likely be Disk_image.  Manually review disc and re-transfer content if necessary.', master=self)
+                self.controller.alert('WARNING', 'DVD does not appear to have any titles; job type should likely be Disk_image.  Manually review disc and re-transfer content if necessary.')
                 return
         
         #CDDA job
@@ -2347,16 +4198,26 @@ class DigitalObject(Shipment):
         
     def run_item_analysis(self):
         
+        #the job can be cancelled between stages; completed stages are skipped next time based on PREMIS events
+        self.controller.checkpoint()
+        
+        #the scans below are independent reads of the content; they run side by side within the item's CPU and I/O budgets
+        scheduler = StageScheduler(self.controller, self.analysis_cpu_budget, self.analysis_io_budget)
+        
+        #share the cores between checksums and bulk_extractor
+        self.fixity_workers = min(self.fixity_workers, max(1, self.analysis_cpu_budget // 2 - 1))
+        self.bulkext_threads = max(1, self.analysis_cpu_budget // 2 - 1)
+        
         '''run antivirus'''
         print('\nVIRUS SCAN: clamscan.exe')
         if self.check_premis('virus check') and not self.re_analyze:
             print('\n\tVirus scan already completed; moving on to next step...')
         else:
-            self.run_antivirus()
+            scheduler.add('virus scan', self.run_antivirus, cpu=1, io=1)
     
         '''create DFXML (if not already done so)'''
+        print('\n\nDIGITAL FORENSICS XML CREATION:')
         if self.check_premis('message digest calculation') and not self.re_analyze:
-            print('\n\nDIGITAL FORENSICS XML CREATION:')
             print('\n\tDFXML already created; moving on to next step...')
         else:
             if self.job_type == 'Disk_image':
@@ -2364,25 +4225,28 @@ class DigitalObject(Shipment):
                 
                 #if it's an HFS+ file system, we can use fiwalk on the disk image; otherwise, use bdpl_ingest on the file directory
                 if 'hfs+' in [fs.lower() for fs in self.db['fs_list']]:
-                    self.produce_dfxml(self.imagefile)
+                    dfxml_target = self.imagefile
                 else:
-                    self.produce_dfxml(self.files_dir)
+                    dfxml_target = self.files_dir
             
             elif self.job_type == 'Copy_only':
-                self.produce_dfxml(self.files_dir)
+                dfxml_target = self.files_dir
             
             elif self.job_type == 'DVD':
-                self.produce_dfxml(self.imagefile)
+                dfxml_target = self.imagefile
             
             elif self.job_type == 'CDDA':
-                self.produce_dfxml(self.image_dir)
+                dfxml_target = self.image_dir
+            
+            scheduler.add('DFXML', self.produce_dfxml, args=(dfxml_target,), cpu=self.fixity_workers, io=1)
                 
             '''document directory structure'''
             print('\n\nDOCUMENTING FOLDER/FILE STRUCTURE: TREE')
             if self.check_premis('metadata extraction') and not self.re_analyze:
                 print('\n\tDirectory structure already documented with tree command; moving on to next step...')
             else:
-                self.document_dir_tree() 
+                #tree only reads folder listings
+                scheduler.add('tree', self.document_dir_tree, cpu=1, io=0)
         
         '''run bulk_extractor to identify potential sensitive information (only if disk image or copy job type). Skip if b_e was run before'''
         print('\n\nSENSITIVE DATA SCAN: BULK_EXTRACTOR')
@@ -2390,7 +4254,7 @@ class DigitalObject(Shipment):
             print('\n\tSensitive data scan already completed; moving on to next step...')
         else:
             if self.job_type in ['Copy_only', 'Disk_image']:
-                self.run_bulkext()
+                scheduler.add('bulk_extractor', self.run_bulkext, cpu=self.bulkext_threads, io=1)
             else:
                 print('\n\tSensitive data scan not required for DVD-Video or CDDA content; moving on to next step...')
                 
@@ -2399,14 +4263,25 @@ class DigitalObject(Shipment):
         if self.check_premis('format identification') and not self.re_analyze:
             print('\n\tFile format analysis already completed; moving on to next operation...')
         else:
-            self.format_analysis()
+            scheduler.add('format identification', self.format_analysis, cpu=1, io=1)
         
         #load siegfried.csv into sqlite database; skip if it's already completed
         if not os.path.exists(self.sqlite_done) or self.re_analyze:
-            self.import_csv() # load csv into sqlite db
+            scheduler.add('siegfried import', self.import_csv, deps=['format identification'], cpu=1, io=0)
+        
+        #run the scans; keep a record of how long each one took
+        print('\n\nRUNNING ANALYSIS...')
+        timings = scheduler.run()
+        
+        if timings:
+            self.db['analysis_timings'] = timings
+            self.db.sync()
+            print('\n\nANALYSIS STAGE TIMES:\n\t{}'.format('\n\t'.join('{}: {:.1f} seconds'.format(name, seconds) for name, seconds in timings.items())))
+        
+        self.controller.checkpoint()
         
-        '''generate statistics/reports'''
-        if not os.path.exists(self.stats_done) or self.re_analyze:
+        '''generate statistics/reports; stats are needed for the HTML report, but are loaded from cache if nothing has changed'''
+        if not os.path.exists(self.stats_done) or not os.path.exists(self.new_html) or self.re_analyze:
             self.get_stats()
         
         '''write info to HTML'''
@@ -2421,11 +4296,14 @@ class DigitalObject(Shipment):
         
         status, msg = shipment_spreadsheet.verify_spreadsheet()
         if not status:
-            messagebox.showwarning(title='WARNING', message=msg, master=self)
+            self.controller.alert('WARNING', msg)
             return
         
         shipment_spreadsheet.open_wb()
         shipment_spreadsheet.write_to_spreadsheet(self.db['info'])
+        
+        #make sure the row is saved (it may be held back by a batch) before we mark the item as done
+        shipment_spreadsheet.session.flush()
            
         #create file to indicate that process was completed
         if not os.path.exists(self.done_file):
@@ -2477,10 +4355,9 @@ class Spreadsheet(Shipment):
     
     def open_wb(self):
         
-        if not os.path.exists(self.spreadsheet):
-            self.wb = openpyxl.Workbook()
-        else:
-            self.wb = openpyxl.load_workbook(self.spreadsheet)
+        #workbooks are loaded once per session and reused; see WorkbookSession
+        self.session = WorkbookSession.get(self.spreadsheet)
+        self.wb = self.session.load()
             
         if self.__class__.__name__ == 'MasterSpreadsheet':
             self.item_ws = self.wb['Item']
@@ -2494,163 +4371,80 @@ class Spreadsheet(Shipment):
         elif self.__class__.__name__ == 'McoSpreadsheet':
             self.mco_ws = self.wb.active
     
+    def locked(self):
+        #hold the workbook session's lock while several threads may be using it (e.g., RipStation batches)
+        return WorkbookSession.get(self.spreadsheet).lock
+    
+    def shipment_metadata(self):
+        """Return Inventory/Appraisal metadata for the whole shipment; loaded once per workbook session"""
+        if self.session.metadata is None:
+            self.session.metadata = ShipmentMetadata(self.session)
+        return self.session.metadata
+    
     def get_unit_liaison(self):
         
         for row in self.info_ws['A']:
             if 'Email:' in row.value:
                 return self.info_ws.cell(row=row.row, column=2).value
     
-    def return_row(self, ws):
-        #set initial Boolean value to false; change to True if barcode is found
-        found = False
+    def return_row(self, ws, identifier=None):
         
         #get max row from supplied worksheet
         current_row = ws.max_row+1
         
-        self.identifier = self.controller.identifier.get()
+        if identifier is None:
+            identifier = self.controller.identifier.get()
+        self.identifier = identifier
         
-        if ws.title in ['Inventory', 'Appraisal', 'Item']:
-            #if barcode exists in spreadsheet, set variable to that row
-            for cell in ws['A']:
-                if (cell.value is not None):
-                    if self.identifier == str(cell.value).strip():
-                        current_row = cell.row
-                        found = True
-                        break
+        #look up identifier (or, for the cumulative worksheet in master_spreadsheet, unit_name and shipment_date) in the sheet index
+        index = self.session.index(ws)
         
-        #for the cumulative worksheet in master_spreadsheet, we need to match on the unit_name and shipment_date
+        if ws.title in ['Inventory', 'Appraisal', 'Item']:
+            found_row = index.find(self.identifier)
         elif ws.title == 'Cumulative':
-            iterrows = ws.iter_rows()
-            next(iterrows)
-            
-            for row in iterrows:    
-                if not row[0].value is None and not row[1].value is None:
-                    if self.unit_name in row[0].value and self.shipment_date in row[1].value:
-                        current_row = row[0].row
-                        found = True
-                        break
-                        
-        return found, current_row  
+            found_row = index.find_shipment(self.unit_name, self.shipment_date)
+        else:
+            found_row = None
+        
+        if found_row is None:
+            return False, current_row
+        else:
+            return True, found_row
              
     def get_spreadsheet_columns(self, ws):
+        return dict(self.session.index(ws).columns)
+        
+    def write_to_spreadsheet(self, current_dict, ws=None, save=True):
+    
+        #the workbook session may be shared with other threads
+        with self.locked():
+            if ws is None:
+                ws = self.app_ws
+            
+            #make sure we write to the current copy of the workbook (it is reloaded if the file was changed elsewhere)
+            self.open_wb()
+            ws = self.wb[ws.title]
+            
+            #use the identifier recorded with the metadata, if there is one: the barcode field may have moved on while a background job was running
+            found, current_row = self.return_row(ws, current_dict.get('identifier'))
+            
+            index = self.session.index(ws)
+            ws_cols = dict(index.columns)
+            
+            if ws.title == 'Cumulative':
+                row_key = (self.unit_name, self.shipment_date)
+            else:
+                row_key = self.identifier
+            
+            self.session.update_row(ws, row_key, current_row, {ws_cols[key] : current_dict[key] for key in ws_cols.keys() if key in current_dict})
+            
+            #new rows are added to the index so later lookups don't need a rebuild
+            if not found and ws.max_row >= current_row:
+                index.add(row_key, current_row)
 
-        spreadsheet_columns = {}
-        for cell in ws[1]:
-            if not cell.value is None:
-                if 'identifier' in str(cell.value).lower():
-                    spreadsheet_columns['identifier'] = cell.column
-                elif cell.value.lower().strip() == 'unit':
-                    spreadsheet_columns['unit_name'] = cell.column
-                elif cell.value.lower().strip() == 'shipmentid':
-                    spreadsheet_columns['shipment_date'] = cell.column
-                elif 'accession' in cell.value.lower():
-                    spreadsheet_columns['accession_number'] = cell.column
-                elif 'collection title' in cell.value.lower():
-                    spreadsheet_columns['collection_title'] = cell.column
-                elif 'collection id' in cell.value.lower():
-                    spreadsheet_columns['collection_id'] = cell.column
-                elif 'creator' in cell.value.lower():
-                    spreadsheet_columns['collection_creator'] = cell.column
-                elif 'physical location' in cell.value.lower():
-                    spreadsheet_columns['phys_loc'] = cell.column
-                elif 'source type' in cell.value.lower():
-                    spreadsheet_columns['content_source_type'] = cell.column
-                elif cell.value.strip().lower() == 'title':
-                    spreadsheet_columns['item_title'] = cell.column
-                elif 'label transcription' in cell.value.lower():
-                    spreadsheet_columns['label_transcription'] = cell.column
-                elif cell.value.strip().lower() == 'description':
-                    spreadsheet_columns['item_description'] = cell.column
-                elif 'appraisal notes' in cell.value.lower():
-                    spreadsheet_columns['appraisal_notes'] = cell.column
-                elif 'content date range' in cell.value.lower():
-                    spreadsheet_columns['assigned_dates'] = cell.column
-                elif 'instructions' in cell.value.lower():
-                    spreadsheet_columns['bdpl_instructions'] = cell.column
-                elif 'restriction statement' in cell.value.lower():
-                    spreadsheet_columns['restriction_statement'] = cell.column
-                elif 'restriction end date' in cell.value.lower():
-                    spreadsheet_columns['restriction_end_date'] = cell.column
-                elif 'move directly to sda' in cell.value.lower():
-                    spreadsheet_columns['initial_appraisal'] = cell.column
-                elif 'transfer method' in cell.value.lower():
-                    spreadsheet_columns['transfer_method'] = cell.column
-                elif 'migration date' in cell.value.lower():
-                    spreadsheet_columns['migration_date'] = cell.column
-                elif 'migration notes' in cell.value.lower():
-                    spreadsheet_columns['technician_note'] = cell.column
-                elif 'migration outcome' in cell.value.lower():
-                    spreadsheet_columns['migration_outcome'] = cell.column
-                elif 'extent (normalized)' in cell.value.lower():
-                    spreadsheet_columns['extent_normal'] = cell.column
-                elif 'extent (raw)' in cell.value.lower():
-                    spreadsheet_columns['extent_raw'] = cell.column
-                elif 'extracted files extent' in cell.value.lower():
-                    spreadsheet_columns['extent_raw'] = cell.column
-                elif 'no. of files' in cell.value.lower():
-                    spreadsheet_columns['item_file_count'] = cell.column
-                elif 'extracted files number' in cell.value.lower():
-                    spreadsheet_columns['item_file_count'] = cell.column
-                elif 'no. of duplicate files' in cell.value.lower():
-                    spreadsheet_columns['item_duplicate_count'] = cell.column
-                elif 'no. of unidentified files' in cell.value.lower():
-                    spreadsheet_columns['item_unidentified_count'] = cell.column
-                elif 'file formats' in cell.value.lower():
-                    spreadsheet_columns['format_overview'] = cell.column
-                elif 'begin date' in cell.value.lower():
-                    spreadsheet_columns['begin_date'] = cell.column
-                elif cell.value.lower() == 'end date':
-                    spreadsheet_columns['end_date'] = cell.column
-                elif 'virus status' in cell.value.lower():
-                    spreadsheet_columns['virus_scan_results'] = cell.column
-                elif 'pii status' in cell.value.lower():
-                    spreadsheet_columns['pii_scan_results'] = cell.column
-                elif 'full report' in cell.value.lower():
-                    spreadsheet_columns['full_report'] = cell.column
-                elif 'link to transfer' in cell.value.lower():
-                    spreadsheet_columns['transfer_link'] = cell.column
-                elif 'appraisal results' in cell.value.lower():
-                    spreadsheet_columns['final_appraisal'] = cell.column
-                elif 'job type' in cell.value.lower():
-                    spreadsheet_columns['job_type'] = cell.column                
-                #additional elements for master_spreadsheet 'Item' sheet
-                elif 'sip creation date' in cell.value.lower():
-                    spreadsheet_columns['sip_creation_date'] = cell.column
-                elif 'sip extent' in cell.value.lower():
-                    spreadsheet_columns['sip_extent'] = cell.column
-                elif 'sip md5' in cell.value.lower():
-                    spreadsheet_columns['sip_md5'] = cell.column
-                elif 'sip filename' in cell.value.lower():
-                    spreadsheet_columns['sip_filename'] = cell.column                    
-                #additional elements for master_spreadsheet 'Cumulative'
-                elif 'sip count' in cell.value.lower():
-                    spreadsheet_columns['sip_count'] = cell.column
-                elif 'sips extent' in cell.value.lower():
-                    spreadsheet_columns['sips_extent'] = cell.column
-                elif 'ingest start date' in cell.value.lower():
-                    spreadsheet_columns['ingest_start_date'] = cell.column
-                elif cell.value.lower() == 'ingest end date':
-                    spreadsheet_columns['ingest_end_date'] = cell.column
-                elif 'ingest duration' in cell.value.lower():
-                    spreadsheet_columns['ingest_duration'] = cell.column
-        return spreadsheet_columns
-        
-    def write_to_spreadsheet(self, current_dict, ws=None):
-    
-        if ws is None:
-            ws = self.app_ws
-        
-        current_row = self.return_row(ws)[1]
-        
-        ws_cols = self.get_spreadsheet_columns(ws)
-
-        for key in ws_cols.keys():
-            
-            if key in current_dict:
-                ws.cell(row=current_row, column=ws_cols[key], value=current_dict[key])
-
-        #save and close spreadsheet
-        self.wb.save(self.spreadsheet) 
+            #save spreadsheet (held back during batches); batch writers with save=False flush the session themselves
+            if save:
+                self.session.commit()
         
     def check_shipment_progress(self):
         
@@ -2665,19 +4459,20 @@ class Spreadsheet(Shipment):
             messagebox.showwarning(title='WARNING', message=msg, master=self)
             return
         
-        self.open_wb()
+        #this is just a read-only pass over the barcode columns
+        self.session = WorkbookSession.get(self.spreadsheet)
         
         #get list of all barcodes on appraisal spreadsheet
         app_barcodes = []
-        for col in self.app_ws['A'][1:]:
-            if not col.value is None:
-                app_barcodes.append(str(col.value))
+        for (value,) in self.session.read_rows('Appraisal', min_row=2, max_col=1):
+            if not value is None:
+                app_barcodes.append(str(value))
         
         #get list of all barcodes on inventory spreadsheet
         inv_barcodes = {}
-        for col in self.inv_ws['A'][1:]:
-            if not col.value is None:
-                inv_barcodes[str(col.value)] = col.row
+        for row, (value,) in enumerate(self.session.read_rows('Inventory', min_row=2, max_col=1), 2):
+            if not value is None:
+                inv_barcodes[str(value)] = row
         
         inv_list = list(inv_barcodes.keys())        
         
@@ -2748,7 +4543,8 @@ class McoSpreadsheet(Spreadsheet):
         mco_header = ['Other Identifier', 'Other Identifier Type', 'Other Identifier', 'Other Identifier Type', 'Other Identifier', 'Other Identifier Type', 'Title', 'Creator', 'Date Issued', 'Abstract', 'Physical Description', 'Publish', 'File', 'Label']
         self.mco_ws.append(mco_header)
         
-        self.wb.save(self.spreadsheet)
+        self.session.touch('header')
+        self.session.flush()
         
     def add_columns(self, column_count):
         #new 'file' column will be two over from the last one
@@ -2765,12 +4561,14 @@ class McoSpreadsheet(Spreadsheet):
         
         self.mco_ws.cell(row=2, column=current_max, value='Label')
         
-        self.wb.save(self.spreadsheet)
+        self.session.touch('header')
+        self.session.commit()
         
-    def write_row(self, metadata_list):
+    def write_row(self, metadata_list, identifier):
         
         self.mco_ws.append(metadata_list)
-        self.wb.save(self.spreadsheet)
+        self.session.touch(identifier)
+        self.session.commit()
 
 class ManualPremisEvent(tk.Toplevel):
     def __init__(self, controller):
@@ -2946,7 +4744,7 @@ class RipstationBatch(Shipment):
         Shipment.__init__(self, controller)
         
         self.controller = controller 
-        self.ripstation_userdata = self.contoller.ripstation_userdata.get()
+        self.ripstation_userdata = self.controller.ripstation_userdata.get()
         self.ripstation_log = self.controller.ripstation_log.get()
         self.ripstation_ingest_option = self.controller.ripstation_ingest_option.get()
         
@@ -2957,6 +4755,15 @@ class RipstationBatch(Shipment):
         self.replicated_report = os.path.join(self.ripstation_reports, 'replicated_ripstation.txt')
         self.analyzed_report = os.path.join(self.ripstation_reports, 'analyzed_ripstation.txt')
         
+        #pipeline: discs replicated at once, discs analyzed at once, and items held in the pipeline (replicated discs can queue up for analysis)
+        self.stage_limits = dict(self.controller.ripstation_workers)
+        self.max_in_flight = self.stage_limits['replicate'] + self.stage_limits['analyze'] * 2
+        
+        self.active = {}
+        self.futures = {}
+        self.stage_counts = Counter()
+        self.ready = {'replicate' : deque(), 'analyze' : deque()}
+        
         #get a timestamp for ripstation batch
         self.rs_timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(self.ripstation_log)).strftime('%Y-%m-%d')
             
@@ -2969,250 +4776,355 @@ class RipstationBatch(Shipment):
         if not os.path.exists(self.ripstation_reports):
             os.makedirs(self.ripstation_reports)
           
+    def read_report(self, report):
+        #identifiers listed in a report file (failed items are followed by a tab and the reason)
+        if not os.path.exists(report):
+            return set()
+        with open(report, 'r') as f:
+            return set(line.split('\t')[0].strip() for line in f if line.strip())
+    
     def ripstation_batch_ingest(self):
         
-        #loop through our list of barcodes
-        for item in self.batch_barcodes:
-            
-            print('\nWorking on item: {}'.format(item))
-            
-            #set our barcode variable and create barcode object
-            self.controller.identifier.set(item)
-            current_item = DigitalObject(self.controller)
+        #discs are replicated on one thread pool and analyzed on another, so the next disc is replicated while earlier ones are analyzed. 
+        #Only this thread writes the report files; they are checkpoints, so a restarted batch skips whatever was already replicated or analyzed.
+        self.failed_items = self.read_report(self.failed_ingest_report)
+        self.replicated_items = self.read_report(self.replicated_report)
+        self.analyzed_items = self.read_report(self.analyzed_report)
+        
+        #the RipStation log is read once and searched for each disc
+        with open(self.ripstation_log, 'r') as f:
+            self.ripstation_log_lines = f.read().splitlines()
+        
+        self.replicate_pool = concurrent.futures.ThreadPoolExecutor(self.stage_limits['replicate'])
+        self.analyze_pool = concurrent.futures.ThreadPoolExecutor(self.stage_limits['analyze'])
+        
+        try:
+            #loop through our list of barcodes
+            for item in self.batch_barcodes:
                 
-            #if item has already failed, skip it.
-            if self.controller.check_list(self.failed_ingest_report, current_item.identifier):
-                print('\nThis item previously failed.  Moving on to next item...')
-                continue
+                #stop between items if the job has been cancelled: let items in the pipeline reach a checkpoint, then stop
+                try:
+                    self.controller.checkpoint()
+                except JobCancelled:
+                    self.pump(1)
+                    raise
                 
-            #prep barcode; proceed to next item if any errors
-            if not self.controller.check_list(self.replicated_report, current_item.identifier):
+                #don't take on a new item until there's room in the pipeline
+                self.pump(self.max_in_flight)
                 
-                print('\nLOADING METADATA AND CREATING FOLDERS...')
+                #if item has already failed or been analyzed, skip it.
+                if item in self.failed_items:
+                    print('\n{}: this item previously failed.  Moving on to next item...'.format(item))
+                    continue
                 
-                status, msg = current_item.prep_barcode()
-                if not status:
-                    self.controller.write_list(self.failed_ingest_report, '{}\t{}'.format(current_item.identifier, msg))
+                if item in self.analyzed_items:
+                    print('\n{}: this item has already been replicated and analyzed.  Moving on to next item...'.format(item))
                     continue
                 
-                if self.ripstation_ingest_option == 'CDs':
-                    #set job_type
-                    current_item.job_type = 'CDDA'
-                    
-                    #make sure .WAV and .CUE file were produced
-                    try:
-                        current_item.orig_rs_cue = glob.glob(os.path.join(current_item.files_dir, '*.cue'))[0]
-                    except IndexError:
-                        print("\nMissing '.cue' file; moving on to next item...")
-                        self.controller.write_list(self.failed_ingest_report, '{}\tMissing .cue file'.format(current_item.identifier))
-                        continue
-                    
-                    if not os.path.exists(current_item.rs_wav_file):
-                        print("\nMissing '.wav' file; moving on to next item...")
-                        self.controller.write_list(self.failed_ingest_report, '{}\tMissing .wav file'.format(current_item.identifier))
-                        continue
-                    
-                    #write premis information for creating WAV; we assume that this operation was successful
-                    timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(current_item.rs_wav_file)).isoformat()
-                    
-                    current_item.record_premis(timestamp, 'normalization', 0, 'RipStation BR6-7604 batch .WAV file creation', 'Transformed object to an institutionally supported preservation format (.WAV).', 'RipStation V4.4.13.0')
-                    
-                    #save ripstation log information for disc to log_dir.  Have to get album # from txt file...
-                    txt_file = glob.glob(os.path.join(current_item.files_dir, '*.txt'))[0]
-                    
-                    album_number = os.path.splitext(os.path.basename(txt_file))[0]
-
-                    with open(current_item.ripstation_item_log, 'w') as outf:
-                        outf.write('RipStation V4.4.13.0\n')
-                        with open(self.ripstation_log, 'r') as inf:
-                            for line in inf.read().splitlines():
-                                if album_number in line:
-                                    outf.write('{} {}\n'.format(self.rs_timestamp, line))
-                    
-                    print('\nSTEP 1: FORMAT NORMALIZATION TO .BIN\n\n')
-                    
-                    #get info about wav file
-                    cmd = 'ffprobe -i {} -hide_banner -show_streams -select_streams a'.format(self.rs_wav_file)
-                    
-                    audio_info = subprocess.check_output(cmd, shell=True, text=True).split('\n')
-                    
-                    audio_dict = {}
-                    
-                    for a in audio_info:
-                        if '=' in a:
-                            audio_dict[a.split('=')[0]] = a.split('=')[1]
-                    
-                    sample_rate = audio_dict['sample_rate']
-                    channels = audio_dict['channels']
-                    
-                    #now create bin file with raw 16 bit little-endian PCM 
-                    cmd = 'ffmpeg -y -i {} -hide_banner -ar {} -ac {} -f s16le -acodec pcm_s16le {}'.format(current_item.rs_wav_file, sample_rate, channels, current_item.rs_cdr_bin)
-                    
-                    timestamp = str(datetime.datetime.now())
-                    exitcode_bin = subprocess.call(cmd, shell=True)
-                    
-                    ffmpeg_ver = '; '.join(subprocess.check_output('"C:\\Program Files\\ffmpeg\\bin\\ffmpeg" -version', shell=True, text=True).splitlines()[0:2])
-               
-                    current_item.record_premis(timestamp, 'normalization', exitcode_bin, cmd, 'Transformed object to an institutionally supported preservation format (.BIN)', ffmpeg_ver)
-                    
-                    #correct cue file; save to file_dir.  
-                    with open(current_item.rs_wav_cue, 'w') as outfile:
-                        with open(current_item.orig_rs_cue, 'r') as infile:
-                            for line in infile.readlines():
-                                if line.startswith('FILE'):
-                                    outfile.write(line.replace('WAV1', 'WAVE'))
-                                elif line.startswith('  TRACK') or line.startswith('    INDEX'):
-                                    outfile.write(line)
-                    
-                    #copy corrected cue file to image_dir; correct FILE reference
-                    with open(current_item.rs_cdr_cue, 'w') as outfile:
-                        with open(current_item.rs_wav_cue, 'r') as infile:
-                            for line in infile.readlines():
-                                if line.startswith('FILE'):
-                                    outfile.write('FILE "{}" BINARY\n'.format(os.path.basename(current_item.rs_cdr_bin)))
-                                elif line.startswith('  TRACK') or line.startswith('    INDEX'):
-                                    outfile.write(line)
-                    
-                    #remove original cue and txt file        
-                    os.remove(current_item.orig_rs_cue)
-                    os.remove(txt_file)
-                    
-                    #create toc file
-                    cue2toc_ver = subprocess.check_output('cue2toc -v', text=True).split('\n')[0]
-                    timestamp = str(datetime.datetime.now())
-                    cmd = 'cue2toc -o {} {}'.format(current_item.rs_cdr_toc, current_item.rs_cdr_cue)
-                    exitcode = subprocess.call(cmd, shell=True, text=True)
-                    
-                    #record premis
-                    current_item.record_premis(timestamp, 'metadata modification', exitcode, cmd, "Converted the CD's .CUE file to the table of contents (.TOC) format.", cue2toc_ver)
-                    
-                    #record successful completion
-                    self.controller.write_list(self.replicated_report, current_item.identifier)
-                    
-                elif self.ripstation_ingest_option == 'DVD_Data':
-                    
-                    #make sure we can account for our original .ISO imagefile
-                    if not os.path.exists(current_item.ripstation_orig_imagefile):
-                    
-                        if os.path.exists(current_item.imagefile):
-                            print('\n.ISO file already changed to .DD; converting back to complete operations.')
-                            os.rename(current_item.imagefile, current_item.ripstation_orig_imagefile)
-                            
-                        elif os.path.exists(os.path.join(current_item.image_dir, '{}.mdf'.format(current_item.identifier))):
-                            print('\nWARNING: item is Compact Disc Digital Audio; unable to transfer using RipStation DataGrabber.')
-                            self.controller.write_list(self.failed_ingest_report, '{}\tDisc is CDDA; transfer using original RipStation'.format(current_item.identifier))
-                            continue
-                            
-                        else:
-                            print('\nWARNING: disk image does not exist!  Moving on to next item...')
-                            self.controller.write_list(self.failed_ingest_report, '{}\tDisk image does not exist'.format(current_item.identifier))
-                            continue
-                    
-                    #write premis information for disk image creation.  Even if image is unreadable, we assume that this operation was successful
-                    timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(current_item.ripstation_orig_imagefile)).isoformat()
-                    
-                    current_item.record_premis(timestamp, 'disk image creation', 0, 'RipStation BR6-7604 ISO image batch operation', 'Extracted a disk image from the physical information carrier.', 'RipStation DataGrabber V1.0.35.0')
-                    
-                    #save ripstation log information for disc to log_dir.  Make sure it's only written once...
-                    with open(current_item.ripstation_item_log, 'w') as outf:
-                        outf.write('RipStation DataGrabber V1.0.35.0\n')
-                        with open(self.ripstation_log, 'r') as inf:
-                            for line in inf.read().splitlines():
-                                if current_item.identifier in line:
-                                    outf.write('{} {}\n' % (self.rs_timestamp, line))
-                    
-                    #mount .ISO so we can verify disk image type
-                    exitcode = current_item.mount_iso()
-                    if exitcode != 0:
-                        print('\nWARNING: failed to mount disk image!  Moving on to next item...')
-                        self.controller.write_list(self.failed_ingest_report, '{}\tFailed to mount disk image'.format(current_item.identifier))
-                        continue
-                    
-                    #set media_attached variable to true: confirms that 'media' (mounted disk image) is present; required by bdpl_ingest functions
-                    self.controller.media_attached.set(True)
-                    current_item.media_attached = self.controller.media_attached.get()
-                    
-                    #get drive letter for newly mounted disk image
-                    drive_letter = current_item.get_iso_drive_letter()
-                    
-                    #run lsdvd to determine if job_type is DVD or Disk_image
-                    print('\nCHECKING IF DISC IS DATA OR DVD-VIDEO...')
-                    titlecount, title_format = lsdvd_check(folders, identifier, drive_letter)
-                    
-                    #fail if disc is PAL-formatted
-                    if title_format == 'PAL':
-                        print('\nWARNING: PAL-formatted DVD; need to develop appropriate procedures...')
-                        self.controller.write_list(self.failed_ingest_report, '{}\tFailed replication: PAL-formatted DVD'.format(current_item.identifier))
-                        continue
-                    
-                    if titlecount == 0:
-                        current_item.job_type = 'Disk_image'
-                        
-                        #dismount disk image
-                        exitcode = current_item.dismount_iso()
-                        if exitcode != 0:
-                            print('\nWARNING: failed to dismount disk image!  Moving on to next item...')
-                            self.controller.write_list(self.failed_ingest_report, '{}\tFailed to dismount disk image'.format(current_item.identifier))
-                            continue
-                        
-                        #rename to '.dd' file extension
-                        timestamp = str(datetime.datetime.now())
-                        
-                        os.rename(current_item.ripstation_orig_imagefile, current_item.imagefile)
-                        
-                        #document change to filename
-                        current_item.record_premis(timestamp, 'filename change', 0, 'os.rename({}, {})'.format(current_item.ripstation_orig_imagefile, current_item.imagefile), 'Modified the filename, changing extension from .ISO to .DD to ensure consistency with IUL BDPL practices', 'Python %s' % sys.version.split()[0])
-                    
-                        #next, get technical metadata from disk image and replicate files so we can run additional analyses (this step will also involve creating DFXML and correcting MAC times)
-                        current_item.disk_image_info()
-                        current_item.disk_image_replication()
-                    
-                    else:
-                        current_item.job_type = 'DVD'
-                        
-                        current_item.normalize_dvd_content(titlecount, drive_letter)
-                        
-                        #dismount disk image
-                        print('\nDISMOUNTING DISK IMAGE FILE...') 
-                        exitcode = current_item.dismount_iso()
-                        if exitcode != 0:
-                            print('\nWARNING: failed to dismount disk image!  Moving on to next item...')
-                            self.controller.write_list(self.failed_ingest_report, '{}\tFailed to dismount disk image'.format(current_item.identifier))
-                            continue
-                            
-                        #rename to '.dd' file extension
-                        os.rename(current_item.ripstation_orig_imagefile, current_item.imagefile)
-                    
-                    #record successful status if files exist; otherwise note failure
-                    if current_item.check_files(current_item.files_dir):
-                        self.controller.write_list(self.replicated_report, current_item.identifier)
-                    else:
-                        print('\nWARNING: failed to replicate files!  Moving on to next item...')
-                        self.controller.write_list(self.failed_ingest_report, '{}\tFailed to replicate files'.format(current_item.identifier))
-                        continue
-            
-            if not self.controller.check_list(self.analyzed_report, current_item.identifier):
-                current_item.run_item_analysis()
+                print('\nWorking on item: {}'.format(item))
                 
-                #check procedures
-                jobs = ['virus check', 'metadata extraction', 'message digest calculation', 'format identification']
+                #create barcode object; it is pinned to this shipment, as the technician may be working on something else
+                current_item = DigitalObject(ControllerView(self.controller, unit_name=self.unit_name, shipment_date=self.shipment_date, identifier=item))
                 
-                if current_item.job_type == 'Disk_image':
-                    jobs.append('sensitive data scan')
+                #items analyzed at the same time share out the cores
+                current_item.analysis_cpu_budget = max(2, current_item.analysis_cpu_budget // self.stage_limits['analyze'])
                 
-                failed_analysis_jobs = []
-
-                for job in jobs:
-                    if not current_item.check_premis(job):
-                        failed_analysis_jobs.append(job)
+                self.active[current_item.identifier] = current_item
                 
-                if len(failed_analysis_jobs) > 0:
-                    print('\nWARNING: analysis did not complete with:\n\t{}'.format('\n\t'.join(failed_analysis_jobs)))
-                    self.controller.write_list(self.failed_ingest_report, '{}\tFailed analysis job(s): {}'.format(current_item.identifier, ', '.join(failed_analysis_jobs)))
-                    continue
+                if current_item.identifier in self.replicated_items:
+                    self.submit('analyze', current_item)
                 else:
-                    self.controller.write_list(self.analyzed_report, current_item.identifier)
-                        
+                    self.submit('replicate', current_item)
+            
+            #let everything still in the pipeline finish
+            self.pump(1)
+        
+        finally:
+            self.replicate_pool.shutdown(cancel_futures=True)
+            self.analyze_pool.shutdown(cancel_futures=True)
+    
+    def submit(self, stage, current_item):
+        #keep each pool's queue bounded; anything over the limit waits here until a worker frees up
+        if self.stage_counts[stage] < self.stage_limits[stage]:
+            if stage == 'replicate':
+                future = self.replicate_pool.submit(self.controller.job_thread(self.replicate_item), current_item)
+            else:
+                future = self.analyze_pool.submit(self.controller.job_thread(self.analyze_item), current_item)
+            self.futures[future] = (stage, current_item)
+            self.stage_counts[stage] += 1
+        else:
+            self.ready[stage].append(current_item)
+    
+    def pump(self, max_active):
+        """Process finished stages until fewer than max_active items are in the pipeline"""
+        while len(self.active) >= max_active and len(self.futures) > 0:
+            
+            done, not_done = concurrent.futures.wait(self.futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            
+            for future in done:
+                self.complete(future)
+    
+    def complete(self, future):
+        stage, current_item = self.futures.pop(future)
+        identifier = current_item.identifier
+        self.stage_counts[stage] -= 1
+        
+        try:
+            status, msg = future.result()
+        except JobCancelled:
+            #nothing is recorded, so the item picks up where it left off next time
+            status, msg = None, None
+        except Exception as e:
+            status, msg = False, 'Unexpected error during {}: {}'.format('replication' if stage == 'replicate' else 'analysis', e)
+        
+        if status is None:
+            del self.active[identifier]
+        
+        elif not status:
+            print('\n{}: {}'.format(identifier, msg))
+            self.controller.write_list(self.failed_ingest_report, '{}\t{}'.format(identifier, msg))
+            self.failed_items.add(identifier)
+            del self.active[identifier]
+        
+        elif stage == 'replicate':
+            print('\n{}: replication complete; queued for analysis.'.format(identifier))
+            self.controller.write_list(self.replicated_report, identifier)
+            self.replicated_items.add(identifier)
+            self.submit('analyze', current_item)
+        
+        else:
+            print('\n{}: analysis complete.'.format(identifier))
+            self.controller.write_list(self.analyzed_report, identifier)
+            self.analyzed_items.add(identifier)
+            del self.active[identifier]
+        
+        #start anything that was waiting for this pool
+        if len(self.ready[stage]) > 0:
+            self.submit(stage, self.ready[stage].popleft())
+    
+    def replicate_item(self, current_item):
+        """Prep the barcode and normalize/replicate RipStation output; returns (status, msg)"""
+        self.controller.checkpoint()
+        
+        print('\nLOADING METADATA AND CREATING FOLDERS...')
+        
+        status, msg = current_item.prep_barcode()
+        if not status:
+            return (False, msg)
+        
+        if self.ripstation_ingest_option == 'CDs':
+            return self.replicate_cd(current_item)
+        
+        elif self.ripstation_ingest_option == 'DVD_Data':
+            return self.replicate_dvd_data(current_item)
+        
+        return (False, 'Unknown RipStation ingest option: {}'.format(self.ripstation_ingest_option))
+    
+    def replicate_cd(self, current_item):
+        #set job_type
+        current_item.job_type = 'CDDA'
+        
+        #make sure .WAV and .CUE file were produced
+        try:
+            current_item.orig_rs_cue = glob.glob(os.path.join(current_item.files_dir, '*.cue'))[0]
+        except IndexError:
+            print("\nMissing '.cue' file; moving on to next item...")
+            return (False, 'Missing .cue file')
+        
+        if not os.path.exists(current_item.rs_wav_file):
+            print("\nMissing '.wav' file; moving on to next item...")
+            return (False, 'Missing .wav file')
+        
+        #write premis information for creating WAV; we assume that this operation was successful
+        timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(current_item.rs_wav_file)).isoformat()
+        
+        current_item.record_premis(timestamp, 'normalization', 0, 'RipStation BR6-7604 batch .WAV file creation', 'Transformed object to an institutionally supported preservation format (.WAV).', 'RipStation V4.4.13.0')
+        
+        #save ripstation log information for disc to log_dir.  Have to get album # from txt file...
+        txt_file = glob.glob(os.path.join(current_item.files_dir, '*.txt'))[0]
+        
+        album_number = os.path.splitext(os.path.basename(txt_file))[0]
+
+        with open(current_item.ripstation_item_log, 'w') as outf:
+            outf.write('RipStation V4.4.13.0\n')
+            for line in self.ripstation_log_lines:
+                if album_number in line:
+                    outf.write('{} {}\n'.format(self.rs_timestamp, line))
+        
+        print('\nSTEP 1: FORMAT NORMALIZATION TO .BIN\n\n')
+        
+        #get info about wav file
+        cmd = 'ffprobe -i {} -hide_banner -show_streams -select_streams a'.format(current_item.rs_wav_file)
+        
+        audio_info = subprocess.check_output(cmd, shell=True, text=True).split('\n')
+        
+        audio_dict = {}
+        
+        for a in audio_info:
+            if '=' in a:
+                audio_dict[a.split('=')[0]] = a.split('=')[1]
+        
+        sample_rate = audio_dict['sample_rate']
+        channels = audio_dict['channels']
+        
+        #now create bin file with raw 16 bit little-endian PCM 
+        cmd = 'ffmpeg -y -i {} -hide_banner -ar {} -ac {} -f s16le -acodec pcm_s16le {}'.format(current_item.rs_wav_file, sample_rate, channels, current_item.rs_cdr_bin)
+        
+        timestamp = str(datetime.datetime.now())
+        exitcode_bin = subprocess.call(cmd, shell=True)
+        
+        ffmpeg_ver = '; '.join(subprocess.check_output('"C:\\Program Files\\ffmpeg\\bin\\ffmpeg" -version', shell=True, text=True).splitlines()[0:2])
+   
+        current_item.record_premis(timestamp, 'normalization', exitcode_bin, cmd, 'Transformed object to an institutionally supported preservation format (.BIN)', ffmpeg_ver)
+        
+        #correct cue file; save to file_dir.  
+        with open(current_item.rs_wav_cue, 'w') as outfile:
+            with open(current_item.orig_rs_cue, 'r') as infile:
+                for line in infile.readlines():
+                    if line.startswith('FILE'):
+                        outfile.write(line.replace('WAV1', 'WAVE'))
+                    elif line.startswith('  TRACK') or line.startswith('    INDEX'):
+                        outfile.write(line)
+        
+        #copy corrected cue file to image_dir; correct FILE reference
+        with open(current_item.rs_cdr_cue, 'w') as outfile:
+            with open(current_item.rs_wav_cue, 'r') as infile:
+                for line in infile.readlines():
+                    if line.startswith('FILE'):
+                        outfile.write('FILE "{}" BINARY\n'.format(os.path.basename(current_item.rs_cdr_bin)))
+                    elif line.startswith('  TRACK') or line.startswith('    INDEX'):
+                        outfile.write(line)
+        
+        #remove original cue and txt file        
+        os.remove(current_item.orig_rs_cue)
+        os.remove(txt_file)
+        
+        #create toc file
+        cue2toc_ver = subprocess.check_output('cue2toc -v', text=True).split('\n')[0]
+        timestamp = str(datetime.datetime.now())
+        cmd = 'cue2toc -o {} {}'.format(current_item.rs_cdr_toc, current_item.rs_cdr_cue)
+        exitcode = subprocess.call(cmd, shell=True, text=True)
+        
+        #record premis
+        current_item.record_premis(timestamp, 'metadata modification', exitcode, cmd, "Converted the CD's .CUE file to the table of contents (.TOC) format.", cue2toc_ver)
+        
+        #record successful completion
+        return (True, None)
+    
+    def replicate_dvd_data(self, current_item):
+        
+        #make sure we can account for our original .ISO imagefile
+        if not os.path.exists(current_item.ripstation_orig_imagefile):
+        
+            if os.path.exists(current_item.imagefile):
+                print('\n.ISO file already changed to .DD; converting back to complete operations.')
+                os.rename(current_item.imagefile, current_item.ripstation_orig_imagefile)
+                
+            elif os.path.exists(os.path.join(current_item.image_dir, '{}.mdf'.format(current_item.identifier))):
+                print('\nWARNING: item is Compact Disc Digital Audio; unable to transfer using RipStation DataGrabber.')
+                return (False, 'Disc is CDDA; transfer using original RipStation')
+                
+            else:
+                print('\nWARNING: disk image does not exist!  Moving on to next item...')
+                return (False, 'Disk image does not exist')
+        
+        #write premis information for disk image creation.  Even if image is unreadable, we assume that this operation was successful
+        timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(current_item.ripstation_orig_imagefile)).isoformat()
+        
+        current_item.record_premis(timestamp, 'disk image creation', 0, 'RipStation BR6-7604 ISO image batch operation', 'Extracted a disk image from the physical information carrier.', 'RipStation DataGrabber V1.0.35.0')
+        
+        #save ripstation log information for disc to log_dir.  Make sure it's only written once...
+        with open(current_item.ripstation_item_log, 'w') as outf:
+            outf.write('RipStation DataGrabber V1.0.35.0\n')
+            for line in self.ripstation_log_lines:
+                if current_item.identifier in line:
+                    outf.write('{} {}\n'.format(self.rs_timestamp, line))
+        
+        #mount .ISO so we can verify disk image type
+        exitcode = current_item.mount_iso()
+        if exitcode != 0:
+            print('\nWARNING: failed to mount disk image!  Moving on to next item...')
+            return (False, 'Failed to mount disk image')
+        
+        #confirm that 'media' (mounted disk image) is present; required by bdpl_ingest functions
+        current_item.media_attached = True
+        
+        #get drive letter for newly mounted disk image
+        drive_letter = current_item.get_iso_drive_letter()
+        
+        #run lsdvd to determine if job_type is DVD or Disk_image
+        print('\nCHECKING IF DISC IS DATA OR DVD-VIDEO...')
+        titlecount, title_format = current_item.lsdvd_check(drive_letter)
+        
+        #fail if disc is PAL-formatted
+        if title_format == 'PAL':
+            print('\nWARNING: PAL-formatted DVD; need to develop appropriate procedures...')
+            return (False, 'Failed replication: PAL-formatted DVD')
+        
+        if titlecount == 0:
+            current_item.job_type = 'Disk_image'
+            
+            #dismount disk image
+            exitcode = current_item.dismount_iso()
+            if exitcode != 0:
+                print('\nWARNING: failed to dismount disk image!  Moving on to next item...')
+                return (False, 'Failed to dismount disk image')
+            
+            #rename to '.dd' file extension
+            timestamp = str(datetime.datetime.now())
+            
+            os.rename(current_item.ripstation_orig_imagefile, current_item.imagefile)
+            
+            #document change to filename
+            current_item.record_premis(timestamp, 'filename change', 0, 'os.rename({}, {})'.format(current_item.ripstation_orig_imagefile, current_item.imagefile), 'Modified the filename, changing extension from .ISO to .DD to ensure consistency with IUL BDPL practices', 'Python %s' % sys.version.split()[0])
+        
+            #next, get technical metadata from disk image and replicate files so we can run additional analyses (this step will also involve creating DFXML and correcting MAC times)
+            current_item.disk_image_info()
+            current_item.disk_image_replication()
+        
+        else:
+            current_item.job_type = 'DVD'
+            
+            current_item.normalize_dvd_content(titlecount, drive_letter)
+            
+            #dismount disk image
+            print('\nDISMOUNTING DISK IMAGE FILE...') 
+            exitcode = current_item.dismount_iso()
+            if exitcode != 0:
+                print('\nWARNING: failed to dismount disk image!  Moving on to next item...')
+                return (False, 'Failed to dismount disk image')
+                
+            #rename to '.dd' file extension
+            os.rename(current_item.ripstation_orig_imagefile, current_item.imagefile)
+        
+        #record successful status if files exist; otherwise note failure
+        if current_item.check_files(current_item.files_dir):
+            return (True, None)
+        else:
+            print('\nWARNING: failed to replicate files!  Moving on to next item...')
+            return (False, 'Failed to replicate files')
+    
+    def analyze_item(self, current_item):
+        """Run analysis procedures and confirm they completed; returns (status, msg)"""
+        current_item.run_item_analysis()
+        
+        #check procedures
+        jobs = ['virus check', 'metadata extraction', 'message digest calculation', 'format identification']
+        
+        if current_item.job_type == 'Disk_image':
+            jobs.append('sensitive data scan')
+        
+        failed_analysis_jobs = []
+
+        for job in jobs:
+            if not current_item.check_premis(job):
+                failed_analysis_jobs.append(job)
+        
+        if len(failed_analysis_jobs) > 0:
+            print('\nWARNING: analysis did not complete with:\n\t{}'.format('\n\t'.join(failed_analysis_jobs)))
+            return (False, 'Failed analysis job(s): {}'.format(', '.join(failed_analysis_jobs)))
+        
+        return (True, None)
                         
     def clean_up(self):
         
@@ -3231,6 +5143,24 @@ class SdaBatchDeposit(Shipment):
              
         self.bdpl_archiver_collection = os.path.join(self.controller.bdpl_archiver_spool_dir, self.controller.tabs['SdaDeposit'].archiver_dir.get())
         
+        #tracks space needed for SIPs on each destination volume
+        self.space_planner = SpacePlanner()
+        
+        #deposit pipeline: items bagged/tarred at once (each bag hashes with its share of the fixity workers), concurrent moves/deletions, and items held in the pipeline
+        self.stage_limits = {'package' : min(4, max(1, self.controller.fixity_workers // 2)), 'io' : 4}
+        self.max_in_flight = self.stage_limits['package'] * 2 + self.stage_limits['io']
+        
+        #save a tree hash (per-chunk md5s) of each SIP to bag_reports so large SIPs can be verified in parallel; kept out of the Archiver spool folder
+        self.sip_tree_hash = True
+        self.spreadsheet_batch_size = 25
+        
+        self.active = {}
+        self.futures = {}
+        self.stage_counts = Counter()
+        self.ready = {'package' : deque(), 'io' : deque()}
+        self.waiting_for_space = []
+        self.spreadsheet_batch = []
+        
         #set up deposit directories
         self.bag_report_dir = os.path.join(self.ship_dir, 'bag_reports')            
         self.deaccession_dir = os.path.join(self.ship_dir, 'deaccessioned')
@@ -3246,10 +5176,6 @@ class SdaBatchDeposit(Shipment):
         self.master_spreadsheet = MasterSpreadsheet(self.controller)
         self.shipment_spreadsheet = Spreadsheet(self.controller)
         
-        #set up shelve to track status
-        self.sda_status = os.path.join(self.bag_report_dir, 'sda_status')
-        self.sda_status_db = shelve.open(self.sda_status, writeback=True)
-        
         self.db_lists = [
             'spreadsheet_barcodes', #list of all barcodes in spreadsheet
             'directory_barcodes', #list of all barcodes in ship_dir
@@ -3276,14 +5202,11 @@ class SdaBatchDeposit(Shipment):
             'separation-stats', #stats on separations
             'other_action' #barcodes with 'other' final appraisal decisions
         ]
-            
-        if len(self.sda_status_db) == 0:
- 
-            for ls in self.db_lists:
-                self.sda_status_db[ls] = []
-            
-            for dc in self.db_dicts:
-                self.sda_status_db[dc] = {}         
+        
+        #set up status store; db_lists and the 'failed' and 'other_action' dicts are tracked as stages for each identifier. Bring in the shelve from earlier sessions, if there is one
+        self.sda_status = os.path.join(self.bag_report_dir, 'sda_status')
+        self.sda_status_db = SdaStatusStore('{}.sqlite'.format(self.sda_status), self.db_lists, ['failed', 'other_action'])
+        self.sda_status_db.migrate_shelve(self.sda_status)
     
     def return_dates(self, list_of_folders):
     
@@ -3399,356 +5322,43 @@ class SdaBatchDeposit(Shipment):
             
             #make sure we have our master_list; if identifier is in it, return True
             if db.get('master_list') and identifier in db['master_list']:
-                    return True
-                    
-        #otherwise, return False
-        return False
-    
-    def deposit_barcodes_to_sda(self):
-        
-        for item in self.sda_status_db['directory_barcodes']:
-
-            #set identifier variable; create DigitalObject with 'True' to skip folder creation
-            self.controller.identifier.set(item.strip())
-            current_item = DigitalObject(self.controller, True)
-            
-            print('\nWorking on item: {}'.format(current_item.identifier))
-            
-            #continue to next item if we've already completed the item or it's been deaccessioned.
-            if current_item.identifier in self.sda_status_db['completed']:
-                print('\n{} already completed'.format(current_item.identifier))
-                continue
-            elif current_item.identifier in self.sda_status_db['deaccessioned']:
-                print('\n{} already deaccessioned'.format(current_item.identifier))
-                continue
-                
-            #load metadata
-            current_item.load_item_metadata(self.shipment_spreadsheet)
-            
-            #record status
-            if not current_item.identifier in self.sda_status_db['started']:
-                self.write_db('started', current_item.identifier)
-            
-            '''Check final_appraisal information for disposition of content'''                
-            if current_item.db['info']['final_appraisal'] == "Delete content":
-                try:
-                    print('\n\tContent will not be transferred to SDA.  Continuing with next item.')
-                    shutil.move(current_item.barcode_dir, self.deaccession_dir)
-                    self.write_db('deaccessioned', current_item.identifier)
-                
-                except (PermissionError, OSError) as e:
-                    self.write_db('failed', current_item.identifier, 'deaccession\t{}'.format(e))
-                        
-                continue
-            
-            elif 'transfer' and 'sda' in current_item.db['info']['final_appraisal'].lower():
-            
-                #if this was previously marked for 'other_action', remove from that list
-                if self.sda_status_db['other_action'].get(current_item.identifier):
-                    del self.sda_status_db['other_action'][current_item.identifier]
-                
-                #check if item will also be transferred to MCO
-                if 'mco' in current_item.db['info']['final_appraisal'].lower():
-                
-                    if not self.check_mco_status(current_item.identifier): 
-                        print('\n\nContent will be deposited to Media Collections Online. Moving on to next item...')
-                        self.write_db('mco_deposit', current_item.identifier)
-                        continue
-                
-                '''PREPARE ITEM: VERIFY CONTENT IS PRESENT AND GET STATS'''
-                if not current_item.identifier in self.sda_status_db['prepped']:
-                    
-                    #check if there is a file count in the spreadsheet; double check image_dir
-                    if current_item.db['info']['item_file_count'] is None or current_item.db['info']['item_file_count'] == 0:
-                    
-                        if not current_item.check_files(current_item.files_dir) and not current_item.check_files(current_item.image_dir):
-                            
-                            print('\n\tItem has no files or disk image!  Moving on...')
-                            
-                            self.write_db('failed', current_item.identifier,  'check_folder\tNO CONTENT IN BARCODE FOLDER; CHANGE APPRAISAL DECISION?')
-                            
-                            continue
-                    
-                    #copy item info to our sda db
-                    if not self.sda_status_db['item_stats'].get(current_item.identifier):
-                        self.sda_status_db['item_stats'][current_item.identifier] = current_item.db['info']
-                    
-                    #set up barcode dict to collect format info
-                    if not self.sda_status_db['format_report'].get(current_item.identifier):
-                        self.sda_status_db['format_report'][current_item.identifier] = {}
-                    
-                    #get file format info
-                    format_csv = os.path.join(current_item.reports_dir, 'formatVersions.csv')
-                    if os.path.exists(format_csv):
-                        with open(format_csv, 'r') as fi:
-                            fi = csv.reader(fi)
-                            #skip header row
-                            next(fi)
-                            #loop through format csv; create a dictionary for each row, recording the PUIDs (with format names and versions) and a count of each
-                            for line in fi:
-                                puid = line[1]
-                                self.sda_status_db['format_report'][current_item.identifier][puid] = {'format' : line[0], 'version' : line[2], 'count' : int(line[3])}
-                            self.sda_status_db.sync()
-                    
-                    #item prepped: record status
-                    self.write_db('prepped', current_item.identifier)
-                        
-                '''COMPLETE SEPARATIONS AND REMOVE TEMP & B_E FILES'''
-                if not current_item.identifier in self.sda_status_db['separations_completed']:
-                    print('\n\tSeparating unnecessary files...\n')
-                    
-                    #remove folders
-                    for dir in [current_item.temp_dir, current_item.bulkext_dir, current_item.assets_target]:
-                        if os.path.exists(dir):
-                            shutil.rmtree(dir)
-                    
-                    #remove temp files/reports
-                    for f in ["duplicates.csv", "errors.csv", "formats.csv", "formatVersions.csv", "mimetypes.csv", "unidentified.csv", "uniqueyears.csv", "years.csv", 'email_domain_histogram.txt', 'find_histogram.txt', 'telephone_histogram.txt', 'report.html']:
-                        report = os.path.join(current_item.reports_dir, f)
-                        if os.path.exists(report):
-                            os.remove(report)
-                    
-                    #address separations, if indicated
-                    if self.separations_status:
-                        
-                        #set up log file
-                        current_item.separations_log = os.path.join(current_item.log_dir, 'separations.txt')
-                        
-                        #get content-to-be-separated from the item barcode
-                        with open(self.separations_file, 'r') as f:
-                            sep_list = [file for file in f.read().replace('"', '').replace("'", "").splitlines() if current_item.identifier in file]
-                        
-                        #make sure we have separations for this barcode
-                        if len(sep_list) > 0:
-                            
-                            for item in sep_list:
-                                #set up list to hold all files to be separated
-                                files_to_be_separated = []
-                            
-                                #split path at shipment_date in case drive letters differ with BDPL workstation and collecting unit that prepared separations_file
-                                item = item.split('{}\\'.format(self.shipment_date))[1] 
-                                
-                                #if a wildcard is used, we will use glob to build a list of all files/folders matching pattern
-                                if '\\**' in item:
-                                    files_to_be_separated = glob.glob(item, recursive=True)
-                                
-                                elif '\\*' in item:
-                                    files_to_be_separated = glob.glob(item)
-                                
-                                #build recursive list of all files in the folder   
-                                elif os.path.isdir(item):                                
-                                    for root, dirs, files in os.walk(item):
-                                        for f in files:
-                                            files_to_be_separated.append(os.path.join(root, f))
-                                    #also add parent folder so that we can remove it.
-                                    files_to_be_separated.append(item)
-                                            
-                                elif os.path.isfile(item):
-                                    files_to_be_separated.append(item)
-
-                                else:
-                                    file_separated = False
-                                    if os.path.exists(current_item.separations_log):
-                                        with open(current_item.separations_log, 'r') as f:
-                                            for line in f.readlines():
-                                                if current_item.identifier in line:
-                                                    file_separated = True
-                                                    break
-                                    if not file_separated:        
-                                        print('\n\tNo such file: {}'.format(item))
-                                        files_to_be_separated.append('FAIL: {}'.format(item))
-                                    
-                                    else:
-                                        print('\n\t{} already separated.'.format(item))
-                                
-                            #check to see if we failed to identify any separation targets; if so, fail barcode so we can troublshoot
-                            if [f for f in files_to_be_separated if 'FAIL' in f]:
-                                self.write_db('failed', current_item.identifier,  'separations\t{}'.format(','.join([f.split('FAIL: ')[1] for f in files_to_be_separated if 'FAIL' in f])))
-                                continue
-                            #if no failures, move forward with separations
-                            else:                                
-                                #separate items and gather stats
-                                status = self.separate_content(current_item, files_to_be_separated)
-                                
-                                if not status:
-                                    continue
-                                else:
-                                    self.write_db('separations_completed', current_item.identifier)
-                
-                '''BAG FOLDER'''
-                if not current_item.identifier in self.sda_status_db['bagged']:
-                
-                    print('\n\tCreating bag for barcode folder...')
-
-                    #set metadata for bag.
-                    self.sda_status_db['item_stats'][current_item.identifier]['bag_description'] = 'Source: {}. | Label: {}. | Title: {}. | Appraisal notes: {}. | Date range: {}-{}'.format(self.sda_status_db['item_stats'][current_item.identifier]['content_source_type'], self.sda_status_db['item_stats'][current_item.identifier].get('label_transcription', '-'), self.sda_status_db['item_stats'][current_item.identifier].get('item_title', '-'),  self.sda_status_db['item_stats'][current_item.identifier].get('appraisal_notes', '-'), self.sda_status_db['item_stats'][current_item.identifier]['begin_date'], self.sda_status_db['item_stats'][current_item.identifier]['end_date'])
-                    
-                    #make sure we haven't added a temp_dir if we had to restart packaging
-                    if os.path.exists(current_item.temp_dir):
-                        shutil.rmtree(current_item.temp_dir)
-                    
-                    try:
-                        #create bag
-                        bagit.make_bag(current_item.barcode_dir, {"Source-Organization" : current_item.unit_name, "External-Description" : self.sda_status_db['item_stats'][current_item.identifier]['bag_description'], "External-Identifier" : current_item.identifier}, checksums=["md5"])
-                        
-                        print('\tBagging complete.')
-                        
-                        #record completion
-                        self.write_db('bagged', current_item.identifier)
-                    
-                    #continue on to next item if failure
-                    except (RuntimeError, PermissionError, bagit.BagError, OSError) as e:
-                        print("\tUnexpected error: ", e)
-                        
-                        self.write_db('failed', current_item.identifier, 'bagit\t{}'.format(e))
-                        
-                        continue
-                
-                '''CREATE TAR'''
-                #make sure file hasn't already been tarred
-                if not current_item.identifier in self.sda_status_db['tarred']:
-                
-                    #Make sure we have enough space to create tar file (just to be sure; we should check first, as a rule)
-                    print('\n\tChecking available space...')
-                    
-                    #first check available space
-                    (total_space, used_space, free_space) = shutil.disk_usage(os.getcwd())
-                    
-                    #now get size of barcode_dir
-                    cmd = 'du -s {}'.format(current_item.barcode_dir)
-                    
-                    output = subprocess.run(cmd, shell=True, text=True, capture_output=True)
-                    
-                    dir_size = int(output.stdout.split()[0])
-                    
-                    #check if the new archive will have sufficient space on disk; include addition 10240 bytes for tar file. Ff so, continue.  If not, exit with a warning
-                    available_space = int(free_space) - (dir_size * 2 + 10240)
-                    
-                    #fail item if not enough space to create tar
-                    if available_space <= 0:
-                        print('\n\tWARNING! Insufficient space to create tar archive.\n\t\tAvailable space: %s\n\t\tSize needed for archive: %s' % (free_space, string(dir_size)))
-                        
-                        self.write_db('failed', current_item.identifier, 'Insufficient space\t need minimum of {} bytes'.format(dir_size))
-                        
-                        continue
-                    
-                    else:
-                        print('\tCheck complete; sufficient space for tar file.')
-                        
-                    #make sure we haven't added a temp_dir to our bag...
-                    if os.path.exists(current_item.temp_dir):
-                        shutil.rmtree(current_item.temp_dir)
-                        
-                    print('\n\tCreating tar archive...')
+                    return True
                     
-                    try:
-                        with tarfile.open(current_item.tar_file, "w") as tar:
-                            tar.add(current_item.barcode_dir, arcname=current_item.identifier)
-                            
-                        print('\tTar archive created')
-                        
-                        self.write_db('tarred', current_item.identifier)
-                        
-                        
-                    except (RuntimeError, PermissionError, IOError, EnvironmentError) as e:
-                        
-                        print("\tUnexpected error: ", e)
-                        
-                        self.write_db('failed', current_item.identifier, 'tar\t{}'.format(e))
-                        
-                        continue
-                
-                '''MOVE TAR TO ARCHIVER LOCATION'''
-                if not current_item.identifier in self.sda_status_db['moved']:
+        #otherwise, return False
+        return False
+    
+    def deposit_barcodes_to_sda(self):
+        
+        #bags and tars are made on a process pool; moves and folder removal run on a thread pool. Only this thread touches sda_status_db and the spreadsheets.
+        self.package_pool = concurrent.futures.ProcessPoolExecutor(self.stage_limits['package'])
+        self.io_pool = concurrent.futures.ThreadPoolExecutor(self.stage_limits['io'])
+        
+        try:
+            for item in list(self.sda_status_db['directory_barcodes']):
                 
-                    print('\n\tMoving tar file to Archiver folder...')
-                    
-                    #get some stats on SIP and store values in self.sda_status_db['item_stats'][current_item.identifier]
-                    print('\tGenerating SIP statistics...')
-                    self.sda_status_db['item_stats'][current_item.identifier]['sip_extent'] = current_item.get_size(current_item.tar_file)
-                    
-                    self.sda_status_db['item_stats'][current_item.identifier]['sip_md5'] = current_item.md5(current_item.tar_file)
-                    
-                    self.sda_status_db['item_stats'][current_item.identifier]['sip_filename'] = os.path.basename(current_item.tar_file)
-                    
-                    self.sda_status_db['item_stats'][current_item.identifier]['sip_creation_date'] = datetime.datetime.fromtimestamp(os.path.getmtime(current_item.tar_file)).isoformat()
-                    
-                    #save db['info']
+                #if the job has been cancelled, finish what is already in the pipeline so its status is recorded, then stop
+                try:
+                    self.controller.checkpoint()
+                except JobCancelled:
+                    self.pump(1)
                     self.sda_status_db.sync()
-                    
-                    try:
-                        shutil.move(current_item.tar_file, self.bdpl_archiver_collection)
-                        
-                        print('\tTar file moved.')
-                        
-                        self.write_db('moved', current_item.identifier)
-                        
-                    except (RuntimeError, PermissionError, IOError, EnvironmentError) as e:
-                    
-                        print("\tUnexpected error: ", e)
-                        
-                        self.write_db('failed', current_item.identifier, 'move\t{}'.format(e))
-                        
-                        continue
+                    raise
                 
-                '''WRITE STATS TO MASTER SPREADSHEET'''
-                if not current_item.identifier in self.sda_status_db['metadata_written']:
-                    
-                    self.master_spreadsheet.write_to_spreadsheet(self.sda_status_db['item_stats'][current_item.identifier], self.master_spreadsheet.item_ws)
-                    
-                    #set up additional shipment stats keys if not already done so
-                    if not self.sda_status_db['shipment_stats'].get('sip_count'):
-                        self.sda_status_db['shipment_stats']['sip_count'] = 0
-                        self.sda_status_db['shipment_stats']['extent_raw'] = 0
-                        self.sda_status_db['shipment_stats']['item_file_count'] = 0
-                        self.sda_status_db['shipment_stats']['sips_extent'] = 0
-                    
-                    #update statistics & save shelve
-                    self.sda_status_db['shipment_stats']['sip_count'] += 1
-                    self.sda_status_db['shipment_stats']['extent_raw'] += self.sda_status_db['item_stats'][current_item.identifier]['extent_raw']
-                    self.sda_status_db['shipment_stats']['item_file_count'] += self.sda_status_db['item_stats'][current_item.identifier]['item_file_count']
-                    self.sda_status_db['shipment_stats']['sips_extent'] += self.sda_status_db['item_stats'][current_item.identifier]['sip_extent']                   
-                    self.sda_status_db.sync()
-                    
-                    #record completion
-                    self.write_db('metadata_written', current_item.identifier)
+                #don't take on a new item until there's room in the pipeline
+                self.pump(self.max_in_flight)
                 
-                '''CLEAN ORIGINAL BARCODE FOLDER'''
-                #remove original folder
-                if not current_item.identifier in self.sda_status_db['completed']:
-                    print('\n\tRemoving original folder...')
-                    
-                    cmd = 'RD /S /Q "{}"'.format(current_item.barcode_dir)
-                    
-                    try:
-                        subprocess.check_output(cmd, shell=True)
-                        print('\tFolder removed')
-                        self.write_db('completed', current_item.identifier)
-                        
-                    #if unsuccessful, note failure and continue
-                    except (PermissionError, subprocess.CalledProcessError, OSError) as e:
-                        print("\tUnexpected error: ", e)
-                        self.write_db('failed', current_item.identifier, 'clean_original\t{}'.format(e))
-                        continue
-                        
-                '''BARCODE IS NOW DONE!'''
-                print('\n\t{} COMPLETED\n---------------------------------------------------------------'.format(current_item.identifier))
+                job = self.prepare_item(item)
                 
-                #if barcode had previously failed, remove it from list.
-                if current_item.identifier in self.sda_status_db['failed']:
-                    del self.sda_status_db['failed'][current_item.identifier]
-                    
-                #get rid of shelve to avoid errors...
-                current_item.db.close()
-            
-            #if other appraisal decision is indicated, note barcode in 'other_action' list
-            else:
+                if job:
+                    self.active[job['identifier']] = job
+                    self.advance(job)
             
-                print('\n\tAlternate appraisal decision: {}. \n\tConfer with collecting unit as needed.'.format(current_item.db['info']['final_appraisal']))
-                
-                if current_item.identifier not in self.sda_status_db['other_action']:
-                    self.write_db('other_action', current_item.identifier, current_item.db['info']['final_appraisal'])
-                continue
+            #let everything still in the pipeline finish
+            self.pump(1)
+        
+        finally:
+            self.package_pool.shutdown(cancel_futures=True)
+            self.io_pool.shutdown(cancel_futures=True)
         
         '''LOOP THROUGH DIRECTORY BARCODES IS NOW COMPLETE; REPORT RESULTS'''        
         #get lists from status files: how many barcodes are in each list
@@ -3797,13 +5407,14 @@ class SdaBatchDeposit(Shipment):
             
             print('\nWriting format information...')
             
-            puids = 'puids_{}_{}'.format(current_item.unit_name, current_item.shipment_date)
+            puids = 'puids_{}_{}'.format(self.unit_name, self.shipment_date)
         
             #if this puid sheet already exists, we'll just remove it and start anew...
             if puids in self.master_spreadsheet.wb.sheetnames:
                 self.master_spreadsheet.wb.remove(self.master_spreadsheet.wb[puids])
             
             self.master_spreadsheet.puid_ws = self.master_spreadsheet.wb.create_sheet(puids)
+            self.master_spreadsheet.session.touch(puids)
             
             #set up a header
             puid_header = []
@@ -3852,8 +5463,9 @@ class SdaBatchDeposit(Shipment):
                         colno = c.column
                 self.master_spreadsheet.puid_ws.cell(row=row, column=colno, value=count)
         
-        #save self.master_spreadsheet; add a copy to SDA
-        self.master_spreadsheet.wb.save(self.master_spreadsheet.spreadsheet)
+        #save self.master_spreadsheet and any updates to the shipment spreadsheet; add a copy to SDA
+        self.master_spreadsheet.session.flush()
+        self.shipment_spreadsheet.session.flush()
         shutil.copy(self.master_spreadsheet.spreadsheet, self.controller.bdpl_archiver_general_dir)
         
         #copy shipment spreadsheet to 'completed shipments' in archiver_dir and unit_home
@@ -3863,7 +5475,383 @@ class SdaBatchDeposit(Shipment):
         #close shelve
         self.sda_status_db.close()
         
-        print('\nCurrent session for shipment {}{} completed!!'.format(current_item.unit_name, current_item.shipment_date))
+        print('\nCurrent session for shipment {}{} completed!!'.format(self.unit_name, self.shipment_date))
+    
+    def prepare_item(self, item):
+        """Prep an item and complete separations; returns a job for the packaging stages, or None if the item was not sent on"""
+        
+        #create DigitalObject with 'True' to skip folder creation; it is pinned to this shipment, as the technician may be working on something else
+        current_item = DigitalObject(ControllerView(self.controller, unit_name=self.unit_name, shipment_date=self.shipment_date, identifier=item.strip()), True)
+        
+        print('\nWorking on item: {}'.format(current_item.identifier))
+        
+        #continue to next item if we've already completed the item or it's been deaccessioned.
+        if current_item.identifier in self.sda_status_db['completed']:
+            print('\n{} already completed'.format(current_item.identifier))
+            return None
+        elif current_item.identifier in self.sda_status_db['deaccessioned']:
+            print('\n{} already deaccessioned'.format(current_item.identifier))
+            return None
+            
+        #load metadata
+        current_item.load_item_metadata(self.shipment_spreadsheet)
+        
+        #record status
+        if not current_item.identifier in self.sda_status_db['started']:
+            self.write_db('started', current_item.identifier)
+        
+        '''Check final_appraisal information for disposition of content'''                
+        if current_item.db['info']['final_appraisal'] == "Delete content":
+            try:
+                print('\n\tContent will not be transferred to SDA.  Continuing with next item.')
+                shutil.move(current_item.barcode_dir, self.deaccession_dir)
+                self.write_db('deaccessioned', current_item.identifier)
+            
+            except (PermissionError, OSError) as e:
+                self.write_db('failed', current_item.identifier, 'deaccession\t{}'.format(e))
+                    
+            return None
+        
+        elif 'transfer' and 'sda' in current_item.db['info']['final_appraisal'].lower():
+        
+            #if this was previously marked for 'other_action', remove from that list
+            if self.sda_status_db['other_action'].get(current_item.identifier):
+                del self.sda_status_db['other_action'][current_item.identifier]
+            
+            #check if item will also be transferred to MCO
+            if 'mco' in current_item.db['info']['final_appraisal'].lower():
+            
+                if not self.check_mco_status(current_item.identifier): 
+                    print('\n\nContent will be deposited to Media Collections Online. Moving on to next item...')
+                    self.write_db('mco_deposit', current_item.identifier)
+                    return None
+            
+            '''PREPARE ITEM: VERIFY CONTENT IS PRESENT AND GET STATS'''
+            if not current_item.identifier in self.sda_status_db['prepped']:
+                
+                #check if there is a file count in the spreadsheet; double check image_dir
+                if current_item.db['info']['item_file_count'] is None or current_item.db['info']['item_file_count'] == 0:
+                
+                    if not current_item.check_files(current_item.files_dir) and not current_item.check_files(current_item.image_dir):
+                        
+                        print('\n\tItem has no files or disk image!  Moving on...')
+                        
+                        self.write_db('failed', current_item.identifier,  'check_folder\tNO CONTENT IN BARCODE FOLDER; CHANGE APPRAISAL DECISION?')
+                        
+                        return None
+                
+                #copy item info to our sda db
+                if not self.sda_status_db['item_stats'].get(current_item.identifier):
+                    self.sda_status_db['item_stats'][current_item.identifier] = dict(current_item.db['info'])
+                
+                #set up barcode dict to collect format info
+                if not self.sda_status_db['format_report'].get(current_item.identifier):
+                    self.sda_status_db['format_report'][current_item.identifier] = {}
+                
+                #get file format info
+                format_csv = os.path.join(current_item.reports_dir, 'formatVersions.csv')
+                if os.path.exists(format_csv):
+                    with open(format_csv, 'r') as fi:
+                        fi = csv.reader(fi)
+                        #skip header row
+                        next(fi)
+                        #loop through format csv; create a dictionary for each row, recording the PUIDs (with format names and versions) and a count of each
+                        for line in fi:
+                            puid = line[1]
+                            self.sda_status_db['format_report'][current_item.identifier][puid] = {'format' : line[0], 'version' : line[2], 'count' : int(line[3])}
+                        self.sda_status_db.sync()
+                
+                #item prepped: record status
+                self.write_db('prepped', current_item.identifier)
+                    
+            '''COMPLETE SEPARATIONS AND REMOVE TEMP & B_E FILES'''
+            if not current_item.identifier in self.sda_status_db['separations_completed']:
+                print('\n\tSeparating unnecessary files...\n')
+                
+                #remove folders
+                for dir in [current_item.temp_dir, current_item.bulkext_dir, current_item.assets_target]:
+                    if os.path.exists(dir):
+                        shutil.rmtree(dir)
+                
+                #remove temp files/reports
+                for f in ["duplicates.csv", "errors.csv", "formats.csv", "formatVersions.csv", "mimetypes.csv", "unidentified.csv", "uniqueyears.csv", "years.csv", 'email_domain_histogram.txt', 'find_histogram.txt', 'telephone_histogram.txt', 'report.html']:
+                    report = os.path.join(current_item.reports_dir, f)
+                    if os.path.exists(report):
+                        os.remove(report)
+                
+                #address separations, if indicated
+                if self.separations_status:
+                    
+                    #set up log file
+                    current_item.separations_log = os.path.join(current_item.log_dir, 'separations.txt')
+                    
+                    #get content-to-be-separated from the item barcode
+                    with open(self.separations_file, 'r') as f:
+                        sep_list = [file for file in f.read().replace('"', '').replace("'", "").splitlines() if current_item.identifier in file]
+                    
+                    #make sure we have separations for this barcode
+                    if len(sep_list) > 0:
+                        
+                        for item in sep_list:
+                            #set up list to hold all files to be separated
+                            files_to_be_separated = []
+                        
+                            #split path at shipment_date in case drive letters differ with BDPL workstation and collecting unit that prepared separations_file
+                            item = item.split('{}\\'.format(self.shipment_date))[1] 
+                            
+                            #if a wildcard is used, we will use glob to build a list of all files/folders matching pattern
+                            if '\\**' in item:
+                                files_to_be_separated = glob.glob(item, recursive=True)
+                            
+                            elif '\\*' in item:
+                                files_to_be_separated = glob.glob(item)
+                            
+                            #build recursive list of all files in the folder   
+                            elif os.path.isdir(item):                                
+                                for root, dirs, files in os.walk(item):
+                                    for f in files:
+                                        files_to_be_separated.append(os.path.join(root, f))
+                                #also add parent folder so that we can remove it.
+                                files_to_be_separated.append(item)
+                                        
+                            elif os.path.isfile(item):
+                                files_to_be_separated.append(item)
+
+                            else:
+                                file_separated = False
+                                if os.path.exists(current_item.separations_log):
+                                    with open(current_item.separations_log, 'r') as f:
+                                        for line in f.readlines():
+                                            if current_item.identifier in line:
+                                                file_separated = True
+                                                break
+                                if not file_separated:        
+                                    print('\n\tNo such file: {}'.format(item))
+                                    files_to_be_separated.append('FAIL: {}'.format(item))
+                                
+                                else:
+                                    print('\n\t{} already separated.'.format(item))
+                            
+                        #check to see if we failed to identify any separation targets; if so, fail barcode so we can troublshoot
+                        if [f for f in files_to_be_separated if 'FAIL' in f]:
+                            self.write_db('failed', current_item.identifier,  'separations\t{}'.format(','.join([f.split('FAIL: ')[1] for f in files_to_be_separated if 'FAIL' in f])))
+                            return None
+                        #if no failures, move forward with separations
+                        else:                                
+                            #separate items and gather stats
+                            status = self.separate_content(current_item, files_to_be_separated)
+                            
+                            if not status:
+                                return None
+                            else:
+                                self.write_db('separations_completed', current_item.identifier)
+            
+            #the remaining stages only need paths and settings; close the item shelve
+            job = {'identifier' : current_item.identifier, 'barcode_dir' : current_item.barcode_dir, 'temp_dir' : current_item.temp_dir, 'dfxml_output' : current_item.dfxml_output, 'tar_file' : current_item.tar_file, 'sip_file' : os.path.join(self.bdpl_archiver_collection, os.path.basename(current_item.tar_file)), 'fixity_workers' : max(1, current_item.fixity_workers // self.stage_limits['package']), 'hash_cache_db' : current_item.hash_cache_db, 'tree_hash_file' : TreeHash.sidecar(os.path.join(self.bag_report_dir, os.path.basename(current_item.tar_file))) if self.sip_tree_hash else None}
+            
+            current_item.db.close()
+            
+            return job
+            
+        #if other appraisal decision is indicated, note barcode in 'other_action' list
+        else:
+        
+            print('\n\tAlternate appraisal decision: {}. \n\tConfer with collecting unit as needed.'.format(current_item.db['info']['final_appraisal']))
+            
+            if current_item.identifier not in self.sda_status_db['other_action']:
+                self.write_db('other_action', current_item.identifier, current_item.db['info']['final_appraisal'])
+            return None
+    
+    def advance(self, job):
+        """Hand an item to its next stage; sda_status_db's stage lists record what has already been done"""
+        identifier = job['identifier']
+        item_stats = self.sda_status_db['item_stats'][identifier]
+        
+        if not identifier in self.sda_status_db['bagged']:
+            '''BAG FOLDER'''
+            print('\n\t{}: creating bag for barcode folder...'.format(identifier))
+            
+            #set metadata for bag.
+            item_stats['bag_description'] = 'Source: {}. | Label: {}. | Title: {}. | Appraisal notes: {}. | Date range: {}-{}'.format(item_stats['content_source_type'], item_stats.get('label_transcription', '-'), item_stats.get('item_title', '-'),  item_stats.get('appraisal_notes', '-'), item_stats['begin_date'], item_stats['end_date'])
+            self.sda_status_db.sync()
+            
+            job['bag_info'] = {"Source-Organization" : self.unit_name, "External-Description" : item_stats['bag_description'], "External-Identifier" : identifier}
+            
+            self.submit('package', 'bagged', sda_bag_item, job)
+        
+        elif not identifier in self.sda_status_db['tarred']:
+            '''CREATE TAR'''
+            #we need the size of the tar before we can reserve space for it
+            if job.get('sip_size') is None:
+                self.submit('package', 'planned', sda_plan_item, job)
+            else:
+                self.reserve_space(job)
+        
+        elif not identifier in self.sda_status_db['moved']:
+            '''MOVE TAR TO ARCHIVER LOCATION'''
+            #tars written by SipWriter are already in the Archiver folder with their stats recorded
+            if item_stats.get('sip_md5') and os.path.exists(job['sip_file']):
+                self.write_db('moved', identifier)
+                self.advance(job)
+            else:
+                print('\n\t{}: moving tar file to Archiver folder...'.format(identifier))
+                self.submit('io', 'moved', sda_move_item, job)
+        
+        elif not identifier in self.sda_status_db['metadata_written']:
+            '''WRITE STATS TO MASTER SPREADSHEET'''
+            self.spreadsheet_batch.append(job)
+            if len(self.spreadsheet_batch) >= self.spreadsheet_batch_size:
+                self.flush_spreadsheet()
+        
+        elif not identifier in self.sda_status_db['completed']:
+            '''CLEAN ORIGINAL BARCODE FOLDER'''
+            print('\n\t{}: removing original folder...'.format(identifier))
+            self.submit('io', 'completed', sda_clean_item, job)
+        
+        else:
+            '''BARCODE IS NOW DONE!'''
+            print('\n\t{} COMPLETED\n---------------------------------------------------------------'.format(identifier))
+            
+            #if barcode had previously failed, remove it from list.
+            if identifier in self.sda_status_db['failed']:
+                del self.sda_status_db['failed'][identifier]
+                self.sda_status_db.sync()
+            
+            del self.active[identifier]
+    
+    def submit(self, pool, stage, fn, job):
+        #keep each pool's queue bounded; anything over the limit waits here until a worker frees up
+        if self.stage_counts[pool] < self.stage_limits[pool]:
+            if pool == 'package':
+                future = self.package_pool.submit(fn, job)
+            else:
+                future = self.io_pool.submit(fn, job)
+            self.futures[future] = (pool, stage, job)
+            self.stage_counts[pool] += 1
+        else:
+            self.ready[pool].append((stage, fn, job))
+    
+    def pump(self, max_active):
+        """Process finished stages until fewer than max_active items are in the pipeline"""
+        while len(self.active) >= max_active:
+            
+            #nothing is running: write out any pending spreadsheet rows
+            if len(self.futures) == 0:
+                if len(self.spreadsheet_batch) > 0:
+                    self.flush_spreadsheet()
+                    continue
+                break
+            
+            done, not_done = concurrent.futures.wait(self.futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            
+            for future in done:
+                self.complete(future)
+    
+    def complete(self, future):
+        pool, stage, job = self.futures.pop(future)
+        identifier = job['identifier']
+        self.stage_counts[pool] -= 1
+        
+        try:
+            status, result = future.result()
+        except Exception as e:
+            status, result = False, '{}\t{}'.format(stage, e)
+        
+        #a finished tar frees up its reserved space; see if any items are waiting on it
+        if stage == 'tarred':
+            self.space_planner.release(identifier)
+            waiting = self.waiting_for_space
+            self.waiting_for_space = []
+            for waiting_job in waiting:
+                self.reserve_space(waiting_job)
+        
+        if not status:
+            print("\n\t{}: unexpected error: {}".format(identifier, result))
+            self.write_db('failed', identifier, result)
+            del self.active[identifier]
+        
+        else:
+            if stage in ['bagged', 'planned']:
+                job['sip_size'] = result
+                if stage == 'bagged':
+                    print('\n\t{}: bagging complete.'.format(identifier))
+            
+            elif stage in ['tarred', 'moved']:
+                self.sda_status_db['item_stats'][identifier].update(result)
+                self.sda_status_db.sync()
+                print('\n\t{}: tar archive {}.'.format(identifier, 'created' if stage == 'tarred' else 'moved'))
+            
+            elif stage == 'completed':
+                print('\n\t{}: folder removed'.format(identifier))
+            
+            if stage in self.db_lists:
+                self.write_db(stage, identifier)
+            
+            self.advance(job)
+        
+        #start anything that was waiting for this pool
+        if len(self.ready[pool]) > 0:
+            self.submit(pool, *self.ready[pool].popleft())
+    
+    def reserve_space(self, job):
+        identifier = job['identifier']
+        
+        #Make sure we have enough space to create tar file on the Archiver volume, allowing for SIPs still being written
+        try:
+            (status, available_space) = self.space_planner.reserve(identifier, self.bdpl_archiver_collection, job['sip_size'], '{}.part'.format(job['sip_file']))
+        
+        except (PermissionError, OSError) as e:
+            print("\n\t{}: unexpected error: {}".format(identifier, e))
+            self.write_db('failed', identifier, 'space check\t{}'.format(e))
+            del self.active[identifier]
+            return
+        
+        if status:
+            print('\n\t{}: creating tar archive...'.format(identifier))
+            self.submit('package', 'tarred', sda_tar_item, job)
+        
+        #if other tars are still being written, wait for them to finish
+        elif len(self.space_planner.reservations) > 0:
+            self.waiting_for_space.append(job)
+        
+        #fail item if not enough space to create tar
+        else:
+            print('\n\tWARNING! Insufficient space to create tar archive for {}.\n\t\tAvailable space: {}\n\t\tSize needed for archive: {}'.format(identifier, available_space, job['sip_size']))
+            self.write_db('failed', identifier, 'Insufficient space\t need minimum of {} bytes'.format(job['sip_size']))
+            del self.active[identifier]
+    
+    def flush_spreadsheet(self):
+        """Write stats for a batch of SIPs to the master spreadsheet, saving it once"""
+        batch = self.spreadsheet_batch
+        self.spreadsheet_batch = []
+        
+        print('\n\tWriting {} item(s) to master spreadsheet...'.format(len(batch)))
+        
+        for job in batch:
+            self.master_spreadsheet.write_to_spreadsheet(self.sda_status_db['item_stats'][job['identifier']], self.master_spreadsheet.item_ws, save=False)
+        
+        self.master_spreadsheet.session.flush()
+        
+        #set up additional shipment stats keys if not already done so
+        if not self.sda_status_db['shipment_stats'].get('sip_count'):
+            self.sda_status_db['shipment_stats']['sip_count'] = 0
+            self.sda_status_db['shipment_stats']['extent_raw'] = 0
+            self.sda_status_db['shipment_stats']['item_file_count'] = 0
+            self.sda_status_db['shipment_stats']['sips_extent'] = 0
+        
+        for job in batch:
+            item_stats = self.sda_status_db['item_stats'][job['identifier']]
+            
+            #update statistics & save shelve
+            self.sda_status_db['shipment_stats']['sip_count'] += 1
+            self.sda_status_db['shipment_stats']['extent_raw'] += item_stats['extent_raw']
+            self.sda_status_db['shipment_stats']['item_file_count'] += item_stats['item_file_count']
+            self.sda_status_db['shipment_stats']['sips_extent'] += item_stats['sip_extent']
+            
+            #record completion
+            self.write_db('metadata_written', job['identifier'])
+            
+            self.advance(job)
     
     def write_db(self, db, identifier, message=None):
     
@@ -4007,8 +5995,9 @@ class SdaBatchDeposit(Shipment):
     
         self.sda_status_db['item_stats'][current_item.identifier]['item_file_count'] -= self.sda_status_db['separation-stats'][current_item.identifier]['sep_file_count']
         
-        #write info to spreadsheet
+        #write info to spreadsheet; save it now, as separations_completed is recorded next
         self.shipment_spreadsheet.write_to_spreadsheet(self.sda_status_db['item_stats'][current_item.identifier])
+        self.shipment_spreadsheet.session.flush()
         
         #record premis information
         event_type = 'deaccession'
@@ -4045,6 +6034,340 @@ class SdaBatchDeposit(Shipment):
         """
         l.sort(key=self.alphanum_key)
 
+class FixedValue:
+    """Read-only stand-in for one of the interface's tk variables"""
+    def __init__(self, value):
+        self.value = value
+    
+    def get(self):
+        return self.value
+
+class ControllerView:
+    """The controller, as seen from another shipment or item. DigitalObject and friends read the unit, shipment and barcode from the interface; 
+    jobs that work across shipments hand them one of these instead of changing what the technician has entered"""
+    def __init__(self, controller, **values):
+        self.controller = controller
+        for key, value in values.items():
+            setattr(self, key, FixedValue(value))
+    
+    def __getattr__(self, name):
+        return getattr(self.controller, name)
+
+class FixityVerifier(Unit):
+    """Re-check a unit's content against the checksums recorded at ingest and deposit: barcode folders still in the unit's shipment folders (against their bag manifests or, if not yet bagged, 
+    their DFXML) and SIPs waiting in the Archiver spool (against the sip_md5 in the master spreadsheet, or the SIP's TreeHash where one was saved). 
+    Targets are taken in order of their last check; files are read on a thread pool, paced by a shared IoThrottle, and the sweep stops when its time budget runs out, 
+    picking up where it left off next time. Each finished check is recorded as a PREMIS 'fixity check' event."""
+    def __init__(self, controller):
+        Unit.__init__(self, controller)
+        self.controller = controller
+        
+        #files read at once, cap on read rate (bytes per second; None for no limit), and how long a sweep may run (seconds)
+        self.workers = 4
+        self.max_read_rate = 200 * 1024**2
+        self.time_budget = 6 * 3600
+        
+        #targets that passed more recently than this are left for a later sweep
+        self.recheck_days = 30
+        
+        #files checked ahead of the recorded position, how often progress is saved, and failures listed for each target
+        self.window = 256
+        self.checkpoint_every = 1000
+        self.max_failures_listed = 1000
+        
+        self.throttle = IoThrottle(self.max_read_rate) if self.max_read_rate else None
+        self.skip_dirs = ['review', 'bag_reports', 'sda_reports', 'item_ingest_info', 'unaccounted', 'deaccessioned', 'ripstation_reports', 'mco_reports', 'reports']
+        
+        self.fixity_status_db = FixityStatusStore(os.path.join(self.unit_home, 'fixity_checks.sqlite'))
+    
+    def sip_records(self):
+        """Map identifiers to (sip_filename, sip_md5) from the Item sheet of the master spreadsheet"""
+        records = {}
+        if not os.path.exists(self.controller.bdpl_master_spreadsheet):
+            return records
+        
+        session = WorkbookSession.get(self.controller.bdpl_master_spreadsheet)
+        with session.lock:
+            rows = session.read_rows('Item')
+        
+        if not rows:
+            return records
+        
+        columns = {}
+        for column, header in enumerate(rows[0]):
+            if not header is None:
+                columns.setdefault(match_column(header), column)
+        
+        if not 'sip_md5' in columns:
+            return records
+        
+        #as with return_row, the first row for an identifier wins
+        for values in rows[1:]:
+            if not values or values[0] is None:
+                continue
+            identifier = str(values[0]).strip()
+            row = {key : values[column] for key, column in columns.items() if column < len(values)}
+            records.setdefault(identifier, (str(row['sip_filename']) if row.get('sip_filename') else '{}.tar'.format(identifier), str(row['sip_md5']).strip().lower() if row.get('sip_md5') else None))
+        
+        return records
+    
+    def spool_tars(self):
+        """Map SIP filenames to their paths in the Archiver spool (one folder per collection)"""
+        tars = {}
+        if not os.path.isdir(self.controller.bdpl_archiver_spool_dir):
+            return tars
+        
+        for folder in os.scandir(self.controller.bdpl_archiver_spool_dir):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith('.tar') and entry.is_file():
+                        tars.setdefault(entry.name, entry.path)
+        
+        return tars
+    
+    def find_targets(self):
+        """List the unit's barcode folders and SIPs that have checksums to check against; each target is a dict of paths and identifiers"""
+        targets = []
+        if not os.path.isdir(self.ingest_dir):
+            return targets
+        
+        sip_records = self.sip_records()
+        spool_tars = self.spool_tars()
+        
+        for shipment_date in sorted(os.listdir(self.ingest_dir)):
+            ship_dir = os.path.join(self.ingest_dir, shipment_date)
+            if not os.path.isdir(ship_dir):
+                continue
+            
+            #barcode folders: bagged folders have manifests; otherwise use the DFXML from ingest
+            for entry in sorted(os.scandir(ship_dir), key=lambda e: e.name):
+                if not entry.is_dir() or entry.name in self.skip_dirs:
+                    continue
+                
+                if os.path.isfile(os.path.join(entry.path, 'manifest-md5.txt')):
+                    kind = 'bag'
+                elif os.path.isfile(os.path.join(entry.path, 'metadata', '{}-dfxml.xml'.format(entry.name))):
+                    kind = 'dfxml'
+                else:
+                    continue
+                
+                targets.append({'key' : 'folder:{}/{}'.format(shipment_date, entry.name), 'kind' : kind, 'shipment_date' : shipment_date, 'identifier' : entry.name, 'path' : entry.path})
+            
+            #SIPs for items ingested with this shipment that are still in the spool
+            item_ingest_info = os.path.join(ship_dir, 'item_ingest_info')
+            if not os.path.isdir(item_ingest_info):
+                continue
+            
+            for identifier in sorted(set(f.rsplit('-info', 1)[0] for f in os.listdir(item_ingest_info) if '-info' in f)):
+                sip_filename, sip_md5 = sip_records.get(identifier, ('{}.tar'.format(identifier), None))
+                tree_hash_file = TreeHash.sidecar(os.path.join(ship_dir, 'bag_reports', sip_filename))
+                
+                if not sip_filename in spool_tars or (sip_md5 is None and not os.path.exists(tree_hash_file)):
+                    continue
+                
+                targets.append({'key' : 'sip:{}'.format(sip_filename), 'kind' : 'sip', 'shipment_date' : shipment_date, 'identifier' : identifier, 'path' : spool_tars[sip_filename], 'md5' : sip_md5, 'tree_hash_file' : tree_hash_file})
+        
+        return targets
+    
+    def due_targets(self):
+        """Targets to check this sweep: any that were left unfinished, then those never checked, then the rest by the time of their last check"""
+        cutoff = time.time() - self.recheck_days * 86400
+        due = []
+        
+        for target in self.find_targets():
+            record = self.fixity_status_db.get(target)
+            
+            if record is None:
+                priority = (1, 0)
+            elif record['status'] == 'in progress':
+                priority = (0, 0)
+            elif record['status'] == 'passed' and record['last_checked'] > cutoff:
+                continue
+            else:
+                priority = (1, record['last_checked'] or 0)
+            
+            due.append((priority, target['key'], target))
+        
+        due.sort(key=lambda d: d[:2])
+        return [d[2] for d in due]
+    
+    def source(self, target):
+        #where the checksums for a target come from
+        if target['kind'] == 'bag':
+            return 'bag manifests'
+        elif target['kind'] == 'dfxml':
+            return '{}-dfxml.xml'.format(target['identifier'])
+        elif os.path.exists(target['tree_hash_file']):
+            return 'tree hash {}'.format(os.path.basename(target['tree_hash_file']))
+        else:
+            return 'master spreadsheet (sip_md5)'
+    
+    def entries(self, target):
+        """Yield (name, path, md5, required, tree_hash_file) for each file in a target, in a fixed order so a sweep can resume partway through"""
+        if target['kind'] == 'sip':
+            yield (os.path.basename(target['path']), target['path'], target['md5'], True, target['tree_hash_file'] if os.path.exists(target['tree_hash_file']) else None)
+        
+        elif target['kind'] == 'bag':
+            for manifest in ('manifest-md5.txt', 'tagmanifest-md5.txt'):
+                manifest_file = os.path.join(target['path'], manifest)
+                if not os.path.exists(manifest_file):
+                    continue
+                
+                with open(manifest_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line == '':
+                            continue
+                        md5, rel_path = re.split(r'\s+', line, 1)
+                        rel_path = rel_path.replace('%0D', '\r').replace('%0A', '\n')
+                        yield (rel_path, os.path.normpath(os.path.join(target['path'], rel_path)), md5, True, None)
+        
+        else:
+            #fiwalk DFXML lists everything in a disk image, not just the files that were extracted; only items without a disk image must have every file
+            image_dir = os.path.join(target['path'], 'disk-image')
+            required = not (os.path.isdir(image_dir) and len(os.listdir(image_dir)) > 0)
+            
+            records = BagBuilder(target['path'], target['identifier'], os.path.join(target['path'], 'metadata', '{}-dfxml.xml'.format(target['identifier']))).load_dfxml()
+            for rel_path in sorted(records):
+                yield (rel_path, os.path.normpath(os.path.join(target['path'], rel_path)), records[rel_path][2], required, None)
+    
+    def check_entry(self, entry):
+        """Check one file; returns (name, status, msg), where status is None for a file that isn't there but didn't have to be"""
+        name, file_target, md5, required, tree_hash_file = entry
+        
+        if not os.path.isfile(file_target):
+            return (name, False if required else None, 'file not found')
+        
+        try:
+            #large files saved with a tree hash (e.g., disk images) are checked chunk by chunk, in parallel
+            if tree_hash_file is None and os.path.getsize(file_target) >= LARGE_FILE_THRESHOLD and os.path.exists(TreeHash.sidecar(file_target)):
+                tree_hash_file = TreeHash.sidecar(file_target)
+            tree = TreeHash.load(tree_hash_file) if tree_hash_file else None
+            
+            if tree is None and not md5:
+                return (name, False, 'no checksum recorded')
+            
+            status, msg = verify_file(file_target, md5, tree, self.throttle, self.workers)
+        
+        except (PermissionError, OSError) as e:
+            status, msg = False, str(e)
+        
+        return (name, status, msg)
+    
+    def verify_target(self, target, deadline):
+        """Check a target's files, several at a time; returns 'passed' or 'failed', or None if the time budget ran out first"""
+        record = self.fixity_status_db.get(target)
+        
+        #pick up an unfinished check, as long as the target hasn't changed form (e.g., a folder bagged since)
+        if record and record['status'] == 'in progress' and record['kind'] == target['kind']:
+            progress = {'position' : record['position'], 'failed' : record['failed'], 'failures' : record['failures'], 'skipped' : 0}
+            print('\n\t{}: resuming fixity check after {} file(s)...'.format(target['key'], progress['position']))
+        else:
+            progress = {'position' : 0, 'failed' : 0, 'failures' : [], 'skipped' : 0}
+            print('\n\t{}: checking against {}...'.format(target['key'], self.source(target)))
+        
+        last_saved = progress['position']
+        pending = deque()
+        finished = False
+        
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                for entry in itertools.islice(self.entries(target), progress['position'], None):
+                    if time.time() > deadline:
+                        break
+                    
+                    self.controller.checkpoint()
+                    pending.append(pool.submit(self.controller.job_thread(self.check_entry), entry))
+                    
+                    #results are taken in order, so the saved position only ever covers files that have been checked
+                    while len(pending) >= self.window or (len(pending) > 0 and pending[0].done()):
+                        self.tally(pending.popleft(), progress)
+                    
+                    if progress['position'] - last_saved >= self.checkpoint_every:
+                        self.fixity_status_db.save(target, 'in progress', None, progress['position'], progress['position'], progress['failed'], progress['failures'])
+                        last_saved = progress['position']
+                else:
+                    finished = True
+                
+                while len(pending) > 0:
+                    self.tally(pending.popleft(), progress)
+        
+        finally:
+            if not finished:
+                self.fixity_status_db.save(target, 'in progress', None, progress['position'], progress['position'], progress['failed'], progress['failures'])
+        
+        if not finished:
+            print('\n\t{}: time budget used up after {} file(s); check will resume with the next sweep.'.format(target['key'], progress['position']))
+            return None
+        
+        status = 'passed' if progress['failed'] == 0 else 'failed'
+        message = '{} file(s) checked against {}: {} failure(s)'.format(progress['position'], self.source(target), progress['failed'])
+        if progress['skipped'] > 0:
+            message = '{}; {} file(s) listed in the DFXML were not extracted'.format(message, progress['skipped'])
+        
+        #record the event before the status: if recording fails, the target is still due at the next sweep
+        self.record_event(target, status, message)
+        self.fixity_status_db.save(target, status, message, 0, progress['position'], progress['failed'], progress['failures'])
+        
+        print('\n\t{}: {}'.format(target['key'], message))
+        return status
+    
+    def tally(self, future, progress):
+        name, status, msg = future.result()
+        progress['position'] += 1
+        
+        if status is None:
+            progress['skipped'] += 1
+        elif not status:
+            progress['failed'] += 1
+            print('\n\t\tFAILED: {}\t{}'.format(name, msg))
+            if len(progress['failures']) < self.max_failures_listed:
+                progress['failures'].append('{}\t{}'.format(name, msg))
+    
+    def record_event(self, target, status, message):
+        #the event goes to the item's state store in item_ingest_info; the PREMIS XML is left alone, as it may already be in a bag or SIP
+        current_item = DigitalObject(ControllerView(self.controller, unit_name=self.unit_name, shipment_date=target['shipment_date'], identifier=target['identifier']), True)
+        
+        try:
+            current_item.record_premis(str(datetime.datetime.now()), 'fixity check', 0 if status == 'passed' else 1, 'FixityVerifier: {}'.format(target['path']), 'Validated fixity by recalculating checksums and comparing them to values recorded in {}. {}.'.format(self.source(target), message), 'Python {} hashlib'.format(sys.version.split()[0]))
+        finally:
+            current_item.db.close()
+    
+    def run(self):
+        """Check targets until all due targets are done or the time budget runs out"""
+        print('\n\nFIXITY CHECK: {}'.format(self.unit_name))
+        
+        deadline = time.time() + self.time_budget
+        results = {'passed' : [], 'failed' : []}
+        
+        try:
+            targets = self.due_targets()
+            print('\n\t{} barcode folder(s) / SIP(s) due for checking.'.format(len(targets)))
+            
+            for target in targets:
+                if time.time() > deadline:
+                    break
+                
+                status = self.verify_target(target, deadline)
+                if status is None:
+                    break
+                results[status].append(target['key'])
+        
+        finally:
+            self.fixity_status_db.close()
+        
+        print('\nFIXITY CHECK COMPLETED:')
+        print('\n\tPassed: {}'.format(len(results['passed'])))
+        print('\n\tFailed: {}'.format(len(results['failed'])))
+        if len(results['failed']) > 0:
+            print('\t\t{}'.format('\n\t\t'.join(results['failed'])))
+        
+        remaining = len(targets) - len(results['passed']) - len(results['failed'])
+        if remaining > 0:
+            print('\n\tNot yet checked (will be checked with the next sweep): {}'.format(remaining))
+        
+        print('\n\tDetails recorded in {}'.format(self.fixity_status_db.db_file))
+
 class McoBatchDeposit(Shipment):
     def __init__(self, controller, mco_client=None):
         Shipment.__init__(self, controller)
@@ -4053,6 +6376,9 @@ class McoBatchDeposit(Shipment):
         #set # of items that will be included per batch. 
         self.batch_size = 50
         
+        #number of SFTP sessions used to move a batch to the MCO dropbox
+        self.mco_sessions = 4
+        
         #set up temp folder and shelve
         self.mco_report_dir = os.path.join(self.ship_dir, 'mco_reports')
         if not os.path.exists(self.mco_report_dir):
@@ -4096,11 +6422,18 @@ class McoBatchDeposit(Shipment):
                 self.mco_status_db[self.current_batch_list] =[]
         
             #manifest and other items should have already been set up; call it up
-            self.current_manifest = McoSpreadsheet(self.controller, self)
+            self.current_manifest = McoSpreadsheet(ControllerView(self.controller, unit_name=self.unit_name, shipment_date=self.shipment_date), self)
         
         #now loop through shipment to identify items designated for MCO deposit
         for barcode in self.shipment_spreadsheet.app_ws['A'][1:]:
             
+            #stop between items if the job has been cancelled; save progress first
+            try:
+                self.controller.checkpoint()
+            except JobCancelled:
+                self.mco_status_db.close()
+                raise
+            
             #if the most recent batch reached batch_size limit, start a new batch
             if len(self.mco_status_db['batch_info'][self.current_batch_no]) == self.batch_size:
                 self.new_batch()
@@ -4109,11 +6442,8 @@ class McoBatchDeposit(Shipment):
             if barcode is None:
                 continue
 
-            #set identifier variable
-            self.controller.identifier.set(str(barcode.value).strip())
-            
-            #create DigitalObject with 'True' to skip folder creation
-            current_item = DigitalObject(self.controller, True)
+            #create DigitalObject with 'True' to skip folder creation; it is pinned to this shipment, as the technician may be working on something else
+            current_item = DigitalObject(ControllerView(self.controller, unit_name=self.unit_name, shipment_date=self.shipment_date, identifier=str(barcode.value).strip()), True)
             
             #skip if we've already completed item or if barcode_dir doesn't exist
             if current_item.identifier in self.mco_status_db['master_list'] or not os.path.exists(current_item.barcode_dir):
@@ -4355,8 +6685,9 @@ class McoBatchDeposit(Shipment):
             if current_item.identifier in self.mco_status_db['failed_prep']:
                 self.mco_status_db['failed_prep'].remove(current_item.identifier)
                     
-            #save info to manifest
-            self.current_manifest.write_row(list(self.item_info.values()))
+            #save info to manifest; save the manifest now, as master_list (synced with the next item) says the item is done
+            self.current_manifest.write_row(list(self.item_info.values()), current_item.identifier)
+            self.current_manifest.session.flush()
             
         print('\n\n----------------------------------------------------------------------------------------------------\n\nMCO preparation complete.')
         
@@ -4440,7 +6771,7 @@ class McoBatchDeposit(Shipment):
         self.mco_status_db.sync()
         
         #create manifest oject; set up spreadsheet if it doesn't already exist
-        self.current_manifest = McoSpreadsheet(self.controller, self)
+        self.current_manifest = McoSpreadsheet(ControllerView(self.controller, unit_name=self.unit_name, shipment_date=self.shipment_date), self)
         
         if not os.path.exists(self.current_manifest.spreadsheet):
             self.current_manifest.set_up_manifest()
@@ -4467,7 +6798,7 @@ class McoBatchDeposit(Shipment):
                 messagebox.showwarning(title='WARNING', message='Batch has already been moved to MCO dropbox.', master=self)
                 return
             else:
-                self.move_batch(batch)
+                self.queue_move_batch(batch)
                 
         elif len(self.batches) > 1:
             McoBatchPicker(self, self.controller)
@@ -4476,35 +6807,54 @@ class McoBatchDeposit(Shipment):
             messagebox.showwarning(title='WARNING', message='No batches have been prepared for this shipment.', master=self)
             return
             
+    def queue_move_batch(self, batch_no):
+        #moving a batch can take hours; run it as a background job
+        self.controller.jobs.submit('MCO move: {} {} batch {}'.format(self.unit_name, self.shipment_date, batch_no), self.move_batch, batch_no)
+    
     def move_batch(self, batch_no):
         
-        if batch_no == '':
-            messagebox.showwarning(title='WARNING', message='Select a batch from this shipment to move to the MCO dropbox', master=self)
-            return
-        else:
-            #set up our batch resources: assign variables to current_batch_list and MCO manifest
-            self.new_batch(batch_no)
+        #set up our batch resources: assign variables to current_batch_list and MCO manifest
+        self.new_batch(batch_no)
         
         #Exit function if there are no files to move.
         if len(self.mco_status_db[self.current_batch_list]) == 0:
-            messagebox.showwarning(title='Empty Batch', message='No files associated with batch # {}. Verify target file formats and run batch preparation again, if necessary.'.format(batch_no))
+            self.controller.alert('Empty Batch', 'No files associated with batch # {}. Verify target file formats and run batch preparation again, if necessary.'.format(batch_no))
             return
             
         print('\nMoving files (batch {}) to {}...'.format(self.current_batch_no, self.mco_destination))
         
-        #now loop through our list of files and copy to MCO destination
+        #now loop through our list of files and get their MCO destinations
+        transfers = []
         for file in self.mco_status_db[self.current_batch_list]:
             
             #check to see if this is a list, which will consist of wav and structure_xml files
             if isinstance(file, list):
                 #copy wav file
-                self.copy_content(file[0])
+                transfers.append((file[0], self.mco_file_path(file[0])))
                 
                 #copy structure_xml file
-                self.copy_content(file[1], file[0])
+                transfers.append((file[1], self.mco_file_path(file[1], file[0])))
             
             else:
-                self.copy_content(file)
+                transfers.append((file, self.mco_file_path(file)))
+        
+        #copy files over several SFTP sessions; partial copies from an earlier attempt are resumed
+        transfer_pool = self.mco_client.transfer_pool(self.mco_sessions)
+        try:
+            for file, status, msg in transfer_pool.upload_all(transfers):
+                if status:
+                    if file in self.mco_status_db[self.failed_move_list]:
+                        self.mco_status_db[self.failed_move_list].remove(file)
+                    print('\n\t{} ... Success! {}'.format(file, msg))
+                else:
+                    if not file in self.mco_status_db[self.failed_move_list]:
+                        self.mco_status_db[self.failed_move_list].append(file)
+                    print('\n\t{} ... Operation failed :( {}'.format(file, msg))
+                
+                self.controller.checkpoint()
+        finally:
+            transfer_pool.close()
+            self.mco_status_db.sync()
         
         #if no failures, copy over our manifest
         if len(self.mco_status_db[self.failed_move_list]) == 0:
@@ -4516,7 +6866,7 @@ class McoBatchDeposit(Shipment):
             self.mco_status_db['moved_batches'].append(self.current_batch_no)
             self.mco_status_db.sync()
             
-            messagebox.showinfo(title='Batch Complete', message='Batch {} has been successfully moved.  Move next batch after this one has completed MCO ingest.'.format(self.current_batch_no))
+            self.controller.alert('Batch Complete', 'Batch {} has been successfully moved.  Move next batch after this one has completed MCO ingest.'.format(self.current_batch_no), kind='info')
         
         else:
             if len(self.mco_status_db[self.failed_move_list]) == 1:
@@ -4524,9 +6874,9 @@ class McoBatchDeposit(Shipment):
             else:
                 fail_message = '{} files'.format(len(self.mco_status_db[self.failed_move_list]))
                 
-            messagebox.showwarning(title='Batch Failed', message='{} failed to copy to the MCO dropbox. Make sure content is in shipment directory and try again.'.format(fail_message))         
+            self.controller.alert('Batch Failed', '{} failed to copy to the MCO dropbox. Make sure content is in shipment directory and try again.'.format(fail_message))
     
-    def copy_content(self, file, parent_audio=None):
+    def mco_file_path(self, file, parent_audio=None):
         #get path where file will be copied in MCO destination
         
         if parent_audio is None:
@@ -4537,20 +6887,8 @@ class McoBatchDeposit(Shipment):
               
         #set up destination filename
         mco_dir = '{}/{}'.format(self.mco_destination, dir_path)
-        mco_file = '{}/{}'.format(mco_dir, os.path.basename(file))
-        
-        #make needed folders in mco dropbox
-        self.mco_client.make_dirs(mco_dir)
-        
-        print('\n\t{}'.format(file), end='')
         
-        #copy file to destination; note failure upon exception
-        try:
-            self.mco_client.sftp.put(file, mco_file)
-            print(' ... Success!')
-        except:
-            self.mco_status_db[self.failed_move_list].append(file)
-            print(' ... Operation failed :(')
+        return '{}/{}'.format(mco_dir, os.path.basename(file))
 
 class McoBatchPicker(tk.Toplevel):
     def __init__(self, parent, controller):
@@ -4604,8 +6942,12 @@ class McoBatchPicker(tk.Toplevel):
     
     def launch_move(self):
     
+        if self.selected_batch.get() == '':
+            messagebox.showwarning(title='WARNING', message='Select a batch from this shipment to move to the MCO dropbox', master=self)
+            return
+        
         #move selected batch
-        self.parent.move_batch(int(self.selected_batch.get()))
+        self.parent.queue_move_batch(int(self.selected_batch.get()))
         
         #update window
         self.update_batch_info()
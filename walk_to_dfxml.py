@@ -13,7 +13,7 @@
 
 """Walk current directory, writing DFXML to stdout."""
 
-__version__ = "0.3.0"
+__version__ = "0.4.0"
 
 import os
 import stat
@@ -22,16 +22,91 @@ import argparse
 import traceback
 import logging
 import sys
+import heapq
+import collections
+import concurrent.futures
 
 _logger = logging.getLogger(os.path.basename(__file__))
 
 import Objects
 
-def filepath_to_fileobject(filepath, args):
+def walk_entries(top):
+    """Yield (filepath, os.DirEntry) for everything under top (not including top), in sorted filepath order.
+
+    Directories are listed with os.scandir as the walk reaches them, so callers can start on the first files before the walk is finished.  A heap keeps the output in the same order as sorting the complete list of paths: every path under a directory sorts after the directory itself, so a directory's contents can be added to the heap when the directory comes off it."""
+    heap = []
+
+    def _push_contents(dirpath):
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    heapq.heappush(heap, (os.path.join(dirpath, entry.name), entry))
+        except OSError as e:
+            _logger.warning("Unable to list directory %r: %s" % (dirpath, e))
+
+    _push_contents(top)
+    while heap:
+        (filepath, entry) = heapq.heappop(heap)
+        yield (filepath, entry)
+        #Like os.walk, don't descend into symlinked directories.
+        if entry.is_dir(follow_symlinks=False):
+            _push_contents(filepath)
+
+def hash_filepath(filepath, chunk_size=2**22):
+    """Return (md5, sha512, error) for a regular file.  The digests are None if the file could not be read through.  Run in worker processes when --jobs is more than 1."""
+    md5obj = hashlib.md5()
+    sha512obj = hashlib.sha512()
+    error = None
+    try:
+        with open(filepath, "rb") as in_fh:
+            while True:
+                buf = b""
+                try:
+                    buf = in_fh.read(chunk_size)
+                except Exception as e:
+                    error = "".join(traceback.format_stack())
+                    if e.args:
+                        error += "\n" + str(e.args)
+                    buf = b""
+                if buf == b"":
+                    break
+
+                md5obj.update(buf)
+                sha512obj.update(buf)
+    except Exception as e:
+        if error is None:
+            error = ""
+        else:
+            error += "\n"
+        error += "".join(traceback.format_stack())
+        if e.args:
+            error += "\n" + str(e.args)
+
+    if error is None:
+        return (md5obj.hexdigest(), sha512obj.hexdigest(), None)
+    return (None, None, error)
+
+def apply_hashes(fobj, hash_result):
+    (md5, sha512, error) = hash_result
+    if error is None:
+        fobj.md5 = md5
+        fobj.sha512 = sha512
+    else:
+        fobj.error = error
+
+def filepath_to_fileobject(filepath, args, entry=None, hash_now=True):
+    """Build a FileObject for filepath.  If entry (an os.DirEntry from walk_entries) is given, its cached type information and stat are used instead of checking the path again.  With hash_now=False, the caller is responsible for hashing regular files (see apply_hashes)."""
     fobj = Objects.FileObject()
 
     #Determine type - done in three steps.
-    if os.path.islink(filepath):
+    if entry is not None:
+        if entry.is_symlink():
+            fobj.name_type = "l"
+        elif entry.is_dir():
+            fobj.name_type = "d"
+        elif entry.is_file():
+            fobj.name_type = "r"
+    elif os.path.islink(filepath):
         fobj.name_type = "l"
     elif os.path.isdir(filepath):
         fobj.name_type = "d"
@@ -42,7 +117,9 @@ def filepath_to_fileobject(filepath, args):
         pass
 
     #Prime fileobjects from Stat data (lstat for soft links).
-    if fobj.name_type == "l":
+    if entry is not None:
+        sobj = entry.stat(follow_symlinks=(fobj.name_type != "l"))
+    elif fobj.name_type == "l":
         sobj = os.lstat(filepath)
     else:
         sobj = os.stat(filepath)
@@ -69,62 +146,48 @@ def filepath_to_fileobject(filepath, args):
 
     if fobj.name_type == "l":
         fobj.link_target = os.readlink(filepath)
-    if not args.n:
+    if not args.n and hash_now:
         #Add hashes for regular files.
         if fobj.name_type == "r":
-            try:
-                with open(filepath, "rb") as in_fh:
-                    chunk_size = 2**22
-                    md5obj = hashlib.md5()
-                    sha512obj = hashlib.sha512()
-                    any_error = False
-                    while True:
-                        buf = b""
-                        try:
-                            buf = in_fh.read(chunk_size)
-                        except Exception as e:
-                            any_error = True
-                            fobj.error = "".join(traceback.format_stack())
-                            if e.args:
-                                fobj.error += "\n" + str(e.args)
-                            buf = b""
-                        if buf == b"":
-                            break
-
-                        md5obj.update(buf)
-                        sha512obj.update(buf)
-
-                    if not any_error:
-                        fobj.md5 = md5obj.hexdigest()
-                        fobj.sha512 = sha512obj.hexdigest()
-            except Exception as e:
-                if fobj.error is None:
-                    fobj.error = ""
-                else:
-                    fobj.error += "\n"
-                fobj.error += "".join(traceback.format_stack())
-                if e.args:
-                    fobj.error += "\n" + str(e.args)
+            apply_hashes(fobj, hash_filepath(filepath))
     return fobj
 
-def main(args_):
-    #Determine whether we're going in threading mode or not.  (Some modules are not available by default.)
-    args = parse_args(args_)
-    using_threading = False
-    if args.jobs > 1:
-        using_threading = True  #(unless supporting modules are absent)
-        try:
-            import threading
-        except:
-            using_threading = False
-            _logger.warning("Threading support not available.  Running in single thread only.")
-
-        try:
-            import queue
-        except:
-            using_threading = False
-            _logger.warning("Python queue support not available.  (If running Ubuntu, this is in package python3-queuelib.)  Running in single thread only.")
-
+def fileobjects(top, args):
+    """Yield FileObjects for top and everything under it, in sorted filepath order.
+
+    With more than one job, regular files are hashed on a process pool (hashing in threads is held back by the GIL).  FileObjects wait in a bounded reorder buffer until their hashes are in, so output keeps streaming in order while files further along are still being hashed, and memory use doesn't grow with the number of files."""
+    if args.jobs <= 1 or args.n:
+        yield filepath_to_fileobject(top, args)
+        for (filepath, entry) in walk_entries(top):
+            yield filepath_to_fileobject(filepath, args, entry)
+        return
+
+    buffer_size = args.buffer or args.jobs * 8
+    pending = collections.deque()
+
+    def _finish(fobj, future):
+        if future is not None:
+            apply_hashes(fobj, future.result())
+        return fobj
+
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        pending.append((filepath_to_fileobject(top, args), None))
+        for (filepath, entry) in walk_entries(top):
+            fobj = filepath_to_fileobject(filepath, args, entry, hash_now=False)
+            future = None
+            if fobj.name_type == "r":
+                future = executor.submit(hash_filepath, filepath)
+            pending.append((fobj, future))
+
+            #Once the buffer is full, wait on the oldest entry; the pool keeps working on the rest.
+            while len(pending) >= buffer_size:
+                yield _finish(*pending.popleft())
+
+        while pending:
+            yield _finish(*pending.popleft())
+
+def write_dfxml(top, output_fh, args):
+    """Stream DFXML for top to output_fh, one fileobject at a time."""
     dobj = Objects.DFXMLObject(version="1.1.1")
     dobj.program = sys.argv[0]
     dobj.program_version = __version__
@@ -134,75 +197,31 @@ def main(args_):
     dobj.add_creator_library("Objects.py", Objects.__version__)
     dobj.add_creator_library("dfxml.py", Objects.dfxml.__version__)
 
-    filepaths = set()
-    #filepaths.add("\\\\?\\C:\\temp")
-    #for (dirpath, dirnames, filenames) in os.walk("\\\\?\\C:\\temp"):
-    filepaths.add(".")
-    for (dirpath, dirnames, filenames) in os.walk("."):
-        dirent_names = set()
-        for dirname in dirnames:
-            dirent_names.add(dirname)
-        for filename in filenames:
-            dirent_names.add(filename)
-        for dirent_name in sorted(dirent_names):
-            #The relpath wrapper removes "./" from the head of the path.
-            #filepath = os.path.relpath(os.path.join(dirpath, dirent_name))
-            filepath = os.path.join(dirpath, dirent_name)
-            filepaths.add(filepath)
-            
-
-    fileobjects_by_filepath = dict()
-
-    if using_threading:
-        #Threading syntax c/o: https://docs.python.org/3.5/library/queue.html
-        q = queue.Queue()
-        threads = []
-
-        def _worker():
-            while True:
-                filepath = q.get()
-                if filepath is None:
-                    break
-                fobj = filepath_to_fileobject(filepath, args)
-                fileobjects_by_filepath[filepath] = fobj
-                q.task_done()
-
-        for i in range(args.jobs):
-            t = threading.Thread(target=_worker)
-            t.start()
-            threads.append(t)
-
-        for filepath in filepaths:
-            q.put(filepath)
-
-        # block until all tasks are done
-        q.join()
-
-        # stop workers
-        for i in range(args.jobs):
-            q.put(None)
-        for t in threads:
-            t.join()
-    else: #Not threading.
-        for filepath in sorted(filepaths):
-            fobj = filepath_to_fileobject(filepath, args)
-            fileobjects_by_filepath[filepath] = fobj
-
-    #Build output DFXML tree.
-    for filepath in sorted(fileobjects_by_filepath.keys()):
-        dobj.append(fileobjects_by_filepath[filepath])
-    return dobj.to_dfxml()
+    #Serialize the document without fileobjects, and write the fileobjects in before the closing tag.
+    document = dobj.to_dfxml()
+    closing = document.rindex("</dfxml>")
+    output_fh.write(document[:closing])
+    for fobj in fileobjects(top, args):
+        output_fh.write(fobj.to_dfxml())
+        output_fh.write("\n")
+    output_fh.write(document[closing:])
+
+def main(args_):
+    args = parse_args(args_)
+    write_dfxml(".", sys.stdout, args)
+
 def parse_args(args_):
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--debug", action="store_true")
     parser.add_argument("-n", action="store_true", help="Do not calculate any hashes")
-    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of file-processing threads to run.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of file-hashing processes to run.")
+    parser.add_argument("--buffer", type=int, default=0, help="Number of fileobjects held while waiting on hashes when running multiple jobs (default: 8 per job).")
     args = parser.parse_args(args_)
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
 
     if args.jobs <= 0:
-        raise ValueError("If requesting multiple jobs, please request 1 or more worker threads.")
+        raise ValueError("If requesting multiple jobs, please request 1 or more worker processes.")
     return args
 if __name__ == "__main__":
     main(sys.argv[1:])